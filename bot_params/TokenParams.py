@@ -16,6 +16,11 @@ class TokenParams:
         self.maxBorrowUSDForToken = None
         self.maxLendUSDForToken = None
         self.maxLimitOrdersPerSide = None
+        self.quoteToleranceTicks = None  # Optional: quote diffing instead of cancel & resend every loop
+        self.wakeOnUpdates = False  # Optional: loop on market data changes, with botSpeed as the maximum rate
+        self.ladderLevels = 1  # Optional: number of limit orders quoted per side, each further from the reference rate
+        self.ladderOffsetStepBPS = 0  # Optional: extra rate offset of each level after the first
+        self.ladderSizeUSD = None  # Optional: order size of each level after the first (orderSizeUSD if None)
         self.tenors = None
 
     def __str__(self):
@@ -32,6 +37,11 @@ class TokenParams:
             + f'orderBookMaxUSD:\t\t\t{self.orderBookMaxUSD}\n' \
             + f'maxBorrowUSDForToken:\t\t\t{self.maxBorrowUSDForToken}\n' \
             + f'maxLendUSDForToken:\t\t\t{self.maxLendUSDForToken}\n' \
+            + f'quoteToleranceTicks:\t\t\t{self.quoteToleranceTicks}\n' \
+            + f'wakeOnUpdates:\t\t\t{self.wakeOnUpdates}\n' \
+            + f'ladderLevels:\t\t\t{self.ladderLevels}\n' \
+            + f'ladderOffsetStepBPS:\t\t\t{self.ladderOffsetStepBPS}\n' \
+            + f'ladderSizeUSD:\t\t\t{self.ladderSizeUSD}\n' \
             + f'tenors:\t\t\t{self.tenors}\n'
 
     def set_from_all_params(self, all_params):
@@ -58,6 +68,16 @@ class TokenParams:
             self.maxLendUSDForToken = all_params['maxLendUSDForToken']
         if 'maxLimitOrdersPerSide' in all_params:
             self.maxLimitOrdersPerSide = all_params['maxLimitOrdersPerSide']
+        if 'quoteToleranceTicks' in all_params:
+            self.quoteToleranceTicks = all_params['quoteToleranceTicks']
+        if 'wakeOnUpdates' in all_params:
+            self.wakeOnUpdates = bool(all_params['wakeOnUpdates'])
+        if 'ladderLevels' in all_params:
+            self.ladderLevels = all_params['ladderLevels']
+        if 'ladderOffsetStepBPS' in all_params:
+            self.ladderOffsetStepBPS = all_params['ladderOffsetStepBPS']
+        if 'ladderSizeUSD' in all_params:
+            self.ladderSizeUSD = all_params['ladderSizeUSD']
         if 'tenors' in all_params:
             self.tenors = all_params['tenors']
 
@@ -85,6 +105,16 @@ class TokenParams:
             self.maxLendUSDForToken = this_token_params['maxLendUSDForToken']
         if 'maxLimitOrdersPerSide' in this_token_params:
             self.maxLimitOrdersPerSide = this_token_params['maxLimitOrdersPerSide']
+        if 'quoteToleranceTicks' in this_token_params:
+            self.quoteToleranceTicks = this_token_params['quoteToleranceTicks']
+        if 'wakeOnUpdates' in this_token_params:
+            self.wakeOnUpdates = bool(this_token_params['wakeOnUpdates'])
+        if 'ladderLevels' in this_token_params:
+            self.ladderLevels = this_token_params['ladderLevels']
+        if 'ladderOffsetStepBPS' in this_token_params:
+            self.ladderOffsetStepBPS = this_token_params['ladderOffsetStepBPS']
+        if 'ladderSizeUSD' in this_token_params:
+            self.ladderSizeUSD = this_token_params['ladderSizeUSD']
         if 'tenors' in this_token_params:
             self.tenors = this_token_params['tenors']
         # Then check that nothing is missing
@@ -119,5 +149,16 @@ class TokenParams:
             raise Exception('No USD max lend for token ' + self.token)
         if self.maxLimitOrdersPerSide is None:
             raise Exception('No max limit orders per side for token ' + self.token)
+        if self.quoteToleranceTicks is not None and self.quoteToleranceTicks < 0:
+            raise Exception('Negative quote tolerance ticks for token ' + self.token)
+        if self.wakeOnUpdates and self.quoteToleranceTicks is None:  # Would send new orders, so wake, on every loop
+            raise Exception('wakeOnUpdates without quoteToleranceTicks for token ' + self.token)
+        if self.ladderLevels is None or self.ladderLevels < 1:
+            raise Exception(f'Invalid ladder levels ({self.ladderLevels}) for token {self.token}')
+        if self.ladderLevels > self.maxLimitOrdersPerSide:
+            raise Exception(f'More ladder levels ({self.ladderLevels}) than max limit orders per side '
+                            + f'({self.maxLimitOrdersPerSide}) for token {self.token}')
+        if self.ladderOffsetStepBPS is None or self.ladderOffsetStepBPS < 0:
+            raise Exception('Negative ladder offset step for token ' + self.token)
         if self.tenors is None:
             raise Exception('No tenor specified for token ' + self.token)
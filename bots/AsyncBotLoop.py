@@ -0,0 +1,43 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from threading import Thread
+
+
+class AsyncBotLoop:
+
+    def __init__(self, max_workers=None, start_loop=True):
+        self.loop = asyncio.new_event_loop()
+        # Blocking REST calls are run on a bounded pool rather than one thread per TokenBot
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='asyncBotWorker')
+        self.loop.set_default_executor(self.executor)
+        self.thread = Thread(name='asyncBotLoop', target=self.run_loop, daemon=True)
+        if start_loop:
+            self.start_loop()
+
+    def run_in_executor(self, func, *args):
+        return self.loop.run_in_executor(self.executor, func, *args)
+
+    def run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        logging.info('Async bot loop started')
+        self.loop.run_forever()
+
+    async def wait_for(self, event, timeout):
+        # asyncio.Event equivalent of threading.Event.wait(timeout). Returns True if event is set.
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def start_loop(self):
+        if not self.thread.is_alive():
+            self.thread.start()
+
+    def stop_loop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown(wait=False)
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
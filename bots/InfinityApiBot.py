@@ -1,32 +1,40 @@
+from bots import InfinityWsFeed as Iwf
+from bots import OrderGateway as Og
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from constants import OrderSide as Osi
 from constants import OrderStatus as Ost
-from constants import RollOverTime as Rot
+from constants import OrderSyncMode as Osm
 from constants import Token
 import datetime as dt
 import logging
 import os
+from misc import BidAskCurve as Bac
+from misc import ChangeNotifier as Cn
+from misc import ExposureAggregator as Ea
+from misc import HttpTransport as Ht
+from misc import MarketDataBus as Mdb
+from misc import MarketRegistry as Mr
+from misc import MarketSnapshot as Ms
+from misc import MaturityCalendar as Mc
 from misc import MiscHelperFunctions as Mhf
+from misc import OrderStore as Ors
+from misc import RateBudget as Rb
+from misc import ReferenceDataCache as Rdc
+from misc import ResponseCache as Rc
+from misc import TickMath as Tm
+from misc import YieldCurve as Yc
 from infinity_exchange.rest_client import rest_client
-from threading import Thread
-from time import sleep
+from threading import Event, Lock, Thread
+import time
 import uuid
-
-
-def last_rollover_datetime():
-    current_utc_datetime = dt.datetime.utcnow()
-    if current_utc_datetime.time() > dt.time(Rot.HOUR, Rot.MINUTE, Rot.SECOND):
-        date_to_use = current_utc_datetime.date()
-    else:
-        date_to_use = current_utc_datetime.date() - dt.timedelta(days=1)
-    pass
-    datetime_to_use = dt.datetime.combine(date_to_use, dt.time(Rot.HOUR, Rot.MINUTE, Rot.SECOND))
-    return datetime_to_use.replace(tzinfo=dt.timezone.utc)
+import weakref
 
 
 class InfinityApiBot:
 
-    def __init__(self, verify, send_orders=True, cancel_orders=True, update_active_orders=True):
+    def __init__(self, verify, send_orders=True, cancel_orders=True, update_active_orders=True,
+                 rate_budget_buckets=None):
 
         self.cfg = Mhf.load_config_file_etc()
         self.bot_name = 'InfAPIBot'
@@ -36,7 +44,16 @@ class InfinityApiBot:
         self.domain = self.cfg['infinity_url']
         logging.info(self.domain)
         self.verify = verify
+        self.market_snapshot = None  # Published once __init__ has loaded all market data (see publish_market_snapshot)
+        self.market_snapshot_lock = Lock()
+        self.change_notifier = Cn.ChangeNotifier()  # Wakes TokenBots quoting from market data that has changed
+        self.maturity_calendar = Mc.MaturityCalendar()
+        # Per tick market calls shared by all TokenBots quoting the same market
+        self.response_cache = Rc.ResponseCache(self.cfg.get('response_cache_ttl_seconds', {
+            'floating_rate_market_details': 1.0,
+            'recent_fixed_rate_transactions': 1.0}))
         self.send_orders = send_orders
+        self.shared_send_orders = None  # Shard processes only: switched off by the coordinator (see is_sending_orders)
         self.cancel_orders = cancel_orders
 
         sys_env = self.domain[8:11]
@@ -56,141 +73,220 @@ class InfinityApiBot:
             private_key=os.getenv('PRIVATE_KEY'),
             verify_tls=self.verify,
             logger=None)
-        self.wallets = self.inf_rest.get_user_wallets()['wallets']
-        self.inf_rest._wallet_id = self.get_wallet_id()  # TODO - Do we want this starting with underscore? Do we want to set it within our code?
-        self.wallet_details = self.get_trading_wallet_details()
-
+        # Keep-alive connection pool shared by all bots. Grows with the number of TokenBots (see register_token_bot).
+        self.http_transport = Ht.HttpTransport(
+            self.cfg.get('http_pool_maxsize', 10), self.cfg.get('http_timeout_seconds', 10.0))
+        session = Ht.find_session(self.inf_rest)
+        if session is not None:
+            self.http_transport.attach(session)
+        else:
+            logging.warning('No requests session found on the REST client - using its own HTTP connections')
+        # Every REST call waits for its endpoint class's (read/send/cancel) budget, shared fairly across TokenBots.
+        # rate_budget_buckets: buckets shared with other processes (see ShardCoordinator.create_rate_budget_buckets).
+        self.rate_budget = Rb.RateBudget(
+            self.cfg.get('rate_budget_per_second', {}), self.cfg.get('rate_budget_burst', {}), rate_budget_buckets)
+        self.inf_rest = Rb.RateLimitedClient(self.inf_rest, self.rate_budget)
+        self.reference_data_cache_path_filename = self.cfg.get('reference_data_cache_path_filename')
+        self.wallets = None
+        self.floating_market_details = None
         self.floating_markets = None
         self.floating_tokens_and_prices = None
-        self.get_floating_markets_tokens_and_prices()
-
         self.fixed_markets = None
         self.fixed_markets_last_updated = None
-        self.list_all_fixed_rate_markets()
-        self.active_floating_orders = {}
-        self.active_fixed_orders = {}
+        self.market_registry = Mr.MarketRegistry(None, None, None)
+        self.exposure_aggregator = Ea.ExposureAggregator(self.get_token_id_from_order)
+
+        reference_data = None
+        if self.reference_data_cache_path_filename:
+            reference_data = Rdc.load_reference_data(
+                self.reference_data_cache_path_filename, Mhf.get_last_rollover_datetime(), self.address, self.domain)
+        if reference_data is not None:  # Warm start. Verified against the API in the background.
+            logging.info(f'Using cached reference data from {self.reference_data_cache_path_filename}')
+            self.wallets = reference_data['wallets']
+            self.inf_rest._wallet_id = self.get_wallet_id()
+            self.wallet_details = self.get_trading_wallet_details()
+            self.set_floating_markets_tokens_and_prices(reference_data['floating_market_details'])
+            self.update_last_prices()  # Cached prices are stale
+            self.set_fixed_rate_markets(reference_data['fixed_markets'])
+            Thread(name='referenceDataCheck', target=self.verify_cached_reference_data, daemon=True).start()
+        else:
+            self.wallets = self.inf_rest.get_user_wallets()['wallets']
+            self.inf_rest._wallet_id = self.get_wallet_id()  # TODO - Do we want this starting with underscore? Do we want to set it within our code?
+            self.wallet_details = self.get_trading_wallet_details()
+            self.get_floating_markets_tokens_and_prices()
+            self.list_all_fixed_rate_markets()
+        self.active_floating_orders = Ors.OrderStore()
+        self.active_fixed_orders = Ors.OrderStore()
+        self.active_floating_orders.add_listener(self.exposure_aggregator)
+        self.active_fixed_orders.add_listener(self.exposure_aggregator)
+        self.active_floating_orders.add_listener(self.change_notifier)
+        self.active_fixed_orders.add_listener(self.change_notifier)
+        self.active_orders_sync_mode = self.cfg.get('active_orders_sync_mode', Osm.FULL)
+        self.active_orders_full_sync_every_n_updates = self.cfg.get('active_orders_full_sync_every_n_updates', 60)
+        self.n_active_orders_updates = 0
+        self.active_orders_sync_states = {
+            True: {'last_seen_order_id': None, 'pending_order_ids': []},  # FLOATING
+            False: {'last_seen_order_id': None, 'pending_order_ids': []}}  # FIXED
+        self.last_active_orders_drift = {}
+        self.active_orders_as_of_time = 0.0  # time.time() the active orders were last taken from the API or feed
         self.ok_to_update_active_orders = update_active_orders
         if self.ok_to_update_active_orders:
             self.update_active_orders()
+        self.yield_curve_fit_method = self.cfg.get('yield_curve_fit_method', Yc.LINEAR)
+        self.yield_curve_decay_days = self.cfg.get('yield_curve_decay_days', 90)
+        self.last_floating_rates = {}  # token id -> floating rate
+        self.last_fixed_trade_rates = {}  # token id -> {days to maturity: rate of most recent trade}
+        self.yield_curve_input_versions = {}  # token id -> bumped whenever any input to its yield curve changes
+        self.yield_curves = {}  # token id -> (input version, fitted YieldCurve)
         self.bid_ask_last_rates = {}
+        self.bid_ask_curves = {}
         self.update_bid_ask_last_rates()
         self.cancelled_floating_orders = deque([], maxlen=1000)
         self.cancelled_fixed_orders = deque([], maxlen=10000)
+        self.cancel_pool_max_workers = self.cfg.get('cancel_pool_max_workers', 8)
+        self.cancel_pool = ThreadPoolExecutor(max_workers=self.cancel_pool_max_workers, thread_name_prefix='cancel')
+        # Optional. Sends & cancels are then queued and sent by the gateway's own workers, cancels first.
+        self.order_gateway = None
+        if self.cfg.get('order_gateway_workers', 0) > 0:
+            self.order_gateway = Og.OrderGateway(self, self.cfg['order_gateway_workers'])
+        self.account_ledger = None  # Shard processes only: account limits shared with the other shards
+        self.market_data_bus = None  # Market data for other local processes (see start_market_data_bus)
+        self.token_bots = weakref.WeakSet()  # Re-mapped to their new fixed markets on rollover
+        self.rollover_retry_seconds = self.cfg.get('rollover_retry_seconds', 10)
+
+        # Streaming market data (optional). REST polling in run_loop is used whenever the feed is not connected.
+        self.refresh_now_event = Event()
+        self.ws_feed_resync_needed = False
+        self.ws_feed = None
+        if self.cfg.get('infinity_ws_url'):
+            self.ws_feed = Iwf.InfinityWsFeed(
+                self,
+                self.cfg['infinity_ws_url'],
+                self.cfg.get('ws_feed_reconnect_seconds', 5),
+                self.cfg.get('ws_feed_ping_interval_seconds', 30))
+        self.publish_market_snapshot(True)
+
+    def apply_bid_ask_update(self, token_id, bid_ask, publish_snapshot=True):
+        self.bid_ask_last_rates[token_id] = bid_ask
+        if token_id not in self.bid_ask_curves or not self.bid_ask_curves[token_id].is_same_data(bid_ask):
+            self.bid_ask_curves[token_id] = Bac.BidAskCurve(bid_ask)
+            self.invalidate_yield_curve(token_id)
+            self.change_notifier.mark_changed([Cn.get_token_key(token_id)])
+            if publish_snapshot:
+                self.publish_market_snapshot()
+
+    def apply_order_updates(self, orders, is_floating_market):
+        if is_floating_market:
+            active_orders = self.active_floating_orders
+        else:
+            active_orders = self.active_fixed_orders
+        self.active_orders_as_of_time = time.time()
+        for order in orders:
+            if order['status'] == Ost.STATUS_ON_BOOK:
+                active_orders.add(order)
+            else:  # Filled, cancelled or expired
+                active_orders.remove(order['orderId'])
+        self.publish_market_snapshot()
+
+    def apply_price_updates(self, tokens):
+        floating_tokens_and_prices = dict(self.floating_tokens_and_prices)
+        new_token_or_code = False
+        for token in tokens:
+            if token['tokenId'] in floating_tokens_and_prices:
+                old_token = floating_tokens_and_prices[token['tokenId']]
+                floating_tokens_and_prices[token['tokenId']] = {**old_token, **token}
+                new_token_or_code = new_token_or_code or ('code' in token and token['code'] != old_token['code'])
+            else:
+                floating_tokens_and_prices[token['tokenId']] = token
+                new_token_or_code = True
+        self.mark_prices_changed(self.floating_tokens_and_prices, floating_tokens_and_prices)
+        self.floating_tokens_and_prices = floating_tokens_and_prices
+        if new_token_or_code:
+            self.rebuild_market_registry()
+        self.exposure_aggregator.update_prices(floating_tokens_and_prices)
+        self.publish_market_snapshot()
+
+    def cancel_all_orders(self, wallet_id=None, market_id=None):
+        # Cancels every active floating and fixed order (optionally only for one wallet and/or market), with both
+        # order types cancelled at the same time. Returns {order_id: True if cancelled}.
+        order_ids = {True: [], False: []}
+        for is_floating_market in order_ids:
+            for order in self.active_floating_orders if is_floating_market else self.active_fixed_orders:
+                if (wallet_id is None or order.get('walletId', wallet_id) == wallet_id) \
+                        and (market_id is None or order['marketId'] == market_id):
+                    order_ids[is_floating_market].append(order['orderId'])
+        results = {}
+        # Straight to the exchange, not behind anything queued in the order gateway
+        floating_thread = Thread(target=lambda: results.update(self.cancel_orders_batch_now(order_ids[True], True)))
+        floating_thread.start()
+        fixed_results = self.cancel_orders_batch_now(order_ids[False], False)
+        floating_thread.join()
+        results.update(fixed_results)
+        return results
 
     def cancel_fixed_order(self, order_id):
-        if self.cancel_orders:
-            if order_id not in self.cancelled_fixed_orders:
-                self.cancelled_fixed_orders.append(order_id)
-                self.inf_rest.cancel_fixed_rate_order_by_order_id(order_id)
+        return self.cancel_orders_batch([order_id], False).get(order_id, False)
 
     def cancel_floating_order(self, order_id):
-        if self.cancel_orders:
-            if order_id not in self.cancelled_floating_orders:
-                self.cancelled_floating_orders.append(order_id)
-                self.inf_rest.cancel_floating_rate_order_by_order_id(order_id)
+        return self.cancel_orders_batch([order_id], True).get(order_id, False)
 
-    def check_if_all_fixed_rate_market_dates_look_ok(self):
+    def cancel_order(self, order_id, is_floating_market, client_id=None):
+        try:
+            with self.rate_budget.as_client(client_id):  # Queued as the caller, not as the cancel pool thread
+                if is_floating_market:
+                    self.inf_rest.cancel_floating_rate_order_by_order_id(order_id)
+                else:
+                    self.inf_rest.cancel_fixed_rate_order_by_order_id(order_id)
+            return True
+        except Exception as e:
+            logging.warning(f'Error {e} - Cannot cancel order {order_id}')
+            return False
+
+    def cancel_orders_batch(self, order_ids, is_floating_market):
+        # Waits for the cancels even when going through the order gateway, so callers see the book without them
+        if self.order_gateway is not None and not self.order_gateway.is_worker_thread():
+            return self.order_gateway.submit_cancels(order_ids, is_floating_market).result()
+        return self.cancel_orders_batch_now(order_ids, is_floating_market)
+
+    def cancel_orders_batch_now(self, order_ids, is_floating_market):
+        # Cancels the orders concurrently on cancel_pool. Returns {order_id: True if cancelled}, for the orders sent.
+        # Orders already cancelled by us are skipped. Local state is updated once for the whole batch.
+        if not self.cancel_orders:
+            return {}
+        cancelled_orders = self.cancelled_floating_orders if is_floating_market else self.cancelled_fixed_orders
+        active_orders = self.active_floating_orders if is_floating_market else self.active_fixed_orders
+        order_ids = [order_id for order_id in dict.fromkeys(order_ids) if order_id not in cancelled_orders]
+        if len(order_ids) == 0:
+            return {}
+        cancelled_orders.extend(order_ids)
+        if len(order_ids) == 1:  # Not worth a round trip through the pool
+            results = {order_ids[0]: self.cancel_order(order_ids[0], is_floating_market)}
+        else:
+            results = dict(zip(order_ids, self.cancel_pool.map(
+                self.cancel_order, order_ids, [is_floating_market] * len(order_ids),
+                [self.rate_budget.get_client_id()] * len(order_ids))))
+        active_orders.remove_many([order_id for order_id, is_cancelled in results.items() if is_cancelled])
+        self.publish_market_snapshot()
+        for order_id, is_cancelled in results.items():
+            if not is_cancelled and order_id in cancelled_orders:  # Allow it to be retried
+                cancelled_orders.remove(order_id)
+        return results
+
+    def check_if_all_fixed_rate_market_dates_look_ok(self, fixed_markets=None):
+        if fixed_markets is None:
+            fixed_markets = self.fixed_markets
         result = True
-        for token_id in self.fixed_markets:
-            if len(self.fixed_markets[token_id]) > 0:
-                for fixed_market in self.fixed_markets[token_id]:
+        for token_id in fixed_markets:
+            if len(fixed_markets[token_id]) > 0:
+                for fixed_market in fixed_markets[token_id]:
                     this_maturity_date = dt.datetime.utcfromtimestamp(fixed_market['maturityDate']/1000).date()
                     expected_maturity_date =\
-                        Mhf.convert_tenor_to_date(
-                            str(fixed_market['daysToMaturity']) + 'D',
-                            dt.datetime.now(dt.timezone.utc))
+                        self.maturity_calendar.get_date(str(fixed_market['daysToMaturity']) + 'D')
                     result = result and this_maturity_date == expected_maturity_date
         return result
 
-    def find_active_orders_by_wallet_and_market(self, market_id=None, floating_only=False, fixed_only=False):
-        active_orders = []
-
-        # FLOATING
-        if not fixed_only:
-            for order in self.active_floating_orders:
-                if market_id is None:
-                    active_orders.append(order)
-                    pass
-                else:
-                    if order['marketId'] == market_id:
-                        active_orders.append(order)
-                    pass
-
-        # FIXED
-        if not floating_only:
-            for order in self.active_fixed_orders:
-                if market_id is None:
-                    active_orders.append(order)
-                    pass
-                else:
-                    if order['marketId'] == market_id:
-                        active_orders.append(order)
-                    pass
-        return active_orders
-
-    def get_all_floating_and_fixed_order_position_quantities(self):
-        borrow_order_positions_by_token = {}
-        lend_order_positions_by_token = {}
-
-        borrow_order_positions_by_token, lend_order_positions_by_token = self.process_orders(
-            borrow_order_positions_by_token, lend_order_positions_by_token, self.active_floating_orders)
-        borrow_order_positions_by_token, lend_order_positions_by_token = self.process_orders(
-            borrow_order_positions_by_token, lend_order_positions_by_token, self.active_fixed_orders)
-
-        return borrow_order_positions_by_token, lend_order_positions_by_token
-
-    def get_best_bid_ask(self, token, is_floating_market, days_to_maturity=0, min_bid_n_ask_size=0):
-        try:
-            token_id = self.get_token_id_from_floating_tokens(token)
-
-            if len(self.bid_ask_last_rates[token_id]) == 0:
-                return None, None
-
-            if is_floating_market:
-                return float(self.bid_ask_last_rates[token_id]['ir']['bid']), \
-                    float(self.bid_ask_last_rates[token_id]['ir']['ask'])
-            else:
-                while True:
-                    i = 0
-
-                    while self.bid_ask_last_rates[token_id]['fr'][i]['daysToMaturity'] < days_to_maturity:
-                        i = i + 1
-
-                    if self.bid_ask_last_rates[token_id]['fr'][i]['daysToMaturity'] > days_to_maturity:
-                        logging.fatal(f'Error - days to maturity ({days_to_maturity}) not found.')
-                        os._exit(1)
-
-                    if 'bid' not in self.bid_ask_last_rates[token_id]['fr'][i]\
-                            or 'ask' not in self.bid_ask_last_rates[token_id]['fr'][i]:
-                        floating_bid, floating_ask = \
-                            self.get_best_bid_ask(token, True, 0, min_bid_n_ask_size)
-
-                    if 'bid' in self.bid_ask_last_rates[token_id]['fr'][i]:
-                        bid = float(self.bid_ask_last_rates[token_id]['fr'][i]['bid'])
-                    else:
-                        if 'ask' in self.bid_ask_last_rates[token_id]['fr'][i]:
-                            bid = max(float(
-                                self.bid_ask_last_rates[token_id]['fr'][i]['ask']) - 0.0001, 0.0001)
-                        else:
-                            bid = floating_bid
-
-                    if 'ask' in self.bid_ask_last_rates[token_id]['fr'][i]:
-                        ask = float(self.bid_ask_last_rates[token_id]['fr'][i]['ask'])
-                    else:
-                        if 'bid' in self.bid_ask_last_rates[token_id]['fr'][i]:
-                            ask = float(
-                                self.bid_ask_last_rates[token_id]['fr'][i]['bid']) + 0.0001
-                        else:
-                            ask = floating_ask
-
-                    if self.bid_ask_last_rates[token_id]['fr'][i]['daysToMaturity'] == days_to_maturity:
-                        return bid, ask
-
-        except Exception as e:
-            logging.fatal(f'Error {e} - Cannot get best bid & ask')
-            os._exit(1)
-
-    def get_current_positions_and_orders_in_usd(self, token_id):
+    def compute_current_positions_and_orders_in_usd(self, token_id):
+        # Full recompute of get_current_positions_and_orders_in_usd, for reconciling the exposure aggregator
         token_total_borrow_usd = 0.0
         token_total_lend_usd = 0.0
         wallet_total_borrow_usd = 0.0
@@ -199,7 +295,7 @@ class InfinityApiBot:
             self.get_all_floating_and_fixed_order_position_quantities()
         for this_token_id in self.floating_tokens_and_prices:
             if self.floating_tokens_and_prices[this_token_id]['tokenType'] != Token.TOKEN_TYPE_ERC20:
-                break
+                continue
             this_price = float(self.floating_tokens_and_prices[this_token_id]['price'])
             this_borrow_order_position = 0.0
             this_lend_order_position = 0.0
@@ -209,45 +305,73 @@ class InfinityApiBot:
             if self.floating_tokens_and_prices[this_token_id]['code'] in lend_order_positions:
                 this_lend_order_position = \
                     float(lend_order_positions[self.floating_tokens_and_prices[this_token_id]['code']])
-            wallet_total_borrow_usd = \
-                wallet_total_borrow_usd + max(0.0, this_borrow_order_position) * this_price \
-                + this_borrow_order_position * this_price
-            wallet_total_lend_usd = \
-                wallet_total_lend_usd - min(0.0, this_lend_order_position) * this_price \
-                + this_lend_order_position * this_price
+            this_borrow_usd = Ea.get_borrow_usd(this_borrow_order_position, this_price)
+            this_lend_usd = Ea.get_lend_usd(this_lend_order_position, this_price)
+            wallet_total_borrow_usd = wallet_total_borrow_usd + this_borrow_usd
+            wallet_total_lend_usd = wallet_total_lend_usd + this_lend_usd
 
             if this_token_id == token_id:
-                token_total_borrow_usd = \
-                    token_total_borrow_usd + max(0.0, this_borrow_order_position) * this_price \
-                    + this_borrow_order_position * this_price
-                token_total_lend_usd = \
-                    token_total_lend_usd - min(0.0, this_lend_order_position) * this_price \
-                    + this_lend_order_position * this_price
+                token_total_borrow_usd = token_total_borrow_usd + this_borrow_usd
+                token_total_lend_usd = token_total_lend_usd + this_lend_usd
 
         return token_total_borrow_usd, token_total_lend_usd, wallet_total_borrow_usd, wallet_total_lend_usd
 
-    def get_fixed_rate_orders(self, token_id, days_to_maturity):
-        market_id = self.get_market_id_etc_from_token_id(token_id, False, days_to_maturity)
-        orders = self.find_active_orders_by_wallet_and_market(market_id, fixed_only=True)
-        return orders
+    def get_all_floating_and_fixed_order_position_quantities(self):
+        borrow_order_positions_by_token = {}
+        lend_order_positions_by_token = {}
+
+        borrow_order_positions_by_token, lend_order_positions_by_token = self.process_orders(
+            borrow_order_positions_by_token, lend_order_positions_by_token, self.active_floating_orders)
+        borrow_order_positions_by_token, lend_order_positions_by_token = self.process_orders(
+            borrow_order_positions_by_token, lend_order_positions_by_token, self.active_fixed_orders)
+
+        return borrow_order_positions_by_token, lend_order_positions_by_token
+
+    def get_current_positions_and_orders_in_usd(self, token_id):
+        return self.exposure_aggregator.get_exposures(token_id)
 
     def get_floating_markets_tokens_and_prices(self):
-        result = self.inf_rest.get_floating_rate_market_details()
-        self.floating_markets = Mhf.convert_list_of_dicts_to_dict(result['markets'], 'tokenId')
-        self.floating_tokens_and_prices = Mhf.convert_list_of_dicts_to_dict(result['tokens'], 'tokenId')
+        self.set_floating_markets_tokens_and_prices(self.inf_rest.get_floating_rate_market_details())
 
     def get_floating_rate_market_history(self, floating_market_id):
-        result = self.inf_rest.get_floating_rate_market_details_by_market_id(floating_market_id)
-        return float(result['market']['price'])
+        result = self.response_cache.get(
+            'floating_rate_market_details', floating_market_id,
+            lambda: self.inf_rest.get_floating_rate_market_details_by_market_id(floating_market_id))
+        rate = float(result['market']['price'])
+        token_id = self.market_registry.get_token_id_from_market_id(floating_market_id)
+        if token_id is not None and self.last_floating_rates.get(token_id) != rate:
+            self.last_floating_rates[token_id] = rate
+            self.invalidate_yield_curve(token_id)
+        return rate
 
     def get_recent_fixed_rate_market_transactions(self, fixed_rate_market_id):
-        result = self.inf_rest.get_recent_fixed_rate_transactions_by_market_id(fixed_rate_market_id, 1)
-        return float(result['trxs'][0]['price'])
-
-    def get_floating_rate_orders(self, token_id):
-        market_id = self.get_market_id_etc_from_token_id(token_id, True, 0)
-        orders = self.find_active_orders_by_wallet_and_market(market_id, floating_only=True)
-        return orders
+        result = self.response_cache.get(
+            'recent_fixed_rate_transactions', fixed_rate_market_id,
+            lambda: self.inf_rest.get_recent_fixed_rate_transactions_by_market_id(fixed_rate_market_id, 1))
+        if len(result['trxs']) == 0:
+            return None
+        rate = float(result['trxs'][0]['price'])
+        token_id = self.market_registry.get_token_id_from_market_id(fixed_rate_market_id)
+        if token_id is not None:
+            days_to_maturity = self.market_registry.get_market(fixed_rate_market_id)['daysToMaturity']
+            if token_id not in self.last_fixed_trade_rates:
+                self.last_fixed_trade_rates[token_id] = {}
+            if self.last_fixed_trade_rates[token_id].get(days_to_maturity) != rate:
+                self.last_fixed_trade_rates[token_id][days_to_maturity] = rate
+                self.invalidate_yield_curve(token_id)
+        return rate
+
+    def get_last_fixed_trade_rate(self, fixed_rate_market_id):
+        # As last fetched by get_recent_fixed_rate_market_transactions, without calling the API. None if not fetched.
+        token_id = self.market_registry.get_token_id_from_market_id(fixed_rate_market_id)
+        market = self.market_registry.get_market(fixed_rate_market_id)
+        if token_id is None or market is None:
+            return None
+        return self.last_fixed_trade_rates.get(token_id, {}).get(market['daysToMaturity'])
+
+    def get_last_floating_rate(self, token_id):
+        # As last fetched by get_floating_rate_market_history, without calling the API. None if not fetched yet.
+        return self.last_floating_rates.get(token_id)
 
     def get_last_price(self, token):
         if token is not None:
@@ -257,23 +381,32 @@ class InfinityApiBot:
             logging.fatal(f'No last price for {token}')
             os._exit(1)
 
+    def get_linearly_interpolated_rate(self, token, token_id, this_market_id, floating_market_id):
+        # Mid rate from the token's yield curve (fitted with yield_curve_fit_method, linear by default)
+        market = self.market_registry.get_market(this_market_id)
+        if market is None:
+            logging.error(f'Cannot find market id {this_market_id} for {token} in markets')
+            return None
+        if token_id not in self.last_floating_rates and floating_market_id is not None:
+            self.get_floating_rate_market_history(floating_market_id)
+        return self.get_yield_curve(token_id).get_rate(market['daysToMaturity'])
+
+    def get_market_snapshot(self):
+        return self.market_snapshot
+
     def get_market_id_etc_from_token_id(self, token_id, is_floating_market, days_to_maturity=0,
                                         just_return_market_id=True):
         if is_floating_market:
-            if just_return_market_id:
-                return self.floating_markets[token_id]['marketId']
-            else:
-                return self.floating_markets[token_id]['marketId'], \
-                    self.floating_markets[token_id]['quantityStep'], \
-                    self.floating_markets[token_id]['priceStep']
+            market = self.market_registry.get_floating_market(token_id)
+        else:
+            market = self.market_registry.get_fixed_market(token_id, days_to_maturity)
+        if market is None:
+            logging.error(f'Cannot find token id {token_id} in markets')
+            return None
+        if just_return_market_id:
+            return market['marketId']
         else:
-            for fm in self.fixed_markets[token_id]:
-                if fm['daysToMaturity'] == days_to_maturity:
-                    if just_return_market_id:
-                        return fm['marketId']
-                    else:
-                        return fm['marketId'], fm['quantityStep'], fm['priceStep']
-        logging.error(f'Cannot find token id {token_id} in markets')
+            return market['marketId'], market['quantityStep'], market['priceStep']
 
     def get_token_from_floating_market(self, token_id):
         code = self.floating_markets[token_id]['code']
@@ -282,13 +415,15 @@ class InfinityApiBot:
         return code[0:len(code)-5]
 
     def get_token_from_floating_market_id(self, floating_market_id):
-        token_id = Mhf.get_token_id_from_market_id_and_markets(floating_market_id, self.floating_markets)
+        token_id = self.market_registry.get_token_id_from_market_id(floating_market_id)
+        if token_id is None:
+            raise Exception(f'Cannot find market id {floating_market_id} in markets')
         return self.floating_tokens_and_prices[token_id]['code']
 
     def get_token_id_and_relevant_market_id_etc(self, token, tenor):
         token_id = self.get_token_id_from_floating_tokens(token)
         floating_market_id = self.get_market_id_etc_from_token_id(token_id, True, 0)
-        days_to_maturity = Mhf.convert_tenor_to_n_days(tenor)
+        days_to_maturity = self.maturity_calendar.get_n_days(tenor)
         if tenor == 'FLOAT':
             this_market_id, quantity_step, price_step = \
                 self.get_market_id_etc_from_token_id(token_id, True, 0, False)
@@ -297,11 +432,16 @@ class InfinityApiBot:
                 self.get_market_id_etc_from_token_id(token_id, False, days_to_maturity, False)
         return token_id, floating_market_id, this_market_id, quantity_step, price_step
 
+    def get_token_id_from_order(self, order):
+        if 'code' in order:
+            return self.market_registry.get_token_id(order['code'])
+        return self.market_registry.get_token_id_from_market_id(order['marketId'])
+
     def get_token_id_from_floating_tokens(self, token):
-        for token_id in self.floating_tokens_and_prices:
-            if self.floating_tokens_and_prices[token_id]['code'] == token:
-                return token_id
-        logging.error(f'Cannot find token {token} in floating tokens {self.floating_tokens_and_prices}')
+        token_id = self.market_registry.get_token_id(token)
+        if token_id is None:
+            logging.error(f'Cannot find token {token} in floating tokens {self.floating_tokens_and_prices}')
+        return token_id
 
     def get_trading_wallet_details(self, wallet_name='Trading'):
         for wallet in self.wallets:
@@ -310,6 +450,36 @@ class InfinityApiBot:
         logging.fatal(f'Cannot find wallet called {wallet_name}')
         os._exit(1)
 
+    def get_yield_curve(self, token_id):
+        input_version = self.yield_curve_input_versions.get(token_id, 0)
+        cached_yield_curve = self.yield_curves.get(token_id)
+        if cached_yield_curve is not None and cached_yield_curve[0] == input_version:
+            return cached_yield_curve[1]
+
+        days_to_maturity = []
+        rates = []
+        bid_ask_curve = self.bid_ask_curves.get(token_id)
+        floating_rate = None
+        if bid_ask_curve is not None:
+            floating_rate = bid_ask_curve.get_floating_mid()
+        if floating_rate is None:
+            floating_rate = self.last_floating_rates.get(token_id)
+        if floating_rate is not None:
+            days_to_maturity.append(0)
+            rates.append(floating_rate)
+        if bid_ask_curve is not None:
+            days_to_maturity.extend(bid_ask_curve.quoted_days_to_maturity.tolist())
+            rates.extend(bid_ask_curve.quoted_mids.tolist())
+        quoted_days_to_maturity = set(days_to_maturity)
+        for this_days_to_maturity, rate in self.last_fixed_trade_rates.get(token_id, {}).items():
+            if this_days_to_maturity not in quoted_days_to_maturity:  # Quotes take precedence over older trades
+                days_to_maturity.append(this_days_to_maturity)
+                rates.append(rate)
+
+        yield_curve = Yc.YieldCurve(days_to_maturity, rates, self.yield_curve_fit_method, self.yield_curve_decay_days)
+        self.yield_curves[token_id] = (input_version, yield_curve)
+        return yield_curve
+
     def get_wallet_id(self, wallet_name='Trading'):
         for wallet in self.wallets:
             if wallet['name'] == wallet_name:
@@ -317,18 +487,37 @@ class InfinityApiBot:
         logging.fatal(f'Cannot find wallet called {wallet_name}')
         os._exit(1)
 
-    def list_all_fixed_rate_markets(self):
-        # logging.info('Getting fixed rate markets... please wait')
+    def fetch_all_fixed_rate_markets(self):
         fixed_rate_markets = {}
         for token_id in self.floating_tokens_and_prices:
             fixed_rate_markets[token_id] = self.inf_rest.get_active_fixed_rate_markets_by_token_id(token_id)['markets']
+        return fixed_rate_markets
+
+    def invalidate_yield_curve(self, token_id):
+        self.yield_curve_input_versions[token_id] = self.yield_curve_input_versions.get(token_id, 0) + 1
+
+    def is_sending_orders(self):
+        # In a shard process, the coordinator's KillSwitch stops every shard's sends at once through shared_send_orders
+        return self.send_orders and (self.shared_send_orders is None or bool(self.shared_send_orders.value))
+
+    def list_all_fixed_rate_markets(self):
+        # logging.info('Getting fixed rate markets... please wait')
+        fixed_rate_markets = self.fetch_all_fixed_rate_markets()
         # logging.info('Getting fixed rate markets... DONE')
-        self.fixed_markets = fixed_rate_markets
-        all_fixed_rate_market_dates_look_ok = self.check_if_all_fixed_rate_market_dates_look_ok()
-        if all_fixed_rate_market_dates_look_ok:
-            self.fixed_markets_last_updated = dt.datetime.now(dt.timezone.utc)
-        else:
-            os._exit(1)
+        self.set_fixed_rate_markets(fixed_rate_markets)
+        self.save_reference_data()
+
+    def mark_prices_changed(self, old_floating_tokens_and_prices, new_floating_tokens_and_prices):
+        old_floating_tokens_and_prices = old_floating_tokens_and_prices or {}
+        self.change_notifier.mark_changed([
+            Cn.get_token_key(token_id) for token_id, token in new_floating_tokens_and_prices.items()
+            if token_id not in old_floating_tokens_and_prices
+            or old_floating_tokens_and_prices[token_id].get('price') != token.get('price')])
+
+    def on_ws_feed_state_changed(self):
+        # On disconnect, poll REST straight away. On (re)connect, resync anything missed while disconnected.
+        self.ws_feed_resync_needed = True
+        self.refresh_now_event.set()
 
     def process_orders(self, borrow_order_positions_by_token, lend_order_positions_by_token, active_orders):
         for active_order in active_orders:
@@ -338,12 +527,12 @@ class InfinityApiBot:
                 code = self.get_token_from_floating_market_id(active_order['marketId'])
             match active_order['side']:
                 case Osi.BORROW:
-                    if active_order['marketId'] not in borrow_order_positions_by_token:
+                    if code not in borrow_order_positions_by_token:
                         borrow_order_positions_by_token[code] = 0
                     borrow_order_positions_by_token[code] = \
                         borrow_order_positions_by_token[code] + float(active_order['quantity'])
                 case Osi.LEND:
-                    if active_order['marketId'] not in lend_order_positions_by_token:
+                    if code not in lend_order_positions_by_token:
                         lend_order_positions_by_token[code] = 0
                     lend_order_positions_by_token[code] = \
                         lend_order_positions_by_token[code] + float(active_order['quantity'])
@@ -353,92 +542,351 @@ class InfinityApiBot:
                     os._exit(1)
         return borrow_order_positions_by_token, lend_order_positions_by_token
 
+    def publish_market_snapshot(self, is_first=False):
+        # Builds a new MarketSnapshot from the current market data and swaps it in. Called after every change.
+        if self.market_snapshot is None and not is_first:  # Not all of the market data exists yet
+            return
+        with self.market_snapshot_lock:
+            changed_keys = self.change_notifier.take_changed_keys()
+            version = 1 if self.market_snapshot is None else self.market_snapshot.version + 1
+            self.market_snapshot = Ms.MarketSnapshot(
+                version, self.market_registry, dict(self.floating_tokens_and_prices), dict(self.bid_ask_curves),
+                self.active_floating_orders.get_frozen_view(), self.active_fixed_orders.get_frozen_view())
+            if self.market_data_bus is not None:
+                try:
+                    self.market_data_bus.publish(self.market_snapshot)
+                except Exception as e:
+                    logging.warning(f'Error {e} - Cannot publish market data bus')
+        self.change_notifier.notify(changed_keys)  # Only now, so that woken TokenBots see the changes
+
+    def rebuild_market_registry(self):
+        self.market_registry = \
+            Mr.MarketRegistry(self.floating_markets, self.floating_tokens_and_prices, self.fixed_markets)
+        self.publish_market_snapshot()
+
+    def reconcile_exposures(self):
+        # Full recompute of every token's exposures, so only run if reconcile_exposures is set in config.yml
+        differences = self.exposure_aggregator.reconcile(
+            list(self.floating_tokens_and_prices.keys()), self.compute_current_positions_and_orders_in_usd)
+        if len(differences) > 0:
+            logging.warning(f'Exposure aggregator differs from full recompute:\t{differences}')
+        return differences
+
+    def register_token_bot(self, token_bot):
+        self.token_bots.add(token_bot)
+        # One connection per TokenBot, per cancel worker and for this bot, doubling so the pool is rarely rebuilt
+        n_connections_needed = len(self.token_bots) + self.cancel_pool_max_workers + 1
+        if n_connections_needed > self.http_transport.get_pool_maxsize():
+            self.http_transport.resize(max(n_connections_needed, 2 * self.http_transport.get_pool_maxsize()))
+
+    def reserve_account_usd(self, is_borrow, order_usd, wallet_total_usd, max_usd_for_account):
+        # Account limit check, made just before an order is sent. Returns (True if within max_usd_for_account, wallet
+        # total counted). In a shard process, this also counts the other shards' orders not yet seen by the feed.
+        if self.account_ledger is None:
+            return wallet_total_usd + order_usd < max_usd_for_account, wallet_total_usd
+        return self.account_ledger.reserve(is_borrow, order_usd, wallet_total_usd, max_usd_for_account)
+
+    def roll_over_fixed_markets(self):
+        logging.info('Rolling over fixed rate markets...')
+        try:
+            fixed_rate_markets = self.fetch_all_fixed_rate_markets()
+        except Exception as e:
+            logging.warning(f'Error {e} - Cannot get fixed rate markets for rollover')
+            return False
+        if not self.set_fixed_rate_markets(fixed_rate_markets, False):
+            logging.warning('Fixed rate market dates not rolled over yet')
+            return False
+        self.save_reference_data()
+        self.last_fixed_trade_rates = {}  # Days to maturity of those trades are now a day out
+        for token_id in list(self.yield_curve_input_versions.keys()):
+            self.invalidate_yield_curve(token_id)
+        for token_bot in list(self.token_bots):
+            try:
+                token_bot.remap_market()
+            except Exception as e:
+                logging.error(f'Error {e} - Cannot re-map {token_bot.bot_name} {token_bot.token} {token_bot.tenor} '
+                              + 'to its new market')
+        logging.info('Rolling over fixed rate markets... DONE')
+        return True
+
     def run_loop(self):
         while True:  # Loop
             if self.fixed_markets_last_updated is None:
                 os._exit(1)
-            if self.fixed_markets_last_updated < last_rollover_datetime():
-                os._exit(1)
-            if self.ok_to_update_active_orders:
-                self.update_active_orders()
-            self.update_last_prices()
-            self.update_bid_ask_last_rates()
+            if self.fixed_markets_last_updated < Mhf.get_last_rollover_datetime():
+                if not self.roll_over_fixed_markets():
+                    self.refresh_now_event.wait(self.rollover_retry_seconds)
+                    continue
+            if self.ws_feed is None or not self.ws_feed.is_connected() or self.ws_feed_resync_needed:
+                self.ws_feed_resync_needed = False
+                if self.ok_to_update_active_orders:
+                    self.update_active_orders()
+                self.update_last_prices()
+                self.update_bid_ask_last_rates()
+                if self.cfg.get('reconcile_exposures', False):
+                    self.reconcile_exposures()
+                self.exposure_aggregator.reset_wallet_totals()
+            self.response_cache.log_stats()
+            self.http_transport.log_stats()
+            self.rate_budget.log_stats()
+            if self.order_gateway is not None:
+                self.order_gateway.log_stats()
             self.wallet_details = self.inf_rest.get_user_wallet_details()['wallet']
-            sleep(self.cfg['inf_api_bot_refresh_minutes'] * 60)
+            # Wake up at the rollover time too, rather than up to a full refresh period after it
+            seconds_to_rollover = (Mhf.get_next_rollover_datetime() - dt.datetime.now(dt.timezone.utc)).total_seconds()
+            self.refresh_now_event.wait(
+                max(0.0, min(self.cfg['inf_api_bot_refresh_minutes'] * 60, seconds_to_rollover + 1)))
+            self.refresh_now_event.clear()
 
     def send_order(
-            self, market_id, is_floating_market, order_type, side, qty, price):
-        if self.send_orders:
+            self, market_id, is_floating_market, order_type, side, qty, price, quantity_step=None, price_step=None,
+            comment=None, level=0):
+        # Returns a Future when going through the order gateway. level: the order's level in a quote ladder.
+        if self.order_gateway is not None:
+            return self.order_gateway.submit_order(
+                market_id, is_floating_market, order_type, side, qty, price, quantity_step, price_step, comment, level)
+        return self.send_order_now(
+            market_id, is_floating_market, order_type, side, qty, price, quantity_step, price_step, comment)
+
+    def send_order_now(
+            self, market_id, is_floating_market, order_type, side, qty, price, quantity_step=None, price_step=None,
+            comment=None, client_id=None):
+        # Steps only for a qty or price still to be rounded. TokenBot & QuoteEngine send exact ticks (TickMath) without.
+        if quantity_step is not None:
+            qty = Tm.round_value(qty, quantity_step)
+        if price_step is not None:
+            price = Tm.round_value(price, price_step)
+        logging.info(f'Sending order: market {market_id}\tside {side}\tqty {qty}\trate {price}\t{comment}')
+        if self.is_sending_orders():
             deduplication = uuid.uuid4().hex[:8]
-            if is_floating_market:
-                self.inf_rest.create_floating_rate_order(market_id, order_type, side, qty, deduplication, price)
-            else:
-                self.inf_rest.create_fixed_rate_order(market_id, order_type, side, qty, deduplication, price)
+            with self.rate_budget.as_client(client_id):  # Queued as the caller, not as the pool thread
+                if is_floating_market:
+                    return self.inf_rest.create_floating_rate_order(
+                        market_id, order_type, side, qty, deduplication, price)
+                else:
+                    return self.inf_rest.create_fixed_rate_order(market_id, order_type, side, qty, deduplication, price)
+
+    def send_orders_batch(self, orders):
+        # orders: [send_order args], e.g. a whole quote ladder. Queued on the order gateway together, or else sent
+        # concurrently on cancel_pool. Returns the send_order results (Futures when going through the order gateway).
+        if self.order_gateway is not None:
+            return self.order_gateway.submit_orders(orders)
+        if len(orders) <= 1:  # Not worth a round trip through the pool
+            return [self.send_order_now(*order[:9]) for order in orders]
+        client_id = self.rate_budget.get_client_id()
+        return list(self.cancel_pool.map(lambda order: self.send_order_now(*order[:9], client_id=client_id), orders))
+
+    def save_reference_data(self):
+        if self.reference_data_cache_path_filename:
+            Rdc.save_reference_data(
+                self.reference_data_cache_path_filename, Mhf.get_last_rollover_datetime(), self.address, self.domain,
+                self.wallets, self.floating_market_details, self.fixed_markets)
+
+    def set_fixed_rate_markets(self, fixed_rate_markets, exit_if_dates_wrong=True):
+        all_fixed_rate_market_dates_look_ok = self.check_if_all_fixed_rate_market_dates_look_ok(fixed_rate_markets)
+        if all_fixed_rate_market_dates_look_ok:
+            self.fixed_markets = fixed_rate_markets
+            self.rebuild_market_registry()
+            self.fixed_markets_last_updated = dt.datetime.now(dt.timezone.utc)
+        elif exit_if_dates_wrong:
+            os._exit(1)
+        return all_fixed_rate_market_dates_look_ok
+
+    def set_floating_markets_tokens_and_prices(self, floating_market_details):
+        self.floating_market_details = floating_market_details
+        self.floating_markets = Mhf.convert_list_of_dicts_to_dict(floating_market_details['markets'], 'tokenId')
+        self.floating_tokens_and_prices = \
+            Mhf.convert_list_of_dicts_to_dict(floating_market_details['tokens'], 'tokenId')
+        self.rebuild_market_registry()
+        self.exposure_aggregator.update_prices(self.floating_tokens_and_prices)
 
     def start_bot(self):
         Thread(target=self.run_loop, daemon=True).start()
-
-    def fetch_all_floating_and_fixed_active_orders_by_wallet(self):
-        # FLOATING
-        logging.info('Getting all floating rate orders... please wait')
-        active_floating_orders = []
+        if self.ws_feed is not None:
+            self.ws_feed.start_feed()
+
+    def start_market_data_bus(self, path):
+        # Only in the process polling or streaming market data, as the bus is re-created (see MarketDataBus)
+        with self.market_snapshot_lock:
+            self.market_data_bus = Mdb.MarketDataBus(
+                path, self.cfg.get('market_data_bus_max_tokens', 64), self.cfg.get('market_data_bus_max_tenors', 32),
+                self.cfg.get('market_data_bus_max_markets', 1024))
+            if self.market_snapshot is not None:
+                self.market_data_bus.publish(self.market_snapshot)
+
+    def fetch_active_orders(self, is_floating_market, stop_at_order_id=0):
+        # Walks the wallet's orders from the newest back to stop_at_order_id (or back to the very first order if 0).
+        # Returns None if a page cannot be retrieved, since the result would then be incomplete.
+        # Otherwise (orders on book, pending order ids, newest order id, ids of every order listed).
+        order_type_str = 'floating' if is_floating_market else 'fixed'
+        logging.info(f'Getting {order_type_str} rate orders... please wait')
+        active_orders = []
+        pending_order_ids = []
+        newest_order_id = None
+        listed_order_ids = []
         start_id = 0
         n_orders = 0
         while True:
-            orders = []
             try:
-                orders = self.inf_rest.get_users_floating_rate_orders(pending=True, start_id=start_id, limit=100)['orders']
+                if is_floating_market:
+                    orders = self.inf_rest.get_users_floating_rate_orders(
+                        pending=True, start_id=start_id, limit=100)['orders']
+                else:
+                    orders = self.inf_rest.get_users_fixed_rate_orders(pending=True, start_id=start_id, limit=100)
             except Exception as e:
                 logging.warning(f'Error {e} - Cannot retrieve orders')
+                return None
             if len(orders) == 0:
                 break
+            if newest_order_id is None:
+                newest_order_id = orders[0]['orderId']
             for order in orders:
+                if order['orderId'] < stop_at_order_id:
+                    break
+                listed_order_ids.append(order['orderId'])
                 if order['status'] == Ost.STATUS_ON_BOOK:
-                    active_floating_orders.append(order)
-            start_id = orders[-1]['orderId'] - 1
+                    active_orders.append(order)
+                elif order['status'] == Ost.STATUS_PENDING:
+                    pending_order_ids.append(order['orderId'])
             n_orders = n_orders + len(orders)
             logging.debug(n_orders)
-        logging.info('Getting all floating rate orders... DONE')
-        logging.debug(f'# Floating orders = {n_orders}')
-
-        # FIXED
-        logging.info('Getting all fixed rate orders... please wait')
-        active_fixed_orders = []
-        start_id = 0
-        n_orders = 0
-        while True:
-            orders = []
-            try:
-                orders = self.inf_rest.get_users_fixed_rate_orders(pending=True, start_id=start_id, limit=100)
-            except Exception as e:
-                logging.warning(f'Error {e} - Cannot retrieve orders')
-            if len(orders) == 0:
+            if orders[-1]['orderId'] <= stop_at_order_id:
                 break
-            for order in orders:
-                if order['status'] == Ost.STATUS_ON_BOOK:
-                    active_fixed_orders.append(order)
             start_id = orders[-1]['orderId'] - 1
-            n_orders = n_orders + len(orders)
-            logging.debug(n_orders)
-        logging.info('Getting all fixed rate orders... DONE')
-        logging.debug(f'# Fixed orders = {n_orders}')
+        logging.info(f'Getting {order_type_str} rate orders... DONE')
+        logging.debug(f'# {order_type_str.capitalize()} orders = {n_orders}')
+        return active_orders, pending_order_ids, newest_order_id, listed_order_ids
+
+    def fetch_order(self, is_floating_market, order_id, client_id=None):
+        # Lists the wallet's orders from order_id, one order long. None if that order is no longer listed.
+        with self.rate_budget.as_client(client_id):  # Queued as the caller, not as the cancel pool thread
+            if is_floating_market:
+                orders = self.inf_rest.get_users_floating_rate_orders(
+                    pending=True, start_id=order_id, limit=1)['orders']
+            else:
+                orders = self.inf_rest.get_users_fixed_rate_orders(pending=True, start_id=order_id, limit=1)
+        return orders[0] if len(orders) > 0 and orders[0]['orderId'] == order_id else None
+
+    def fetch_orders_by_id(self, is_floating_market, order_ids):
+        # Current state of each order, fetched concurrently on cancel_pool. Orders no longer listed are left out.
+        # Returns None if any of them cannot be retrieved, since the result would then be incomplete.
+        order_ids = list(dict.fromkeys(order_ids))
+        client_id = self.rate_budget.get_client_id()
+        try:
+            orders = list(self.cancel_pool.map(
+                lambda order_id: self.fetch_order(is_floating_market, order_id, client_id), order_ids))
+        except Exception as e:
+            logging.warning(f'Error {e} - Cannot retrieve orders by id')
+            return None
+        return [order for order in orders if order is not None]
 
+    def fetch_all_floating_and_fixed_active_orders_by_wallet(self):
+        active_floating_orders, active_fixed_orders = [], []
+        result = self.fetch_active_orders(True)
+        if result is not None:
+            active_floating_orders = result[0]
+        result = self.fetch_active_orders(False)
+        if result is not None:
+            active_fixed_orders = result[0]
         return active_floating_orders, active_fixed_orders
 
+    def report_active_orders_drift(self, is_floating_market, active_orders, fetched_orders):
+        order_type_str = 'floating' if is_floating_market else 'fixed'
+        fetched_orders_by_id = Mhf.convert_list_of_dicts_to_dict(fetched_orders, 'orderId')
+        known_order_ids = set(active_orders.get_order_ids())
+        missing_order_ids = [order_id for order_id in fetched_orders_by_id if order_id not in known_order_ids]
+        stale_order_ids = [order_id for order_id in known_order_ids if order_id not in fetched_orders_by_id]
+        changed_order_ids = [
+            order_id for order_id in known_order_ids
+            if order_id in fetched_orders_by_id
+            and active_orders.get_order(order_id)['quantity'] != fetched_orders_by_id[order_id]['quantity']]
+        self.last_active_orders_drift[order_type_str] = {
+            'missing': missing_order_ids, 'stale': stale_order_ids, 'changed': changed_order_ids}
+        if len(missing_order_ids) + len(stale_order_ids) + len(changed_order_ids) > 0:
+            logging.warning(f'Active {order_type_str} orders drift found on full sync:\t'
+                            + f'missing {missing_order_ids}\tstale {stale_order_ids}\tchanged {changed_order_ids}')
+        else:
+            logging.info(f'No active {order_type_str} orders drift found on full sync')
+
+    def sync_active_orders(self, is_floating_market, full_sync):
+        active_orders = self.active_floating_orders if is_floating_market else self.active_fixed_orders
+        sync_state = self.active_orders_sync_states[is_floating_market]
+        known_order_ids = active_orders.get_order_ids() + sync_state['pending_order_ids']
+        if full_sync or sync_state['last_seen_order_id'] is None:
+            stop_at_order_id = 0
+        else:  # Paged back through new orders and as far as the oldest order still on book or pending, no further
+            stop_at_order_id = min([sync_state['last_seen_order_id'] + 1] + known_order_ids)
+        result = self.fetch_active_orders(is_floating_market, stop_at_order_id)
+        if result is None:
+            return False
+        fetched_orders, pending_order_ids, newest_order_id, listed_order_ids = result
+        if stop_at_order_id > 0:  # Known orders that were not listed are fetched one at a time
+            listed_order_ids = set(listed_order_ids)
+            result = self.fetch_orders_by_id(
+                is_floating_market, [order_id for order_id in known_order_ids if order_id not in listed_order_ids])
+            if result is None:
+                return False
+            for order in result:
+                if order['status'] == Ost.STATUS_ON_BOOK:
+                    fetched_orders.append(order)
+                elif order['status'] == Ost.STATUS_PENDING:
+                    pending_order_ids.append(order['orderId'])
+        if stop_at_order_id == 0 and self.active_orders_sync_mode == Osm.INCREMENTAL \
+                and sync_state['last_seen_order_id'] is not None:
+            self.report_active_orders_drift(is_floating_market, active_orders, fetched_orders)
+        active_orders.replace_all(fetched_orders)
+        sync_state['pending_order_ids'] = pending_order_ids
+        if newest_order_id is not None:
+            sync_state['last_seen_order_id'] = max(newest_order_id, sync_state['last_seen_order_id'] or 0)
+        return True
+
+    def verify_cached_reference_data(self):
+        try:
+            wallets = self.inf_rest.get_user_wallets()['wallets']
+            floating_market_details = self.inf_rest.get_floating_rate_market_details()
+            floating_markets = Mhf.convert_list_of_dicts_to_dict(floating_market_details['markets'], 'tokenId')
+            fixed_markets = self.fetch_all_fixed_rate_markets()
+        except Exception as e:
+            logging.warning(f'Error {e} - Cannot verify cached reference data')
+            return
+        if wallets == self.wallets and floating_markets == self.floating_markets \
+                and fixed_markets == self.fixed_markets:
+            logging.info('Cached reference data verified')
+            return
+        logging.warning('Cached reference data is out of date. Replacing it')
+        self.wallets = wallets
+        self.wallet_details = self.get_trading_wallet_details()
+        self.set_floating_markets_tokens_and_prices(floating_market_details)
+        self.set_fixed_rate_markets(fixed_markets)
+        self.save_reference_data()
+
     def update_active_orders(self):
-        self.active_floating_orders, self.active_fixed_orders =\
-            self.fetch_all_floating_and_fixed_active_orders_by_wallet()
-        pass
+        full_sync = self.active_orders_sync_mode != Osm.INCREMENTAL \
+            or self.n_active_orders_updates % self.active_orders_full_sync_every_n_updates == 0
+        self.n_active_orders_updates = self.n_active_orders_updates + 1
+        as_of_time = time.time()  # Any order sent before this is in the orders fetched below
+        is_floating_synced = self.sync_active_orders(True, full_sync)  # FLOATING
+        is_fixed_synced = self.sync_active_orders(False, full_sync)  # FIXED
+        if is_floating_synced and is_fixed_synced:
+            self.active_orders_as_of_time = as_of_time
+        self.publish_market_snapshot()
 
     def update_bid_ask_last_rates(self):
         min_bid_n_ask_size = 0
         for token_id in self.floating_markets:
             try:
-                self.bid_ask_last_rates[token_id] = self.inf_rest.get_current_best_bid_ask_by_token_id(token_id, None, min_bid_n_ask_size)
+                self.apply_bid_ask_update(
+                    token_id, self.inf_rest.get_current_best_bid_ask_by_token_id(token_id, None, min_bid_n_ask_size),
+                    False)
             except Exception as e:
                 logging.fatal(f'Error {e} - Cannot save bid ask last rate data in self.bid_ask_last_rates')
                 os._exit(1)
+        self.publish_market_snapshot()  # Once for all tokens
 
     def update_last_prices(self):
-        self.floating_tokens_and_prices = Mhf.convert_list_of_dicts_to_dict(self.inf_rest.get_token_details()['tokens'], 'tokenId')
-        pass
+        floating_tokens_and_prices = \
+            Mhf.convert_list_of_dicts_to_dict(self.inf_rest.get_token_details()['tokens'], 'tokenId')
+        self.mark_prices_changed(self.floating_tokens_and_prices, floating_tokens_and_prices)
+        self.floating_tokens_and_prices = floating_tokens_and_prices
+        self.rebuild_market_registry()
+        self.exposure_aggregator.update_prices(self.floating_tokens_and_prices)
@@ -0,0 +1,98 @@
+from constants import WsChannel as Wsc
+import json
+import logging
+from threading import Event, Thread
+from time import sleep
+import websocket
+
+
+def apply_message(api_bot, message):
+    match message['channel']:
+        case Wsc.PRICES:
+            api_bot.apply_price_updates(message['data'])
+        case Wsc.BID_ASK:
+            api_bot.apply_bid_ask_update(message['data']['tokenId'], message['data'])
+        case Wsc.FLOATING_ORDERS:
+            api_bot.apply_order_updates(message['data'], True)
+        case Wsc.FIXED_ORDERS:
+            api_bot.apply_order_updates(message['data'], False)
+        case _:
+            logging.debug(f"Ignoring WebSocket channel {message['channel']}")
+
+
+class InfinityWsFeed:
+
+    def __init__(self, api_bot, url, reconnect_seconds=5, ping_interval_seconds=30, start_feed=False):
+        self.api_bot = api_bot
+        self.url = url
+        self.reconnect_seconds = reconnect_seconds
+        self.ping_interval_seconds = ping_interval_seconds
+        self.ws_app = None
+        self.connected = Event()
+        self.stopped = Event()
+        self.n_messages = 0
+        self.thread = Thread(name='wsFeed', target=self.run_loop, daemon=True)
+        if start_feed:
+            self.start_feed()
+
+    def is_connected(self):
+        return self.connected.is_set()
+
+    def on_close(self, ws_app, close_status_code, close_msg):
+        if self.connected.is_set():
+            logging.warning(f'WebSocket feed disconnected ({close_status_code} {close_msg}). '
+                            + 'Falling back to REST polling')
+            self.connected.clear()
+            self.api_bot.on_ws_feed_state_changed()
+
+    def on_error(self, ws_app, error):
+        logging.warning(f'Error {error} - WebSocket feed')
+
+    def on_message(self, ws_app, message):
+        try:
+            self.process_message(json.loads(message))
+        except Exception as e:
+            logging.error(f'Error {e} - Cannot process WebSocket message {message}')
+
+    def on_open(self, ws_app):
+        ws_app.send(json.dumps({
+            'op': 'subscribe',
+            'walletId': self.api_bot.get_wallet_id(),
+            'channels': [Wsc.PRICES, Wsc.BID_ASK, Wsc.FLOATING_ORDERS, Wsc.FIXED_ORDERS]}))
+        logging.info(f'WebSocket feed connected to {self.url}')
+        self.connected.set()
+        self.api_bot.on_ws_feed_state_changed()  # Resync anything missed while disconnected
+
+    def process_message(self, message):
+        if 'channel' not in message:
+            logging.debug(f'Ignoring WebSocket message {message}')
+            return
+        self.n_messages = self.n_messages + 1
+        apply_message(self.api_bot, message)
+
+    def run_loop(self):
+        while not self.stopped.is_set():
+            self.ws_app = websocket.WebSocketApp(
+                self.url,
+                header=[f'User-Agent: {self.api_bot.user_agent}'],
+                on_open=self.on_open,
+                on_message=self.on_message,
+                on_error=self.on_error,
+                on_close=self.on_close)
+            try:
+                self.ws_app.run_forever(ping_interval=self.ping_interval_seconds,
+                                        ping_timeout=self.ping_interval_seconds / 2)
+            except Exception as e:
+                logging.warning(f'Error {e} - WebSocket feed stopped')
+            self.on_close(self.ws_app, None, None)
+            if not self.stopped.is_set():
+                sleep(self.reconnect_seconds)
+
+    def start_feed(self):
+        if not self.thread.is_alive():
+            self.thread.start()
+
+    def stop_feed(self):
+        self.stopped.set()
+        if self.ws_app is not None:
+            self.ws_app.close()
@@ -0,0 +1,106 @@
+from constants import OrderStatus as Ost
+import logging
+import os
+import signal
+from threading import Event, Lock
+import time
+
+
+class KillSwitch:
+
+    # Stops every TokenBot and pulls all of the wallet's resting orders, either on SIGINT/SIGTERM (see
+    # install_signal_handlers) or when trigger is called. Logs how long it took to be flat.
+
+    def __init__(self, api_bot, parent_bots=None):
+        self.api_bot = api_bot
+        self.parent_bots = list(parent_bots) if parent_bots is not None else []
+        self.max_attempts = self.api_bot.cfg.get('kill_switch_max_attempts', 3)
+        self.triggered_event = Event()
+        self.lock = Lock()
+        self.time_to_flat_seconds = None
+
+    def add_parent_bot(self, parent_bot):
+        self.parent_bots.append(parent_bot)
+
+    def install_signal_handlers(self):
+        # Must be called from the main thread
+        signal.signal(signal.SIGINT, self.on_signal)
+        signal.signal(signal.SIGTERM, self.on_signal)
+
+    def is_triggered(self):
+        return self.triggered_event.is_set()
+
+    def on_signal(self, signal_number, frame):
+        self.trigger(f'signal {signal.Signals(signal_number).name}')
+        os._exit(0)
+
+    def trigger(self, reason='manual'):
+        # Returns True if no orders are left on book
+        with self.lock:
+            if self.triggered_event.is_set():
+                return self.time_to_flat_seconds is not None
+            self.triggered_event.set()
+            start_time = time.perf_counter()
+            logging.warning(f'KILL SWITCH TRIGGERED ({reason}) - stopping all bots and cancelling all orders')
+            self.api_bot.send_orders = False  # Nothing new goes out, even from iterations already under way
+            for parent_bot in self.parent_bots:
+                parent_bot.stop_bot()  # Does not wait for the bots to stop
+            is_flat = self.cancel_all_orders(start_time)
+            for parent_bot in self.parent_bots:  # Only now, as e.g. shard processes can take a while to stop
+                parent_bot.wait_for_bot_to_stop()
+            return is_flat
+
+    def cancel_all_orders(self, start_time):
+        if not self.api_bot.cancel_orders:
+            logging.warning('*** CANCELLING ORDERS CURRENTLY DISABLED. KILL SWITCH CANNOT CANCEL ANY ORDERS. ***')
+            return False
+        n_cancelled = 0
+        for attempt in range(1, self.max_attempts + 1):
+            self.allow_cancel_retries()
+            order_ids = {True: self.api_bot.active_floating_orders.get_order_ids(),
+                         False: self.api_bot.active_fixed_orders.get_order_ids()}
+            results = self.api_bot.cancel_all_orders()
+            n_cancelled = n_cancelled + sum(results.values())
+            logging.warning(f'Kill switch attempt {attempt}: {sum(results.values())} of {len(results)} orders '
+                            + f'cancelled after {time.perf_counter() - start_time:.3f}s')
+            is_confirmed = True
+            for is_floating_market in order_ids:
+                is_confirmed = self.confirm_cancels(
+                    is_floating_market, [order_id for order_id in order_ids[is_floating_market]
+                                         if results.get(order_id, False)]) and is_confirmed
+            n_left = len(self.get_uncancelled_order_ids())
+            if is_confirmed and n_left == 0:
+                self.time_to_flat_seconds = time.perf_counter() - start_time
+                logging.warning(f'Kill switch: flat after {self.time_to_flat_seconds:.3f}s '
+                                + f'({n_cancelled} orders cancelled)')
+                return True
+            logging.warning(f'Kill switch: {n_left} orders still on book' + ('' if is_confirmed else ' or unconfirmed'))
+        logging.fatal(f'Kill switch: NOT FLAT after {self.max_attempts} attempts and '
+                      + f'{time.perf_counter() - start_time:.3f}s')
+        return False
+
+    def allow_cancel_retries(self):
+        # The API bot skips orders it has already cancelled, but an order still reported on book has to go again
+        for order_id in self.api_bot.active_floating_orders.get_order_ids():
+            if order_id in self.api_bot.cancelled_floating_orders:
+                self.api_bot.cancelled_floating_orders.remove(order_id)
+        for order_id in self.api_bot.active_fixed_orders.get_order_ids():
+            if order_id in self.api_bot.cancelled_fixed_orders:
+                self.api_bot.cancelled_fixed_orders.remove(order_id)
+
+    def confirm_cancels(self, is_floating_market, cancelled_order_ids):
+        # Incremental sync for orders sent just before send_orders was switched off, then only the orders just
+        # cancelled are queried again, as a cancel can be acknowledged before the order is off book.
+        # Returns False if the exchange could not be queried.
+        active_orders = self.api_bot.active_floating_orders if is_floating_market else self.api_bot.active_fixed_orders
+        is_synced = self.api_bot.sync_active_orders(is_floating_market, False)
+        orders = self.api_bot.fetch_orders_by_id(is_floating_market, cancelled_order_ids)
+        if orders is None:
+            return False
+        for order in orders:
+            if order['status'] == Ost.STATUS_ON_BOOK:
+                active_orders.add(order)
+        return is_synced
+
+    def get_uncancelled_order_ids(self):
+        return self.api_bot.active_floating_orders.get_order_ids() + self.api_bot.active_fixed_orders.get_order_ids()
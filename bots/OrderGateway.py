@@ -0,0 +1,111 @@
+from collections import deque
+from concurrent.futures import Future
+import logging
+from threading import Condition, Thread, current_thread
+
+
+class OrderGateway:
+
+    # Outbound order queue served by its own worker threads. Cancels always go before new orders, and a new order
+    # for a market, side & ladder level replaces one from the same submitter (rate budget client id, i.e. TokenBot) for
+    # the same market, side & level that is still queued (it would be stale by the time it was sent). Submitting
+    # returns a Future with the result of InfinityApiBot.send_order_now / cancel_orders_batch_now, or None for an order
+    # that was superseded before being sent.
+
+    def __init__(self, api_bot, n_workers=2, start_gateway=True):
+        self.api_bot = api_bot
+        self.n_workers = n_workers
+        self.condition = Condition()
+        self.cancel_queue = deque()  # (order ids, is floating, client id, future)
+        self.send_intents = {}  # (client id, market id, side, level) -> (args, client id, future), oldest first
+        self.stats = {'orders_sent': 0, 'orders_superseded': 0, 'cancel_batches': 0}
+        self.is_running = False
+        self.worker_threads = []
+        if start_gateway:
+            self.start_gateway()
+
+    def get_stats(self):
+        with self.condition:
+            return dict(self.stats, cancels_queued=len(self.cancel_queue), orders_queued=len(self.send_intents))
+
+    def is_worker_thread(self):
+        return current_thread() in self.worker_threads
+
+    def log_stats(self):
+        stats = self.get_stats()
+        logging.info(f"Order gateway:\tsent {stats['orders_sent']}\tsuperseded {stats['orders_superseded']}\t"
+                     + f"cancel batches {stats['cancel_batches']}\tqueued {stats['cancels_queued']} cancels & "
+                     + f"{stats['orders_queued']} orders")
+
+    def run_worker(self):
+        while True:
+            with self.condition:
+                while self.is_running and len(self.cancel_queue) == 0 and len(self.send_intents) == 0:
+                    self.condition.wait()
+                if not self.is_running:
+                    return
+                if len(self.cancel_queue) > 0:  # Cancels first
+                    order_ids, is_floating_market, client_id, future = self.cancel_queue.popleft()
+                    self.stats['cancel_batches'] = self.stats['cancel_batches'] + 1
+                    is_cancel = True
+                else:
+                    key = next(iter(self.send_intents))
+                    args, client_id, future = self.send_intents.pop(key)
+                    self.stats['orders_sent'] = self.stats['orders_sent'] + 1
+                    is_cancel = False
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with self.api_bot.rate_budget.as_client(client_id):
+                    if is_cancel:
+                        future.set_result(self.api_bot.cancel_orders_batch_now(order_ids, is_floating_market))
+                    else:
+                        future.set_result(self.api_bot.send_order_now(*args))
+            except Exception as e:
+                logging.warning(f'Error {e} - Order gateway request failed')
+                future.set_exception(e)
+
+    def start_gateway(self):
+        with self.condition:
+            if self.is_running:
+                return
+            self.is_running = True
+        self.worker_threads = [Thread(name=f'orderGateway_{i}', target=self.run_worker, daemon=True)
+                               for i in range(self.n_workers)]
+        for t in self.worker_threads:
+            t.start()
+
+    def stop_gateway(self):
+        with self.condition:
+            self.is_running = False
+            self.condition.notify_all()
+
+    def submit_cancels(self, order_ids, is_floating_market):
+        future = Future()
+        with self.condition:
+            self.cancel_queue.append(
+                (order_ids, is_floating_market, self.api_bot.rate_budget.get_client_id(), future))
+            self.condition.notify()
+        return future
+
+    def submit_order(self, market_id, is_floating_market, order_type, side, qty, price, quantity_step=None,
+                     price_step=None, comment=None, level=0):
+        future = Future()
+        client_id = self.api_bot.rate_budget.get_client_id()
+        key = (client_id, market_id, side, level)  # Never another bot's order, e.g. two ParentBots quoting one market
+        args = (market_id, is_floating_market, order_type, side, qty, price, quantity_step, price_step, comment)
+        with self.condition:
+            superseded_intent = self.send_intents.get(key)
+            # Replacing the value keeps the key's place in the queue, so a busy market is not pushed to the back
+            self.send_intents[key] = (args, client_id, future)
+            if superseded_intent is not None:
+                self.stats['orders_superseded'] = self.stats['orders_superseded'] + 1
+            else:
+                self.condition.notify()
+        if superseded_intent is not None:
+            superseded_intent[2].set_result(None)
+        return future
+
+    def submit_orders(self, orders):
+        # orders: [submit_order args], e.g. a whole quote ladder. Returns a Future for each.
+        return [self.submit_order(*order) for order in orders]
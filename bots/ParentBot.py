@@ -1,10 +1,13 @@
+import asyncio
+from bots import AsyncBotLoop as Abl
+from bots import QuoteEngine as Qe
 from bots import TokenBot as Tb
 from bot_params import TokenParams as Tp
+from constants import RunMode as Rm
 import copy
 import logging
 from misc import MiscHelperFunctions as Mhf
-from threading import Lock, Thread
-from time import sleep
+from threading import Event, Lock, Thread
 
 
 def get_tenors_to_use(tenors, token):
@@ -25,20 +28,51 @@ def get_tenors_to_use(tenors, token):
     return tenors_to_use
 
 
+def create_parent_bots(bot_names, api_bot):
+    # With the event loop or quote engine their run mode needs, shared by all of them
+    cfg = Mhf.load_config_file_etc()
+    run_mode = get_run_mode(cfg)
+    bot_loop = None  # Single event loop shared by all bots when running in async mode
+    if run_mode == Rm.ASYNC:
+        bot_loop = Abl.AsyncBotLoop(cfg.get('async_bot_max_workers'))
+    quote_engine = None  # Single thread quoting all bots when running in central mode
+    if run_mode == Rm.CENTRAL:
+        quote_engine = Qe.QuoteEngine(api_bot, cfg.get('quote_engine_ticks_per_second', 10))
+    return [ParentBot(bot_name, api_bot, False, bot_loop, quote_engine) for bot_name in bot_names]
+
+
+def get_run_mode(cfg):
+    # How TokenBots are run within a process. In sharded mode, how each shard process runs its own.
+    run_mode = cfg.get('bot_run_mode', Rm.THREAD)
+    if run_mode == Rm.SHARDED:
+        return cfg.get('shard_bot_run_mode', Rm.THREAD)
+    return run_mode
+
+
 class ParentBot:
 
-    def __init__(self, bot_name, api_bot, start_bot=False):
+    def __init__(self, bot_name, api_bot, start_bot=False, bot_loop=None, quote_engine=None):
 
         self.bot_name = bot_name
         self.api_bot = api_bot
+        self.bot_loop = bot_loop
+        self.quote_engine = quote_engine
         self.token_params_list = None
+        self.stop_bot_event = Event()  # Set to stop all of this bot's TokenBots
+        self.async_stop_event = asyncio.Event()  # Async mode only: set on the bot loop along with stop_bot_event
         self.cfg = Mhf.load_config_file_etc()
         logging.info(f"Domain is {self.cfg['infinity_url']}")
+        self.run_mode = get_run_mode(self.cfg)
+        if self.run_mode == Rm.ASYNC and self.bot_loop is None:
+            raise Exception(f'No bot loop passed to {self.bot_name} for run mode {self.run_mode}')
+        if self.run_mode == Rm.CENTRAL and self.quote_engine is None:
+            raise Exception(f'No quote engine passed to {self.bot_name} for run mode {self.run_mode}')
         self.maxBorrowUSDForAccount = None
         self.maxLendUSDForAccount = None
         self.get_account_params()
         self.get_tokens_and_token_params()
         self.threads = self.prepare_threads()  # Prepare threads
+        self.tasks = []  # Async mode only
         self.lock = Lock()
         if start_bot:
             self.start_bot()
@@ -52,8 +86,8 @@ class ParentBot:
 
     def check_bot_checker(self):
         # Add loop, say every minute, check if all bots are running. If some are not, add those threads. (If possible.)
-        sleep(60)
-        while True:
+        self.stop_bot_event.wait(60)
+        while not self.stop_bot_event.is_set():
             with self.lock:
                 i = 0
                 current_thread_list_length = len(self.threads)
@@ -66,11 +100,11 @@ class ParentBot:
                                                        daemon=True))
                             self.threads[-1].start()
                             break
-            sleep(60)
+            self.stop_bot_event.wait(60)
 
     def check_bots(self):
-        sleep(60)
-        while True:
+        self.stop_bot_event.wait(60)
+        while not self.stop_bot_event.is_set():
             with self.lock:
                 i = 0
                 current_thread_list_length = len(self.threads)
@@ -95,23 +129,26 @@ class ParentBot:
                                     del self.threads[i]
                                     self.threads.append(
                                         Thread(name='TB__' + bot_name + '__' + token.token + '__' + tenor,
-                                               target=Tb.TokenBot,
-                                               args=(bot_name, self.api_bot,
-                                                     token.token, tenor,
-                                                     token.orderType,
-                                                     token.startDelayMinute,
-                                                     token.botSpeed,
-                                                     token.orderSizeUSD,
-                                                     token.rateOffsetRef,
-                                                     token.rateOffsetBPS,
-                                                     self.maxBorrowUSDForAccount, self.maxLendUSDForAccount,
-                                                     token.maxBorrowUSDForToken, token.maxLendUSDForToken,
-                                                     token.orderBookMinUSD, token.orderBookMaxUSD,
-                                                     token.maxLimitOrdersPerSide,
-                                                     self.cfg['token_bot_heartbeat_refresh_minutes']),
+                                               target=self.create_token_bot, args=(token, tenor),
                                                daemon=True))
                                     self.threads[-1].start()
-            sleep(60)
+            self.stop_bot_event.wait(60)
+
+    def create_token_bot(self, token, tenor, start_bot=True):
+        return Tb.TokenBot(self.bot_name, self.api_bot,
+                           token.token, tenor,
+                           token.orderType,
+                           token.startDelayMinute,
+                           token.botSpeed,
+                           token.orderSizeUSD,
+                           token.rateOffsetRef,
+                           token.rateOffsetBPS,
+                           self.maxBorrowUSDForAccount, self.maxLendUSDForAccount,
+                           token.maxBorrowUSDForToken, token.maxLendUSDForToken,
+                           token.orderBookMinUSD, token.orderBookMaxUSD,
+                           token.maxLimitOrdersPerSide,
+                           start_bot,
+                           **self.get_token_bot_kwargs(token))
 
     def get_account_params(self):
         try:
@@ -120,6 +157,16 @@ class ParentBot:
         except Exception as e:
             raise Exception(f'Error {e} - Cannot retrieve account parameters')
 
+    def get_token_bot_kwargs(self, token):
+        # Optional TokenBot params, which all come after start_bot
+        return {'quote_tolerance_ticks': token.quoteToleranceTicks,
+                'stop_bot_event': self.stop_bot_event,
+                'wake_on_updates': token.wakeOnUpdates,
+                'max_idle_seconds': self.cfg.get('token_bot_max_idle_seconds', 60),
+                'ladder_levels': token.ladderLevels,
+                'ladder_offset_step_bps': token.ladderOffsetStepBPS,
+                'ladder_size_usd': token.ladderSizeUSD}
+
     def get_tokens(self):
         if self.bot_name in self.cfg:
             tokens = copy.copy(self.cfg[self.bot_name]['tokens'])
@@ -156,36 +203,55 @@ class ParentBot:
 
     def prepare_threads(self):
         threads = []
+        if self.run_mode in (Rm.ASYNC, Rm.CENTRAL):  # TokenBots run as coroutines or in the quote engine instead
+            return threads
         threads.append(Thread(name='botChecker_' + self.bot_name, target=self.check_bots, daemon=True))
         threads.append(Thread(name='botCheckerChecker_' + self.bot_name, target=self.check_bot_checker, daemon=True))
         for token in self.token_params_list:
             tenors_to_use = get_tenors_to_use(token.tenors, token.token)
             for tenor in tenors_to_use:
                 threads.append(Thread(name='TB__' + self.bot_name + '__' + token.token + '__' + tenor,
-                                      target=Tb.TokenBot,
-                                      args=(self.bot_name, self.api_bot,
-                                            token.token, tenor,
-                                            token.orderType,
-                                            token.startDelayMinute,
-                                            token.botSpeed,
-                                            token.orderSizeUSD,
-                                            token.rateOffsetRef,
-                                            token.rateOffsetBPS,
-                                            self.maxBorrowUSDForAccount, self.maxLendUSDForAccount,
-                                            token.maxBorrowUSDForToken, token.maxLendUSDForToken,
-                                            token.orderBookMinUSD, token.orderBookMaxUSD,
-                                            token.maxLimitOrdersPerSide),
+                                      target=self.create_token_bot, args=(token, tenor),
                                       daemon=True))
         return threads
 
     def start_bot(self):
         for t in self.threads:  # Start threads
             t.start()
+        if self.run_mode == Rm.ASYNC:
+            for token in self.token_params_list:
+                for tenor in get_tenors_to_use(token.tenors, token.token):
+                    self.tasks.append(self.bot_loop.submit(self.supervise_token_bot(token, tenor)))
+        elif self.run_mode == Rm.CENTRAL:
+            for token in self.token_params_list:
+                for tenor in get_tenors_to_use(token.tenors, token.token):
+                    self.quote_engine.add_token_bot(self.create_token_bot(token, tenor, False))
+
+    async def supervise_token_bot(self, token, tenor):
+        # Coroutine equivalent of check_bots: restart the TokenBot if its loop dies
+        task_name = 'TB__' + self.bot_name + '__' + token.token + '__' + tenor
+        while not self.stop_bot_event.is_set():
+            try:
+                token_bot = self.create_token_bot(token, tenor, False)
+                await token_bot.start_bot_async(self.bot_loop, self.async_stop_event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.warning(f'Error {e} - Restarting task for {task_name}')
+            if self.stop_bot_event.is_set() or await self.bot_loop.wait_for(self.async_stop_event, 60):
+                break
 
     def stop_bot(self):
         logging.info('Stopping child bots for ' + self.bot_name)
         self.stop_bot_event.set()
+        if self.bot_loop is not None:
+            self.bot_loop.loop.call_soon_threadsafe(self.async_stop_event.set)
+        self.api_bot.change_notifier.notify_all()  # Wake any TokenBots waiting for market data changes
 
     def wait_for_bot_to_stop(self):
+        if self.run_mode == Rm.CENTRAL:
+            self.stop_bot_event.wait()
         for t in self.threads:
             t.join()
+        for task in self.tasks:
+            task.result()
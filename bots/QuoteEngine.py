@@ -0,0 +1,365 @@
+from bots import TokenBot as Tb
+from constants import OrderSide as Osi
+from constants import OrderType as Ot
+from constants import RateOffsetRef as Ror
+from contextlib import ExitStack
+import logging
+from misc import QuoteReconciler as Qr
+from misc import TickMath as Tm
+import numpy as np
+from threading import Event, Lock, Thread
+import time
+
+SIDES = (Osi.BORROW, Osi.LEND)  # Column order of every per-side array below
+SIDE_STRS = ('Borrow', 'Lend')
+SIDE_NUMS = (Osi.BORROW_NUM, Osi.LEND_NUM)
+OFFSET_SIGNS = np.array([-1.0, 1.0])  # Borrow below the reference rate, lend above it
+
+
+def get_group_ids(keys):
+    # Same id for equal keys, numbered in order of first appearance
+    group_ids = {}
+    return [group_ids.setdefault(key, len(group_ids)) for key in keys]
+
+
+def get_grouped_cumsum(values, group_ids):
+    # Running total of values within each group, in array order
+    order = np.argsort(group_ids, kind='stable')
+    sorted_values = values[order]
+    sorted_group_ids = group_ids[order]
+    cumsum = np.cumsum(sorted_values)
+    is_group_start = np.ones(len(values), dtype=bool)
+    is_group_start[1:] = sorted_group_ids[1:] != sorted_group_ids[:-1]
+    group_offsets = (cumsum - sorted_values)[is_group_start][np.cumsum(is_group_start) - 1]
+    grouped_cumsum = np.empty(len(values))
+    grouped_cumsum[order] = cumsum - group_offsets
+    return grouped_cumsum
+
+
+def get_rows(values, row_indexes):
+    # One value per TokenBot -> a column with one value per row
+    return np.asarray(values)[row_indexes][:, None]
+
+
+class QuoteEngine:
+
+    # Quotes every TokenBot added to it from one thread (bot_run_mode central). Each tick takes one market snapshot,
+    # picks the TokenBots that are due (every 1 / botSpeed seconds, or on market data changes if wakeOnUpdates), then
+    # computes reference rates, quote ladders, tick rounding and limit checks for all of them at once as arrays, and
+    # sends each TokenBot's orders through InfinityApiBot.send_orders_batch. Orders going out in the same tick count
+    # towards the book, token and account limits of those after them, so the checks are never looser than quoting one
+    # TokenBot at a time. The only API calls made in a tick are the cancels and new orders: the rates that mids are
+    # taken from are fetched on a separate thread every quote_engine_rate_refresh_seconds (see refresh_rates).
+
+    def __init__(self, api_bot, ticks_per_second=10, start_engine=True):
+        self.api_bot = api_bot
+        self.ticks_per_second = ticks_per_second
+        self.lock = Lock()
+        self.token_bots = []
+        self.next_run_times = {}  # TokenBot -> earliest time it is next quoted
+        self.last_run_times = {}
+        self.changed_token_bots = set()  # wakeOnUpdates TokenBots whose market data changed since last quoted
+        self.stop_engine_event = Event()
+        self.stats = {'ticks': 0, 'quotes': 0, 'orders_sent': 0, 'total_tick_seconds': 0.0, 'max_tick_seconds': 0.0}
+        self.rate_refresh_seconds = self.api_bot.cfg.get('quote_engine_rate_refresh_seconds', 1.0)
+        self.refresh_rates_event = Event()  # Set to refresh rates straight away, e.g. for a TokenBot just added
+        self.thread = Thread(name='quoteEngine', target=self.run_loop, daemon=True)
+        self.rates_thread = Thread(name='quoteEngineRates', target=self.run_rates_loop, daemon=True)
+        if start_engine:
+            self.start_engine()
+
+    def add_token_bot(self, token_bot):
+        with self.lock:
+            self.token_bots.append(token_bot)
+            self.next_run_times[token_bot] = time.monotonic() + token_bot.startDelayMinute
+            self.last_run_times[token_bot] = time.monotonic()
+            self.changed_token_bots.add(token_bot)  # Quoted as soon as its start delay is over
+        self.refresh_rates_event.set()
+        if token_bot.wakeOnUpdates:
+            token_bot.subscribe_to_changes(lambda: self.mark_changed(token_bot))
+
+    def cancel_orders_batch(self, order_ids, is_floating_market, subscription_ids_by_order_id):
+        # Cancelled without waking the TokenBots cancelling them, as in TokenBot.cancel_own_orders
+        change_notifier = self.api_bot.change_notifier
+        for order_id in order_ids:
+            if subscription_ids_by_order_id.get(order_id) is not None:
+                change_notifier.ignore_removals([order_id], subscription_ids_by_order_id[order_id])
+        try:
+            self.api_bot.cancel_orders_batch(order_ids, is_floating_market)
+        finally:
+            change_notifier.stop_ignoring_removals(order_ids)
+
+    def get_due_token_bots(self, now):
+        with self.lock:
+            for token_bot in [tb for tb in self.token_bots if tb.stop_bot_event.is_set()]:
+                self.remove_token_bot(token_bot)
+            due_token_bots = []
+            for token_bot in self.token_bots:
+                if now < self.next_run_times[token_bot]:
+                    continue
+                if token_bot.wakeOnUpdates and token_bot not in self.changed_token_bots \
+                        and now - self.last_run_times[token_bot] < token_bot.maxIdleSeconds:
+                    continue
+                due_token_bots.append(token_bot)
+                self.changed_token_bots.discard(token_bot)
+                self.next_run_times[token_bot] = now + 1.0 / float(token_bot.botSpeed)
+                self.last_run_times[token_bot] = now
+            return due_token_bots
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, token_bots=len(self.token_bots))
+
+    def log_stats(self):
+        stats = self.get_stats()
+        mean_tick_seconds = stats['total_tick_seconds'] / stats['ticks'] if stats['ticks'] > 0 else 0.0
+        logging.info(f"Quote engine:\ttoken bots {stats['token_bots']}\tticks {stats['ticks']}\t"
+                     + f"quotes {stats['quotes']}\torders sent {stats['orders_sent']}\t"
+                     + f"mean tick {mean_tick_seconds * 1000:.1f}ms\tmax tick {stats['max_tick_seconds'] * 1000:.1f}ms")
+
+    def mark_changed(self, token_bot):
+        with self.lock:
+            self.changed_token_bots.add(token_bot)
+
+    def quote_token_bots(self, token_bots):
+        # Called with every TokenBot's market_lock held. Returns the number of orders sent.
+        market_snapshot = self.api_bot.get_market_snapshot()
+        # Inputs are gathered one TokenBot at a time, so that one that cannot be quoted is skipped alone
+        quoted_token_bots, days_to_maturity_list, bid_ask_and_mid_list, last_price_list = [], [], [], []
+        for token_bot in token_bots:
+            if token_bot.rateOffsetRef.lower() not in (Ror.BBA, Ror.MID):
+                logging.warning(f'Unrecognized value for rateOffsetRef for {token_bot.get_client_id()}. Skipping')
+                continue
+            token_bot.market_snapshot = market_snapshot
+            try:
+                days_to_maturity = self.api_bot.maturity_calendar.get_n_days(token_bot.tenor)
+                bid_ask_and_mid = token_bot.get_bid_ask_and_mid(days_to_maturity, True)
+                last_price = market_snapshot.get_last_price(token_bot.token_id) if bid_ask_and_mid is not None else None
+            except Exception as e:
+                logging.warning(f'Error {e} - Cannot get rates or price for {token_bot.get_client_id()}. Skipping')
+                continue
+            if bid_ask_and_mid is not None:
+                quoted_token_bots.append(token_bot)
+                days_to_maturity_list.append(days_to_maturity)
+                bid_ask_and_mid_list.append(bid_ask_and_mid)
+                last_price_list.append(last_price)
+        if len(quoted_token_bots) == 0:
+            return 0
+        token_bots = quoted_token_bots
+
+        # One row per TokenBot & ladder level (market orders are never laddered), one column per side (see SIDES)
+        is_market_order_by_token_bot = np.array([str(tb.orderType).strip().upper() == 'MARKET' for tb in token_bots])
+        n_levels = np.where(is_market_order_by_token_bot, 1, [tb.ladderLevels for tb in token_bots])
+        token_bot_indexes = np.repeat(np.arange(len(token_bots)), n_levels)  # Row -> TokenBot
+        first_rows = np.cumsum(n_levels) - n_levels  # TokenBot -> its level 0 row
+        levels = (np.arange(len(token_bot_indexes)) - first_rows[token_bot_indexes])[:, None]
+        is_market_order = is_market_order_by_token_bot[token_bot_indexes][:, None]
+        bid_ask_and_mid = np.array(bid_ask_and_mid_list, dtype=float)[token_bot_indexes]
+        best_rates, mid_rates = bid_ask_and_mid[:, 0:2], bid_ask_and_mid[:, 2:3]
+        is_bba = get_rows([tb.rateOffsetRef.lower() == Ror.BBA for tb in token_bots], token_bot_indexes)
+        rate_offset_bps = get_rows([float(tb.rateOffsetBPS) for tb in token_bots], token_bot_indexes) \
+            + levels * get_rows([float(tb.ladderOffsetStepBPS) for tb in token_bots], token_bot_indexes)
+        price_steps = get_rows([float(tb.priceStep) for tb in token_bots], token_bot_indexes)
+        quantity_steps = get_rows([float(tb.quantityStep) for tb in token_bots], token_bot_indexes)
+        order_usds = np.repeat(np.where(
+            levels == 0, get_rows([float(tb.orderSizeUSD) for tb in token_bots], token_bot_indexes),
+            get_rows([float(tb.ladderSizeUSD) for tb in token_bots], token_bot_indexes)), 2, axis=1)
+        last_prices = get_rows(last_price_list, token_bot_indexes)
+
+        # Reference rates & quote levels, in ticks
+        ref_rates = np.where(is_bba & (best_rates > 0), best_rates, mid_rates)
+        rate_ticks = Tm.to_ticks(np.where(
+            is_market_order, ref_rates, ref_rates + OFFSET_SIGNS * ref_rates * rate_offset_bps / 10000), price_steps)
+        quantity_ticks = Tm.to_ticks(order_usds / np.where(last_prices > 0, last_prices, np.inf), quantity_steps)
+        is_quotable = (ref_rates > 0) & (last_prices > 0)
+        for i, j in zip(*np.nonzero(~is_quotable[first_rows])):
+            logging.warning(f'Non-positive reference rate or price for {SIDE_STRS[j]} {token_bots[i].get_client_id()}.'
+                            + ' Skipping')
+
+        # Cancels: excess orders, or with quote diffing, resting orders that no longer match any level's new quote
+        order_ids_to_cancel = {True: [], False: []}  # Is floating market -> order ids
+        subscription_ids_by_order_id = {}  # Of the TokenBot cancelling each order
+        is_to_send = is_quotable.copy()
+        for i, token_bot in enumerate(token_bots):
+            resting_orders_by_side = market_snapshot.get_bid_n_ask_orders(
+                token_bot.this_market_id, token_bot.is_floating_market)
+            if token_bot.quoteToleranceTicks is None:
+                excess_order_ids = token_bot.get_excess_order_ids(*resting_orders_by_side)
+                order_ids_to_cancel[token_bot.is_floating_market].extend(excess_order_ids)
+                subscription_ids_by_order_id.update(dict.fromkeys(excess_order_ids, token_bot.subscription_id))
+                continue
+            if is_market_order_by_token_bot[i]:
+                continue
+            rows = list(range(first_rows[i], first_rows[i] + n_levels[i]))
+            for j, resting_orders in enumerate(resting_orders_by_side):
+                quotes = [(Tm.from_ticks(rate_ticks[row, j], token_bot.priceStep),
+                           Tm.from_ticks(quantity_ticks[row, j], token_bot.quantityStep), row)
+                          for row in rows if is_quotable[row, j]]
+                if len(quotes) == 0:  # Nothing to quote from, so leave resting orders alone
+                    continue
+                orders_to_cancel, quotes_to_place = Qr.reconcile_quotes(
+                    quotes, resting_orders, token_bot.priceStep, token_bot.quantityStep,
+                    token_bot.quoteToleranceTicks, token_bot.quoteToleranceTicks)
+                order_ids_to_cancel[token_bot.is_floating_market].extend(
+                    [order['orderId'] for order in orders_to_cancel])
+                subscription_ids_by_order_id.update(
+                    dict.fromkeys([order['orderId'] for order in orders_to_cancel], token_bot.subscription_id))
+                is_to_send[rows, j] = False
+                is_to_send[[quote[2] for quote in quotes_to_place], j] = True
+        for is_floating_market, order_ids in order_ids_to_cancel.items():
+            if len(order_ids) > 0:
+                self.cancel_orders_batch(order_ids, is_floating_market, subscription_ids_by_order_id)
+        if any(len(order_ids) > 0 for order_ids in order_ids_to_cancel.values()):
+            market_snapshot = self.api_bot.get_market_snapshot()  # Without the orders just cancelled
+
+        # Limit checks, in the same order as TokenBot.is_within_limits
+        total_orders_in_usd = np.array(
+            [[market_snapshot.get_total_orders_in_usd(tb.this_market_id, tb.is_floating_market, side,
+                                                      last_prices[first_rows[i], 0]) for side in SIDES]
+             for i, tb in enumerate(token_bots)])[token_bot_indexes]
+        exposures_by_token_id = {}  # None if they cannot be got, in which case that token's TokenBots send nothing
+        for tb in token_bots:
+            if tb.token_id not in exposures_by_token_id:
+                try:
+                    exposures_by_token_id[tb.token_id] = \
+                        self.api_bot.get_current_positions_and_orders_in_usd(tb.token_id)
+                except Exception as e:
+                    logging.warning(f'Error {e} - Cannot get positions and orders for {tb.token}. Skipping')
+                    exposures_by_token_id[tb.token_id] = None
+        is_to_send &= get_rows([exposures_by_token_id[tb.token_id] is not None for tb in token_bots], token_bot_indexes)
+        exposures = np.array([exposures_by_token_id[tb.token_id] or (0.0, 0.0, 0.0, 0.0) for tb in token_bots],
+                             dtype=float)[token_bot_indexes]
+        token_totals_usd, wallet_totals_usd = exposures[:, 0:2], exposures[:, 2:4]
+        max_usds_for_token = np.array([[tb.maxBorrowUSDForToken, tb.maxLendUSDForToken] for tb in token_bots],
+                                      dtype=float)[token_bot_indexes]
+        max_usds_for_account = np.array([[tb.maxBorrowUSDForAccount, tb.maxLendUSDForAccount] for tb in token_bots],
+                                        dtype=float)[token_bot_indexes]
+        order_book_max_usds = get_rows([float(tb.orderBookMaxUSD) for tb in token_bots], token_bot_indexes)
+        market_ids = get_rows(get_group_ids([(tb.is_floating_market, tb.this_market_id) for tb in token_bots]),
+                              token_bot_indexes)
+        token_ids = get_rows(get_group_ids([tb.token_id for tb in token_bots]), token_bot_indexes)
+        side_ids = np.array([[0, 1]] * len(token_bot_indexes))
+
+        book_order_usds = get_grouped_cumsum(
+            np.where(is_to_send & ~is_market_order, order_usds, 0.0).ravel(),
+            (market_ids * 2 + side_ids).ravel()).reshape(-1, 2)
+        is_within_book = is_to_send & (is_market_order | (total_orders_in_usd + book_order_usds < order_book_max_usds))
+        token_order_usds = get_grouped_cumsum(
+            np.where(is_within_book, order_usds, 0.0).ravel(), (token_ids * 2 + side_ids).ravel()).reshape(-1, 2)
+        is_within_token = is_within_book & (token_totals_usd + token_order_usds < max_usds_for_token)
+        wallet_order_usds = get_grouped_cumsum(
+            np.where(is_within_token, order_usds, 0.0).ravel(), side_ids.ravel()).reshape(-1, 2)
+        is_within_account = is_within_token & (wallet_totals_usd + wallet_order_usds < max_usds_for_account)
+
+        orders_by_token_bot_index = {}  # Each TokenBot's whole ladder is sent as one batch
+        for row, j in zip(*np.nonzero(is_to_send)):
+            token_bot = token_bots[token_bot_indexes[row]]
+            side_str = SIDE_STRS[j]
+            order_usd = order_usds[row, j]
+            if not is_within_book[row, j]:
+                Tb.log_limit_breach('orderBookMaxUSD', token_bot.orderBookMaxUSD,
+                                    f'total_{side_str.lower()}_orders_in_usd',
+                                    total_orders_in_usd[row, j] + book_order_usds[row, j] - order_usd, order_usd)
+                continue
+            if not is_within_token[row, j]:
+                Tb.log_limit_breach(f'max{side_str}USDForToken', max_usds_for_token[row, j],
+                                    f'token_total_{side_str.lower()}_usd',
+                                    token_totals_usd[row, j] + token_order_usds[row, j] - order_usd, order_usd)
+                continue
+            wallet_total_usd = wallet_totals_usd[row, j] + wallet_order_usds[row, j] - order_usd
+            if is_within_account[row, j]:  # Checked again as the order is recorded, e.g. against other shards' orders
+                is_within_account[row, j], wallet_total_usd = self.api_bot.reserve_account_usd(
+                    SIDES[j], order_usd, wallet_total_usd, max_usds_for_account[row, j])
+            if not is_within_account[row, j]:
+                Tb.log_limit_breach(f'max{side_str}USDForAccount', max_usds_for_account[row, j],
+                                    f'wallet_total_{side_str.lower()}_usd', wallet_total_usd, order_usd)
+                continue
+            orders_by_token_bot_index.setdefault(token_bot_indexes[row], []).append((
+                token_bot.this_market_id, token_bot.is_floating_market,
+                Ot.MARKET_NUM if is_market_order[row, 0] else Ot.LIMIT_NUM, SIDE_NUMS[j],
+                Tm.to_decimal(quantity_ticks[row, j], token_bot.quantityStep),
+                Tm.to_decimal(rate_ticks[row, j], token_bot.priceStep), None, None,
+                token_bot.token + ' : ' + str(days_to_maturity_list[token_bot_indexes[row]]), int(levels[row, 0])))
+        n_orders_sent = 0
+        for i, orders in orders_by_token_bot_index.items():
+            try:
+                with self.api_bot.rate_budget.as_client(token_bots[i].get_client_id()):
+                    self.api_bot.send_orders_batch(orders)
+                n_orders_sent = n_orders_sent + len(orders)
+            except Exception as e:
+                logging.warning(f'Error {e} - Cannot send orders for {token_bots[i].get_client_id()}')
+        return n_orders_sent
+
+    def refresh_rates(self):
+        # Fetches the rates behind the mids of all TokenBots (see TokenBot.get_bid_ask_and_mid), once per market
+        with self.lock:
+            token_bots = list(self.token_bots)
+        floating_market_ids = set(tb.floating_market_id for tb in token_bots if tb.floating_market_id is not None)
+        fixed_market_ids = set(tb.this_market_id for tb in token_bots
+                               if not tb.is_floating_market and tb.this_market_id is not None)
+        for market_id in floating_market_ids:  # Also for fixed TokenBots, as the yield curve starts from it
+            try:
+                self.api_bot.get_floating_rate_market_history(market_id)
+            except Exception as e:
+                logging.warning(f'Error {e} - Cannot get floating rate for market id {market_id}')
+        for market_id in fixed_market_ids:
+            try:
+                self.api_bot.get_recent_fixed_rate_market_transactions(market_id)
+            except Exception as e:
+                logging.warning(f'Error {e} - Cannot get recent transactions for market id {market_id}')
+
+    def remove_token_bot(self, token_bot):
+        # Called with self.lock held
+        token_bot.unsubscribe_from_changes()
+        self.token_bots.remove(token_bot)
+        del self.next_run_times[token_bot]
+        del self.last_run_times[token_bot]
+        self.changed_token_bots.discard(token_bot)
+        logging.info(f'Stopped {token_bot.bot_name} {token_bot.token} {token_bot.tenor}')
+
+    def run_loop(self):
+        logging.info(f'Quote engine started ({self.ticks_per_second} ticks a second)')
+        last_stats_time = time.monotonic()
+        while not self.stop_engine_event.is_set():
+            start_time = time.monotonic()
+            self.run_one_tick(start_time)
+            if start_time - last_stats_time >= 60:
+                self.log_stats()
+                last_stats_time = start_time
+            self.stop_engine_event.wait(max(0.0, 1.0 / float(self.ticks_per_second) - (time.monotonic() - start_time)))
+
+    def run_rates_loop(self):
+        while not self.stop_engine_event.is_set():
+            self.refresh_rates_event.clear()
+            self.refresh_rates()
+            self.refresh_rates_event.wait(self.rate_refresh_seconds)
+
+    def run_one_tick(self, now):
+        token_bots = self.get_due_token_bots(now)
+        if len(token_bots) == 0:
+            return
+        n_orders_sent = 0
+        try:
+            with ExitStack() as stack:
+                for token_bot in token_bots:  # So a rollover never re-maps a market mid-tick
+                    stack.enter_context(token_bot.market_lock)
+                n_orders_sent = self.quote_token_bots(token_bots)
+        except Exception as e:
+            logging.warning(f'Error {e} - Quote engine tick failed')
+        tick_seconds = time.monotonic() - now
+        with self.lock:
+            self.stats['ticks'] = self.stats['ticks'] + 1
+            self.stats['quotes'] = self.stats['quotes'] + len(token_bots)
+            self.stats['orders_sent'] = self.stats['orders_sent'] + n_orders_sent
+            self.stats['total_tick_seconds'] = self.stats['total_tick_seconds'] + tick_seconds
+            self.stats['max_tick_seconds'] = max(self.stats['max_tick_seconds'], tick_seconds)
+
+    def start_engine(self):
+        if not self.rates_thread.is_alive():
+            self.rates_thread.start()
+        if not self.thread.is_alive():
+            self.thread.start()
+
+    def stop_engine(self):
+        self.stop_engine_event.set()
+        self.refresh_rates_event.set()
@@ -0,0 +1,246 @@
+from bots import InfinityApiBot as Inf
+from bots import InfinityWsFeed as Iwf
+from bots import ParentBot as Bot
+from constants import OrderStatus as Ost
+from constants import WsChannel as Wsc
+import copy
+import logging
+from misc import AccountLedger as Al
+from misc import MiscHelperFunctions as Mhf
+from misc import RateBudget as Rb
+import multiprocessing
+import os
+import queue
+import signal
+from threading import Event, Thread
+import time
+
+ORDERS_AS_OF = 'ordersAsOf'  # Feed channel with the time.time() the orders sent so far were taken from the API
+STOP = 'stop'  # Feed channel telling a shard to stop its bots and exit
+
+
+def create_rate_budget_buckets(cfg):
+    # For the coordinator's InfinityApiBot, so that it and every shard share one rate budget
+    return Rb.create_buckets(cfg.get('rate_budget_per_second', {}), cfg.get('rate_budget_burst', {}), get_context())
+
+
+def get_context():
+    return multiprocessing.get_context('spawn')  # Not fork, as the coordinator already has threads running
+
+
+def get_n_tokens(cfg, bot_name):
+    return len([token for token in cfg[bot_name]['tokens'] if token != 'all'])
+
+
+def get_shards(cfg, bot_names, n_shards):
+    # Spreads the bots over n_shards lists of bot names: biggest bot first, each onto the shard with fewest tokens
+    shards = [[] for _ in range(n_shards)]
+    n_tokens_by_shard = [0] * n_shards
+    for bot_name in sorted(bot_names, key=lambda name: get_n_tokens(cfg, name), reverse=True):
+        i = n_tokens_by_shard.index(min(n_tokens_by_shard))
+        shards[i].append(bot_name)
+        n_tokens_by_shard[i] = n_tokens_by_shard[i] + get_n_tokens(cfg, bot_name)
+    return shards
+
+
+def run_shard(shard_index, bot_names, feed_queue, account_ledger, rate_budget_buckets, shared_send_orders, verify,
+              send_orders, cancel_orders):
+    # Shard process: own InfinityApiBot, fed by the coordinator rather than polling for market data itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl-C is handled by the coordinator's KillSwitch
+    Mhf.set_up_logging()
+    account_ledger.set_shard_index(shard_index)
+    api_bot = Inf.InfinityApiBot(verify, send_orders, cancel_orders, False, rate_budget_buckets)
+    api_bot.account_ledger = account_ledger
+    api_bot.shared_send_orders = shared_send_orders
+    api_bot.ws_feed = ShardFeedClient(api_bot, feed_queue)
+    api_bot.start_bot()
+    logging.info(f'Shard {shard_index} (pid {os.getpid()}) running {bot_names}')
+
+    bots = Bot.create_parent_bots(bot_names, api_bot)
+    for bot in bots:
+        bot.start_bot()
+    api_bot.ws_feed.stopped.wait()
+    api_bot.send_orders = False
+    for bot in bots:
+        bot.stop_bot()
+    for bot in bots:
+        bot.wait_for_bot_to_stop()
+    logging.info(f'Shard {shard_index} stopped')
+
+
+class ShardCoordinator:
+
+    # bot_run_mode sharded: ParentBots are spread over shard_processes worker processes (see run_shard), each with its
+    # own InfinityApiBot and GIL. This process's InfinityApiBot is the only one polling or streaming market data, and
+    # forwards every change to all shards as WebSocket feed messages (see constants.WsChannel). Account limits are
+    # checked across shards through a shared AccountLedger, and REST calls go through the api_bot's rate budget buckets,
+    # which must be shared (see create_rate_budget_buckets). Stopped like a ParentBot, so main & KillSwitch can use it
+    # as one.
+
+    def __init__(self, api_bot, bot_names, verify=True, send_orders=True, cancel_orders=True, start_bot=False):
+        self.api_bot = api_bot
+        self.cfg = Mhf.load_config_file_etc()
+        n_shards = max(1, min(self.cfg.get('shard_processes') or os.cpu_count(), len(bot_names)))
+        self.shards = get_shards(self.cfg, bot_names, n_shards)
+        self.feed_interval_seconds = self.cfg.get('shard_feed_interval_seconds', 0.1)
+        self.stop_timeout_seconds = self.cfg.get('shard_stop_timeout_seconds', 10)
+        context = get_context()
+        rate_budget_buckets = self.api_bot.rate_budget.buckets
+        if not all(isinstance(bucket, Rb.SharedTokenBucket) for bucket in rate_budget_buckets.values()):
+            raise Exception('Sharded run mode needs the InfinityApiBot built with create_rate_budget_buckets')
+        # Never shorter than two of this process's order refreshes, as without a WS feed the shards only see orders then
+        order_refresh_seconds = self.cfg['inf_api_bot_refresh_minutes'] * 60
+        self.account_ledger = Al.AccountLedger(
+            n_shards, max(self.cfg.get('shard_account_ledger_ttl_seconds', 0.0), 2 * order_refresh_seconds), context,
+            self.cfg.get('shard_account_ledger_max_orders', 1024))
+        self.feed_queues = [context.Queue() for _ in range(n_shards)]
+        self.shared_send_orders = context.Value('b', 1, lock=False)  # Switched off by stop_bot, for every shard at once
+        self.processes = [context.Process(name=f'shard_{i}', target=run_shard,
+                                          args=(i, shard_bot_names, self.feed_queues[i], self.account_ledger,
+                                                rate_budget_buckets, self.shared_send_orders, verify, send_orders,
+                                                cancel_orders),
+                                          daemon=True)
+                          for i, shard_bot_names in enumerate(self.shards)]
+        self.stop_bot_event = Event()
+        self.stop_time = None
+        self.last_version = None
+        self.last_prices = None
+        self.last_bid_asks = {}  # Token id -> last bid/ask sent
+        self.last_orders = {True: {}, False: {}}  # Is floating market -> {order id: last order sent}
+        self.last_orders_as_of_time = None
+        self.feed_thread = Thread(name='shardFeed', target=self.run_feed, daemon=True)
+        if start_bot:
+            self.start_bot()
+
+    def get_feed_messages(self):
+        # Everything changed since the last call, as WebSocket feed messages. All of it on the first call.
+        messages = []
+        # Copies, as the queue pickles messages later on its own thread
+        prices = [dict(token) for token in self.api_bot.get_market_snapshot().floating_tokens_and_prices.values()]
+        if prices != self.last_prices:
+            messages.append({'channel': Wsc.PRICES, 'data': prices})
+            self.last_prices = prices
+        for token_id, bid_ask in dict(self.api_bot.bid_ask_last_rates).items():
+            if bid_ask != self.last_bid_asks.get(token_id):
+                bid_ask = copy.deepcopy(bid_ask)
+                messages.append({'channel': Wsc.BID_ASK, 'data': {**bid_ask, 'tokenId': token_id}})
+                self.last_bid_asks[token_id] = bid_ask
+        orders_as_of_time = self.api_bot.active_orders_as_of_time  # Before the orders, so never newer than them
+        for is_floating_market, channel in ((True, Wsc.FLOATING_ORDERS), (False, Wsc.FIXED_ORDERS)):
+            if is_floating_market:
+                active_orders = self.api_bot.active_floating_orders
+            else:
+                active_orders = self.api_bot.active_fixed_orders
+            orders = {order['orderId']: dict(order) for order in active_orders}
+            last_orders = self.last_orders[is_floating_market]
+            changed_orders = [order for order_id, order in orders.items() if last_orders.get(order_id) != order]
+            # Removed orders are sent as no longer on book, which is all a shard needs to drop them
+            changed_orders.extend([{**order, 'status': Ost.STATUS_DONE} for order_id, order in last_orders.items()
+                                   if order_id not in orders])
+            if len(changed_orders) > 0:
+                messages.append({'channel': channel, 'data': changed_orders})
+            self.last_orders[is_floating_market] = orders
+        if orders_as_of_time != self.last_orders_as_of_time:  # Even if no order changed, e.g. one sent & cancelled
+            messages.append({'channel': ORDERS_AS_OF, 'data': orders_as_of_time})
+            self.last_orders_as_of_time = orders_as_of_time
+        return messages
+
+    def run_feed(self):
+        last_orders_sync_time = time.time()
+        while not self.stop_bot_event.is_set():
+            # The shards only drop orders from their AccountLedger once the orders data is newer than them, so it is
+            # re-synced over REST if neither the feed nor the REST refresh has updated it for half the ledger's ttl
+            if self.api_bot.ok_to_update_active_orders and time.time() - max(
+                    self.api_bot.active_orders_as_of_time, last_orders_sync_time) > self.account_ledger.ttl_seconds / 2:
+                last_orders_sync_time = time.time()
+                self.api_bot.update_active_orders()
+            version = self.api_bot.get_market_snapshot().version
+            if version != self.last_version:
+                self.last_version = version
+                try:
+                    messages = self.get_feed_messages()
+                except Exception as e:
+                    logging.warning(f'Error {e} - Cannot forward market data to shards')
+                    messages = []
+                    self.last_version = None  # Retry
+                if len(messages) > 0:
+                    for feed_queue in self.feed_queues:
+                        feed_queue.put(messages)
+            self.stop_bot_event.wait(self.feed_interval_seconds)
+
+    def start_bot(self):
+        for i, process in enumerate(self.processes):
+            process.start()
+            logging.info(f'Started shard {i} (pid {process.pid}) for {self.shards[i]}')
+        self.feed_thread.start()
+
+    def stop_bot(self):
+        # Does not wait for the shards to stop (see wait_for_bot_to_stop), but no shard sends any order after this, so
+        # a KillSwitch can start cancelling straight away
+        logging.info('Stopping shards')
+        self.shared_send_orders.value = 0
+        self.stop_time = time.monotonic()
+        self.stop_bot_event.set()
+        for feed_queue in self.feed_queues:
+            feed_queue.put([{'channel': STOP}])
+
+    def wait_for_bot_to_stop(self):
+        # Until stop_bot is called (or every shard has exited), then for at most stop_timeout_seconds in all before
+        # terminating the shards still running
+        while not self.stop_bot_event.wait(1.0):
+            if not any(process.is_alive() for process in self.processes):
+                return
+        for i, process in enumerate(self.processes):
+            process.join(max(0.0, self.stop_time + self.stop_timeout_seconds - time.monotonic()))
+            if process.is_alive():
+                logging.warning(f'Shard {i} did not stop within {self.stop_timeout_seconds}s. Terminating it')
+                process.terminate()
+                process.join()
+
+
+class ShardFeedClient:
+
+    # Stands in for a shard's InfinityWsFeed (InfinityApiBot.ws_feed): applies the market data forwarded by the
+    # ShardCoordinator. Counts as connected once the first update has arrived, so the shard stops polling REST.
+
+    def __init__(self, api_bot, feed_queue):
+        self.api_bot = api_bot
+        self.feed_queue = feed_queue
+        self.connected = Event()
+        self.stopped = Event()
+        self.n_messages = 0
+        self.thread = Thread(name='shardFeedClient', target=self.run_loop, daemon=True)
+
+    def is_connected(self):
+        return self.connected.is_set()
+
+    def run_loop(self):
+        while not self.stopped.is_set():
+            try:
+                messages = self.feed_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError) as e:  # Coordinator gone
+                logging.warning(f'Error {e} - Shard feed closed. Stopping')
+                self.stopped.set()
+                return
+            for message in messages:
+                if message['channel'] == STOP:
+                    self.stopped.set()
+                    return
+                try:
+                    if message['channel'] == ORDERS_AS_OF:  # After the orders, which come first in the same messages
+                        self.api_bot.account_ledger.set_orders_as_of_time(message['data'])
+                    else:
+                        Iwf.apply_message(self.api_bot, message)
+                except Exception as e:
+                    logging.error(f"Error {e} - Cannot apply shard feed message for {message['channel']}")
+            self.n_messages = self.n_messages + len(messages)
+            self.connected.set()
+
+    def start_feed(self):
+        if not self.thread.is_alive():
+            self.thread.start()
+
+    def stop_feed(self):
+        self.stopped.set()
@@ -1,9 +1,18 @@
+import asyncio
 from constants import OrderSide as Osi
 from constants import OrderType as Ot
 from constants import RateOffsetRef as Ror
 import logging
-from misc import MiscHelperFunctions as Mhf
-from time import sleep
+from misc import ChangeNotifier as Cn
+from misc import QuoteReconciler as Qr
+from misc import TickMath as Tm
+from threading import Event, Lock
+import time
+
+
+def log_limit_breach(limit_name, limit_usd, total_name, total_usd, order_usd):
+    logging.warning(f'{limit_name} for breached\t\tDetails:\t{limit_name} ({limit_usd}) < {total_name} ({total_usd}) '
+                    + f'+ new_order_usd ({order_usd})')
 
 
 class TokenBot:
@@ -11,7 +20,9 @@ class TokenBot:
     def __init__(self, bot_name, api_bot, token, tenor, order_type, start_delay, bot_speed, order_size_usd,
                  rate_offset_ref, rate_offset_bps, max_borrow_usd_for_account, max_lend_usd_for_account,
                  max_borrow_usd_for_token, max_lend_usd_for_token, order_book_min_usd, order_book_max_usd,
-                 max_limit_orders_per_side, start_bot=True):
+                 max_limit_orders_per_side, start_bot=True, quote_tolerance_ticks=None,
+                 stop_bot_event=None, wake_on_updates=False, max_idle_seconds=60, ladder_levels=1,
+                 ladder_offset_step_bps=0, ladder_size_usd=None):
 
         self.bot_name = bot_name
         self.api_bot = api_bot
@@ -33,9 +44,25 @@ class TokenBot:
         self.orderBookMinUSD = order_book_min_usd
         self.orderBookMaxUSD = order_book_max_usd
         self.maxLimitOrdersPerSide = max_limit_orders_per_side
+        self.quoteToleranceTicks = quote_tolerance_ticks  # None: cancel excess & resend every loop. Else quote diffing.
+        self.stop_bot_event = stop_bot_event if stop_bot_event is not None else Event()  # Shared by a ParentBot's bots
+        # If wakeOnUpdates, loop when this bot's token or market data changes (at most botSpeed times a second, and at
+        # least once every maxIdleSeconds) rather than every 1 / botSpeed seconds
+        self.wakeOnUpdates = wake_on_updates
+        self.maxIdleSeconds = max_idle_seconds
+        # Limit orders are quoted as a ladder of ladderLevels orders per side. Level 0 is the usual orderSizeUSD quote
+        # at rateOffsetBPS, and each level after it is ladderOffsetStepBPS further from the reference rate.
+        self.ladderLevels = ladder_levels
+        self.ladderOffsetStepBPS = ladder_offset_step_bps
+        self.ladderSizeUSD = ladder_size_usd if ladder_size_usd is not None else order_size_usd
+        self.wake_callback = None
+        self.subscription_id = None
         self.wallet_id = self.api_bot.get_wallet_id()
+        self.market_snapshot = None  # Taken at the start of each iteration
+        self.market_lock = Lock()  # Held while quoting, so a rollover never re-maps the market mid-iteration
         self.token_id, self.floating_market_id, self.this_market_id, self.quantityStep, self.priceStep =\
             self.api_bot.get_token_id_and_relevant_market_id_etc(token, self.tenor)
+        self.api_bot.register_token_bot(self)
 
         if start_bot:
             self.start_bot()
@@ -57,35 +84,34 @@ class TokenBot:
 
     def cancel_all_orders(self):
         logging.info('Cancelling all orders...')
-        self.api_bot.cancel_all_orders(self.wallet_id, self.market_id)
+        self.api_bot.cancel_all_orders(self.wallet_id, self.this_market_id)
 
     def cancel_current_floating_orders(self):
-        orders = self.api_bot.get_floating_rate_orders(self.token_id, self.wallet_id)
-        bid_orders, ask_orders = Mhf.separate_bid_n_ask_orders(orders)
-        days_to_maturity = Mhf.convert_tenor_to_n_days(self.tenor)
+        bid_orders, ask_orders = self.market_snapshot.get_bid_n_ask_orders(self.this_market_id, True)
+        days_to_maturity = self.api_bot.maturity_calendar.get_n_days(self.tenor)
         if days_to_maturity != 0:
             raise Exception(f'self.days_to_maturity ({days_to_maturity}) != 0')
 
         # CANCEL ORDERS IF REACHED MAX NUMBER ORDERS IN ORDER BOOK
-        if len(bid_orders) > self.maxLimitOrdersPerSide:
-            for i in range(0, len(bid_orders) - self.maxLimitOrdersPerSide):
-                self.api_bot.cancel_floating_order(bid_orders[i]['orderId'])
-        if len(ask_orders) > self.maxLimitOrdersPerSide:
-            for i in range(0, len(ask_orders) - self.maxLimitOrdersPerSide):
-                self.api_bot.cancel_floating_order(ask_orders[i]['orderId'])
+        self.cancel_own_orders(self.get_excess_order_ids(bid_orders, ask_orders), True)
 
     def cancel_current_fixed_orders(self):
-        days_to_maturity = Mhf.convert_tenor_to_n_days(self.tenor)
-        orders = self.api_bot.get_fixed_rate_orders(self.token_id, days_to_maturity)
-        bid_orders, ask_orders = Mhf.separate_bid_n_ask_orders(orders)
+        bid_orders, ask_orders = self.market_snapshot.get_bid_n_ask_orders(self.this_market_id, False)
 
         # CANCEL ORDERS IF REACHED MAX NUMBER ORDERS IN ORDER BOOK
-        if len(bid_orders) > self.maxLimitOrdersPerSide:
-            for i in range(0, len(bid_orders) - self.maxLimitOrdersPerSide):
-                self.api_bot.cancel_fixed_order(bid_orders[i]['orderId'])
-        if len(ask_orders) > self.maxLimitOrdersPerSide:
-            for i in range(0, len(ask_orders) - self.maxLimitOrdersPerSide):
-                self.api_bot.cancel_fixed_order(ask_orders[i]['orderId'])
+        self.cancel_own_orders(self.get_excess_order_ids(bid_orders, ask_orders), False)
+
+    def cancel_own_orders(self, order_ids, is_floating_market):
+        # Cancelled without waking this bot, if it wakes on updates (see ChangeNotifier.ignore_removals)
+        change_notifier = self.api_bot.change_notifier
+        subscription_id = self.subscription_id
+        if subscription_id is not None:
+            change_notifier.ignore_removals(order_ids, subscription_id)
+        try:
+            return self.api_bot.cancel_orders_batch(order_ids, is_floating_market)
+        finally:
+            if subscription_id is not None:
+                change_notifier.stop_ignoring_removals(order_ids)
 
     def cancel_current_orders(self):
         logging.info(
@@ -100,29 +126,35 @@ class TokenBot:
         else:  # FIXED
             self.cancel_current_fixed_orders()
 
-    def send_new_floating_orders(self):
-        days_to_maturity = Mhf.convert_tenor_to_n_days(self.tenor)
-        orders = self.api_bot.get_floating_rate_orders(self.token_id, self.wallet_id)
-        bid_orders, ask_orders = Mhf.separate_bid_n_ask_orders(orders)
-        bid, ask = self.api_bot.get_best_bid_ask(self.token, True, days_to_maturity, 0)
-        # TODO - UN-FALSE THE FOLLOWING
-        if False:  # bid > 0 and ask > 0:
-            mid = (bid + ask) / 2
-        else:
-            mid = self.api_bot.get_floating_rate_market_history(self.floating_market_id)
-        last_price = self.api_bot.get_last_price(self.token)
-        total_bid_orders_in_usd = Mhf.get_total_orders_in_usd(bid_orders, last_price)
-        total_ask_orders_in_usd = Mhf.get_total_orders_in_usd(ask_orders, last_price)
+    def get_client_id(self):
+        return f'{self.bot_name}__{self.token}__{self.tenor}'
 
+    def get_excess_order_ids(self, bid_orders, ask_orders):
+        excess_order_ids = []
+        for orders in (bid_orders, ask_orders):
+            if len(orders) > self.maxLimitOrdersPerSide:
+                for i in range(0, len(orders) - self.maxLimitOrdersPerSide):
+                    excess_order_ids.append(orders[i]['orderId'])
+        return excess_order_ids
+
+    def get_level_order_usd(self, level):
+        return self.orderSizeUSD if level == 0 else self.ladderSizeUSD
+
+    def get_new_order_type_and_rate_levels(self, side, bid, ask, mid):
+        # Returns the order type and the rate of each ladder level
+        if side == Osi.BORROW:
+            best, best_str = bid, 'bid'
+        else:
+            best, best_str = ask, 'ask'
         match self.rateOffsetRef.lower():
             case Ror.BBA:
-                if bid > 0:
-                    ref = bid
+                if best > 0:
+                    ref = best
                 else:
                     if mid > 0:
                         ref = mid
                     else:
-                        raise Exception('Non-positive bid & mid')
+                        raise Exception(f'Non-positive {best_str} & mid')
             case Ror.MID:
                 if mid > 0:
                     ref = mid
@@ -130,81 +162,123 @@ class TokenBot:
                     raise Exception('Non-positive mid')
             case _:
                 raise Exception('Unrecognized value for rateOffsetRef')
+
         if str(self.orderType).strip().upper() == 'MARKET':
-            new_buy_order_type = Ot.MARKET_NUM
-            new_buy_order_rate_level = ref
+            return Ot.MARKET_NUM, [ref]  # Shouldn't matter what the rate is. Never laddered.
+        rate_offsets_bps = [self.rateOffsetBPS + level * self.ladderOffsetStepBPS for level in range(self.ladderLevels)]
+        if side == Osi.BORROW:  # LIMIT
+            return Ot.LIMIT_NUM, [ref - ref * rate_offset_bps / 10000 for rate_offset_bps in rate_offsets_bps]
         else:  # LIMIT
-            new_buy_order_type = Ot.LIMIT_NUM
-            new_buy_order_rate_level = ref - ref * self.rateOffsetBPS / 10000
-
-        match self.rateOffsetRef.lower():
-            case Ror.BBA:
-                if ask > 0:
-                    ref = ask
-                else:
-                    if mid > 0:
-                        ref = mid
-                    else:
-                        raise Exception('Non-positive ask & mid')
-            case Ror.MID:
-                if mid > 0:
-                    ref = mid
+            return Ot.LIMIT_NUM, [ref + ref * rate_offset_bps / 10000 for rate_offset_bps in rate_offsets_bps]
+
+    def cancel_stale_quotes(self, side, order_type, quotes):
+        # Quote diffing: cancel resting orders that no longer match any of the new quotes ([(rate, qty, level)]).
+        # Returns the quotes that still need to be placed, i.e. those no resting order already matches.
+        if order_type == Ot.MARKET_NUM:
+            return quotes
+        bid_orders, ask_orders = self.market_snapshot.get_bid_n_ask_orders(self.this_market_id, self.is_floating_market)
+        resting_orders = bid_orders if side == Osi.BORROW else ask_orders
+        # Same tolerance on quantity, as the USD order size converts to a slightly different qty whenever price moves
+        orders_to_cancel, quotes_to_place = Qr.reconcile_quotes(
+            quotes, resting_orders, self.priceStep, self.quantityStep, self.quoteToleranceTicks,
+            self.quoteToleranceTicks)
+        self.cancel_own_orders([order['orderId'] for order in orders_to_cancel], self.is_floating_market)
+        return quotes_to_place
+
+    def is_within_limits(self, side, order_type, order_usd, total_orders_in_usd, token_total_usd, wallet_total_usd):
+        # If is_limit_order AND current orderbook + order qty > maxQty (for token) then don't place order.
+        # If current position + current orderbook position + order qty > maxForToken then don't place order.
+        # If current positions + all current orderbook positions + order qty > maxForAccount then don't place order.
+        # Otherwise, place order.
+        if side == Osi.BORROW:
+            side_str = 'Borrow'
+            max_usd_for_token, max_usd_for_account = self.maxBorrowUSDForToken, self.maxBorrowUSDForAccount
+        else:
+            side_str = 'Lend'
+            max_usd_for_token, max_usd_for_account = self.maxLendUSDForToken, self.maxLendUSDForAccount
+
+        if order_type == Ot.MARKET_NUM or \
+                (order_type == Ot.LIMIT_NUM and total_orders_in_usd + order_usd < self.orderBookMaxUSD):
+            if token_total_usd + order_usd < max_usd_for_token:
+                is_within_account, wallet_total_usd = self.api_bot.reserve_account_usd(
+                    side == Osi.BORROW, order_usd, wallet_total_usd, max_usd_for_account)
+                if is_within_account:
+                    return True
                 else:
-                    raise Exception('Non-positive mid')
-            case _:
-                raise Exception('Unrecognized value for rateOffsetRef')
-
-        if self.orderType.strip().upper() == 'MARKET':
-            new_sell_order_type = Ot.MARKET_NUM
-            new_sell_order_rate_level = ref
+                    log_limit_breach(f'max{side_str}USDForAccount', max_usd_for_account,
+                                     f'wallet_total_{side_str.lower()}_usd', wallet_total_usd, order_usd)
+            else:
+                log_limit_breach(f'max{side_str}USDForToken', max_usd_for_token,
+                                 f'token_total_{side_str.lower()}_usd', token_total_usd, order_usd)
         else:
-            new_sell_order_type = Ot.LIMIT_NUM
-            new_sell_order_rate_level = ref + ref * self.rateOffsetBPS / 10000
-
-        new_buy_order_usd = self.orderSizeUSD
-        new_sell_order_usd = self.orderSizeUSD
-
-        # For each side:
-        #   If is_limit_order AND current orderbook + order qty > maxQty (for token) then don't place order.
-        #   If current position + current orderbook position + order qty > maxForToken then don't place order.
-        #   If current positions + all current orderbook positions + order qty > maxForAccount then don't place order.
-        #   Otherwise, place order.
-
+            log_limit_breach('orderBookMaxUSD', self.orderBookMaxUSD,
+                             f'total_{side_str.lower()}_orders_in_usd', total_orders_in_usd, order_usd)
+        return False
+
+    def send_new_quotes(self, bid, ask, mid, days_to_maturity):
+        last_price = self.market_snapshot.get_last_price(self.token_id)
+        order_types_and_quotes = {}  # Side -> (order type, [(rate, qty, level)]), rate & qty as exact whole ticks
+        for side in (Osi.BORROW, Osi.LEND):
+            order_type, rate_levels = self.get_new_order_type_and_rate_levels(side, bid, ask, mid)
+            rates = Tm.to_decimals(Tm.to_ticks(rate_levels, self.priceStep), self.priceStep)
+            qtys = Tm.to_decimals(Tm.to_ticks(
+                [self.get_level_order_usd(level) / last_price for level in range(len(rate_levels))],
+                self.quantityStep), self.quantityStep)
+            order_types_and_quotes[side] = (order_type, list(zip(rates, qtys, range(len(rate_levels)))))
+
+        if self.quoteToleranceTicks is not None:
+            for side, (order_type, quotes) in order_types_and_quotes.items():
+                order_types_and_quotes[side] = (order_type, self.cancel_stale_quotes(side, order_type, quotes))
+            self.market_snapshot = self.api_bot.get_market_snapshot()  # Without the orders just cancelled
+
+        # Totals taken after any cancels above
         token_total_borrow_usd, token_total_lend_usd, wallet_total_borrow_usd, wallet_total_lend_usd = \
             self.api_bot.get_current_positions_and_orders_in_usd(self.token_id)
-
-        if new_buy_order_type == Ot.MARKET_NUM or \
-                (new_buy_order_type == Ot.LIMIT_NUM and
-                 total_bid_orders_in_usd + new_buy_order_usd < self.orderBookMaxUSD):
-            if token_total_borrow_usd + new_buy_order_usd < self.maxBorrowUSDForToken:
-                if wallet_total_borrow_usd + new_buy_order_usd < self.maxBorrowUSDForAccount:
-                    new_buy_order_qty = new_buy_order_usd / last_price
-                    self.api_bot.send_order(
-                        self.this_market_id, self.is_floating_market, new_buy_order_type, Osi.BORROW_NUM,
-                        new_buy_order_qty, new_buy_order_rate_level, self.quantityStep, self.priceStep,
-                        self.token + ' : ' + str(days_to_maturity))
-
-        if new_sell_order_type == Ot.MARKET_NUM or \
-                (new_sell_order_type == Ot.LIMIT_NUM and
-                 total_ask_orders_in_usd + new_sell_order_usd < self.orderBookMaxUSD):
-            if token_total_lend_usd + new_sell_order_usd < self.maxLendUSDForToken:
-                if wallet_total_lend_usd + new_sell_order_usd < self.maxLendUSDForAccount:
-                    new_sell_order_qty = new_sell_order_usd / last_price
-                    self.api_bot.send_order(
-                        self.this_market_id, self.is_floating_market, new_sell_order_type, Osi.LEND_NUM,
-                        new_sell_order_qty, new_sell_order_rate_level, self.quantityStep, self.priceStep,
-                        self.token + ' : ' + str(days_to_maturity))
-
-    def send_new_fixed_orders(self):
-        days_to_maturity = Mhf.convert_tenor_to_n_days(self.tenor)
-        orders = self.api_bot.get_fixed_rate_orders(self.token_id, days_to_maturity)
-        bid_orders, ask_orders = Mhf.separate_bid_n_ask_orders(orders)
-        bid, ask = self.api_bot.get_best_bid_ask(self.token, False, days_to_maturity, 0)
-        # TODO UN-FALSE THE FOLLOWING:
+        for side, side_num, token_total_usd, wallet_total_usd in (
+                (Osi.BORROW, Osi.BORROW_NUM, token_total_borrow_usd, wallet_total_borrow_usd),
+                (Osi.LEND, Osi.LEND_NUM, token_total_lend_usd, wallet_total_lend_usd)):
+            order_type, quotes = order_types_and_quotes[side]
+            total_orders_in_usd = self.market_snapshot.get_total_orders_in_usd(
+                self.this_market_id, self.is_floating_market, side, last_price)
+            orders = []  # Whole ladder for this side, sent as one batch
+            for rate_level, qty, level in quotes:
+                order_usd = self.get_level_order_usd(level)
+                if self.is_within_limits(
+                        side, order_type, order_usd, total_orders_in_usd, token_total_usd, wallet_total_usd):
+                    orders.append((self.this_market_id, self.is_floating_market, order_type, side_num, qty, rate_level,
+                                   None, None, self.token + ' : ' + str(days_to_maturity), level))
+                    # Counted towards the limits of the levels after it
+                    total_orders_in_usd = total_orders_in_usd + order_usd
+                    token_total_usd = token_total_usd + order_usd
+                    wallet_total_usd = wallet_total_usd + order_usd
+            self.api_bot.send_orders_batch(orders)
+
+    def get_bid_ask_and_mid(self, days_to_maturity, is_cached_only=False):
+        # From self.market_snapshot. None if there is nothing to quote from. If is_cached_only, the mid is only taken
+        # from rates already fetched from the API (see QuoteEngine.refresh_rates), so no API call is made.
+        bid, ask = self.market_snapshot.get_best_bid_ask(self.token_id, self.is_floating_market, days_to_maturity)
+        if bid is None or ask is None:
+            if self.is_floating_market:
+                logging.warning(f'No best bid & ask for {self.token} {self.tenor}. Skipping')
+                return None
+            # Unquoted fixed tenor: quoted from its most recent trade, or else the yield curve, as the mid below
+            bid, ask = bid or 0.0, ask or 0.0
+        # TODO - UN-FALSE THE FOLLOWING
         if False:  # bid > 0 and ask > 0:
             mid = (bid + ask) / 2
+        elif self.is_floating_market:
+            if is_cached_only:
+                mid = self.api_bot.get_last_floating_rate(self.token_id)
+                if mid is None:
+                    logging.warning(f'No floating rate fetched yet for {self.token} {self.tenor}. Skipping')
+                    return None
+            else:
+                mid = self.api_bot.get_floating_rate_market_history(self.floating_market_id)
         else:
-            mid = self.api_bot.get_recent_fixed_rate_market_transactions(self.this_market_id)
+            if is_cached_only:
+                mid = self.api_bot.get_last_fixed_trade_rate(self.this_market_id)
+            else:
+                mid = self.api_bot.get_recent_fixed_rate_market_transactions(self.this_market_id)
             if mid is not None:
                 pass
             elif mid is None and bid > 0:
@@ -213,117 +287,11 @@ class TokenBot:
                 mid = ask
             else:
                 mid = self.api_bot.get_linearly_interpolated_rate(
-                    self.token, self.token_id, self.this_market_id, self.floating_market_id)
-
-        last_price = self.api_bot.get_last_price(self.token)
-        total_bid_orders_in_usd = Mhf.get_total_orders_in_usd(bid_orders, last_price)
-        total_ask_orders_in_usd = Mhf.get_total_orders_in_usd(ask_orders, last_price)
-
-        match self.rateOffsetRef.lower():
-            case Ror.BBA:
-                if bid > 0:
-                    ref = bid
-                else:
-                    if mid > 0:
-                        ref = mid
-                    else:
-                        raise Exception('Non-positive bid & mid')
-            case Ror.MID:
-                if mid > 0:
-                    ref = mid
-                else:
-                    raise Exception('Non-positive mid')
-            case _:
-                raise Exception('Unrecognized value for rateOffsetRef')
-
-        if self.orderType.strip().upper() == 'MARKET':
-            new_buy_order_type = Ot.MARKET_NUM
-            new_buy_order_rate_level = ref  # Shouldn't matter what this value is
-        else:
-            new_buy_order_type = Ot.LIMIT_NUM
-            new_buy_order_rate_level = ref - ref * self.rateOffsetBPS / 10000
-
-        match self.rateOffsetRef.lower():
-            case Ror.BBA:
-                if ask > 0:
-                    ref = ask
-                else:
-                    if mid > 0:
-                        ref = mid
-                    else:
-                        raise Exception('Non-positive ask & mid')
-            case Ror.MID:
-                if mid > 0:
-                    ref = mid
-                else:
-                    raise Exception('Non-positive mid')
-            case _:
-                raise Exception('Unrecognized value for rateOffsetRef')
-
-        if self.orderType.strip().upper() == 'MARKET':
-            new_sell_order_type = Ot.MARKET_NUM
-            new_sell_order_rate_level = ref
-        else:
-            new_sell_order_type = Ot.LIMIT_NUM
-            new_sell_order_rate_level = ref + ref * self.rateOffsetBPS / 10000
-
-        new_buy_order_usd = self.orderSizeUSD
-        new_sell_order_usd = self.orderSizeUSD
-
-        # For each side:
-        #   If is_limit_order AND current orderbook + order qty > maxQty (for token) then don't place order.
-        #   If current position + current orderbook position + order qty > maxForToken then don't place order.
-        #   If current positions + all current orderbook positions + order qty > maxForAccount then don't place order.
-        #   Otherwise, place order.
-
-        token_total_borrow_usd, token_total_lend_usd, wallet_total_borrow_usd, wallet_total_lend_usd = \
-            self.api_bot.get_current_positions_and_orders_in_usd(self.token_id)
-
-        if new_buy_order_type == Ot.MARKET_NUM or \
-            (new_buy_order_type == Ot.LIMIT_NUM and
-                total_bid_orders_in_usd + new_buy_order_usd < self.orderBookMaxUSD):
-            if token_total_borrow_usd + new_buy_order_usd < self.maxBorrowUSDForToken:
-                if wallet_total_borrow_usd + new_buy_order_usd < self.maxBorrowUSDForAccount:
-                    new_buy_order_qty = new_buy_order_usd / last_price
-                    self.api_bot.send_order(
-                        self.this_market_id, self.is_floating_market, new_buy_order_type, Osi.BORROW_NUM,
-                        new_buy_order_qty, new_buy_order_rate_level, self.quantityStep, self.priceStep,
-                        self.token + ' : ' + str(days_to_maturity))
-                else:
-                    logging.warning(f'maxBorrowUSDForAccount for breached\t\tDetails:\tmaxBorrowUSDForAccount '
-                                    + f'({self.maxBorrowUSDForAccount}) < wallet_total_borrow_usd '
-                                    + f'({wallet_total_borrow_usd}) + new_buy_order_usd ({new_buy_order_usd})')
-            else:
-                logging.warning(f'maxBorrowUSDForToken for breached\t\tDetails:\tmaxBorrowUSDForToken '
-                                + f'({self.maxBorrowUSDForToken}) < token_total_borrow_usd '
-                                + f'({token_total_borrow_usd}) + new_buy_order_usd ({new_buy_order_usd})')
-        else:
-            logging.warning(f'orderBookMaxUSD for breached\t\tDetails:\torderBookMaxUSD '
-                            + f'({self.orderBookMaxUSD}) < total_bid_orders_in_usd '
-                            + f'({total_bid_orders_in_usd}) + new_buy_order_usd ({new_buy_order_usd})')
-
-        if new_sell_order_type == Ot.MARKET_NUM or \
-                (new_sell_order_type == Ot.LIMIT_NUM and
-                 total_ask_orders_in_usd + new_sell_order_usd < self.orderBookMaxUSD):
-            if token_total_lend_usd + new_sell_order_usd < self.maxLendUSDForToken:
-                if wallet_total_lend_usd + new_sell_order_usd < self.maxLendUSDForAccount:
-                    new_sell_order_qty = new_sell_order_usd / last_price
-                    self.api_bot.send_order(
-                        self.this_market_id, self.is_floating_market, new_sell_order_type, Osi.LEND_NUM,
-                        new_sell_order_qty, new_sell_order_rate_level, self.quantityStep, self.priceStep,
-                        self.token + ' : ' + str(days_to_maturity))
-                else:
-                    logging.warning(f'maxLendUSDForAccount for breached\t\tDetails:\tmaxLendUSDForAccount '
-                                    + f'({self.maxLendUSDForAccount}) < wallet_total_lend_usd '
-                                    + f'({wallet_total_lend_usd}) + new_sell_order_usd ({new_sell_order_usd})')
-            else:
-                logging.warning(f'maxLendUSDForToken for breached\t\tDetails:\tmaxLendUSDForToken '
-                                + f'({self.maxLendUSDForToken}) < token_total_lend_usd '
-                                + f'({token_total_lend_usd}) + new_sell_order_usd ({new_sell_order_usd})')
-        else:
-            logging.warning(f'orderBookMaxUSD for breached\t\tDetails:\torderBookMaxUSD '
-                            + f'({self.orderBookMaxUSD}) < total_ask_orders_in_usd '
-                            + f'({total_ask_orders_in_usd}) + new_sell_order_usd ({new_sell_order_usd})')
+                    self.token, self.token_id, self.this_market_id, None if is_cached_only else self.floating_market_id)
+                if mid is None:
+                    logging.warning(f'No rate to quote {self.token} {self.tenor} from. Skipping')
+                    return None
+        return bid, ask, mid
 
     def send_new_orders(self):
         logging.info(
@@ -333,14 +301,80 @@ class TokenBot:
             + f'{self.tenor}\t'
             + f'qty: {self.orderSizeUSD}\t'
             + f'rate: {self.rateOffsetBPS}')
-        if self.tenor == 'FLOAT':
-            self.send_new_floating_orders()
-        else:  # FIXED
-            self.send_new_fixed_orders()
+        days_to_maturity = self.api_bot.maturity_calendar.get_n_days(self.tenor)
+        bid_ask_and_mid = self.get_bid_ask_and_mid(days_to_maturity)
+        if bid_ask_and_mid is not None:
+            self.send_new_quotes(*bid_ask_and_mid, days_to_maturity)
+
+    def remap_market(self):
+        token_id, floating_market_id, this_market_id, quantity_step, price_step = \
+            self.api_bot.get_token_id_and_relevant_market_id_etc(self.token, self.tenor)
+        with self.market_lock:
+            if this_market_id != self.this_market_id:
+                logging.info(f'{self.bot_name} {self.token} {self.tenor} re-mapped from market '
+                             + f'{self.this_market_id} to {this_market_id}')
+            self.token_id, self.floating_market_id, self.this_market_id, self.quantityStep, self.priceStep = \
+                token_id, floating_market_id, this_market_id, quantity_step, price_step
+            if self.subscription_id is not None:
+                self.unsubscribe_from_changes()
+                self.subscribe_to_changes(self.wake_callback)
+
+    def run_one_iteration(self):
+        # Fair queuing per bot, also on the pool threads shared by async TokenBots
+        with self.api_bot.rate_budget.as_client(self.get_client_id()), self.market_lock:
+            self.market_snapshot = self.api_bot.get_market_snapshot()  # All market data for this iteration
+            if self.quoteToleranceTicks is None:  # With quote diffing, stale orders are cancelled in send_new_orders
+                self.cancel_current_orders()
+                self.market_snapshot = self.api_bot.get_market_snapshot()  # Without the orders just cancelled
+            self.send_new_orders()
 
     def start_bot(self):
-        sleep(self.startDelayMinute)  # Delay start
-        while True:  # Loop
-            self.cancel_current_orders()
-            self.send_new_orders()
-            sleep(1.0 / float(self.botSpeed))
+        self.stop_bot_event.wait(self.startDelayMinute)  # Delay start
+        wake_event = Event()
+        if self.wakeOnUpdates:
+            self.subscribe_to_changes(wake_event.set)
+        try:
+            while not self.stop_bot_event.is_set():  # Loop
+                start_time = time.monotonic()
+                wake_event.clear()
+                self.run_one_iteration()
+                if self.wakeOnUpdates:
+                    self.stop_bot_event.wait(max(0.0, 1.0 / float(self.botSpeed) - (time.monotonic() - start_time)))
+                    wake_event.wait(self.maxIdleSeconds)
+                else:
+                    self.stop_bot_event.wait(1.0 / float(self.botSpeed))
+        finally:
+            self.unsubscribe_from_changes()
+        logging.info(f'Stopped {self.bot_name} {self.token} {self.tenor}')
+
+    async def start_bot_async(self, bot_loop, stop_event=None):
+        # stop_event: asyncio.Event set on bot_loop along with self.stop_bot_event, so that waits end straight away
+        stop_event = stop_event if stop_event is not None else asyncio.Event()
+        await bot_loop.wait_for(stop_event, self.startDelayMinute)  # Delay start
+        wake_event = asyncio.Event()
+        if self.wakeOnUpdates:  # Notified on whichever thread changed the data, so hand over to the event loop
+            self.subscribe_to_changes(lambda: bot_loop.loop.call_soon_threadsafe(wake_event.set))
+        try:
+            while not self.stop_bot_event.is_set():  # Loop
+                start_time = time.monotonic()
+                wake_event.clear()
+                await bot_loop.run_in_executor(self.run_one_iteration)
+                if self.wakeOnUpdates:
+                    await bot_loop.wait_for(
+                        stop_event, max(0.0, 1.0 / float(self.botSpeed) - (time.monotonic() - start_time)))
+                    await bot_loop.wait_for(wake_event, self.maxIdleSeconds)
+                else:
+                    await bot_loop.wait_for(stop_event, 1.0 / float(self.botSpeed))
+        finally:
+            self.unsubscribe_from_changes()
+        logging.info(f'Stopped {self.bot_name} {self.token} {self.tenor}')
+
+    def subscribe_to_changes(self, wake_callback):
+        self.wake_callback = wake_callback
+        self.subscription_id = self.api_bot.change_notifier.subscribe(
+            [Cn.get_token_key(self.token_id), Cn.get_market_key(self.this_market_id)], wake_callback)
+
+    def unsubscribe_from_changes(self):
+        if self.subscription_id is not None:
+            self.api_bot.change_notifier.unsubscribe(self.subscription_id)
+            self.subscription_id = None
@@ -0,0 +1,3 @@
+READ = 'read'  # Market data, wallet & order queries
+SEND = 'send'  # New orders
+CANCEL = 'cancel'  # Order cancellations
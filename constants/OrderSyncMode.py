@@ -0,0 +1,2 @@
+FULL = 'full'  # Re-fetch every order in the wallet's history on each refresh
+INCREMENTAL = 'incremental'  # Only page back to the oldest known open order, and fetch known ones not listed by id
@@ -0,0 +1,4 @@
+THREAD = 'thread'  # One OS thread per TokenBot (default)
+ASYNC = 'async'  # All TokenBots as coroutines on a single asyncio event loop
+CENTRAL = 'central'  # All TokenBots quoted together each tick by one QuoteEngine
+SHARDED = 'sharded'  # Bots spread over worker processes, each run in shard_bot_run_mode (see ShardCoordinator)
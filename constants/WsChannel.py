@@ -0,0 +1,7 @@
+# Channels streamed by the Infinity WebSocket feed. Each incoming message is expected to look like
+#   {"channel": <channel>, "data": <payload>}
+# where the payload has the same shape as the matching REST response.
+PRICES = 'prices'  # List of tokens, as in get_token_details()['tokens']
+BID_ASK = 'bidAsk'  # {'tokenId': ..., 'ir': {...}, 'fr': [...]}, as in get_current_best_bid_ask_by_token_id
+FLOATING_ORDERS = 'floatingOrders'  # List of the wallet's floating rate orders
+FIXED_ORDERS = 'fixedOrders'  # List of the wallet's fixed rate orders
@@ -1,5 +1,8 @@
 from bots import InfinityApiBot as Inf
+from bots import KillSwitch as Ks
 from bots import ParentBot as Bot
+from bots import ShardCoordinator as Sc
+from constants import RunMode as Rm
 import logging
 from misc import MiscHelperFunctions as Mhf
 
@@ -21,13 +24,21 @@ if __name__ == '__main__':
     if not cancel_orders:
         logging.warning('*** CANCELLING ORDERS CURRENTLY DISABLED. PLS RE-ENABLE. ***')
 
-    api_bot = Inf.InfinityApiBot(verify, send_orders, cancel_orders)
+    is_sharded = cfg.get('bot_run_mode', Rm.THREAD) == Rm.SHARDED  # Bots in worker processes, fed from this one
+    rate_budget_buckets = Sc.create_rate_budget_buckets(cfg) if is_sharded else None  # Shared with the shards
+    api_bot = Inf.InfinityApiBot(verify, send_orders, cancel_orders, True, rate_budget_buckets)
     api_bot.start_bot()
+    if cfg.get('market_data_bus_path'):  # Prices, bid/ask & markets for other local processes (MarketDataBusReader)
+        api_bot.start_market_data_bus(cfg['market_data_bus_path'])
 
-    bots = []  # For storing bots on own threads
     enabled_bot_names = Mhf.get_list_of_enabled_bots()   # Trading bots
-    for bot_name in enabled_bot_names:
-        bots.append(Bot.ParentBot(bot_name, api_bot, False))
+    if is_sharded:
+        bots = [Sc.ShardCoordinator(api_bot, enabled_bot_names, verify, send_orders, cancel_orders)]
+    else:
+        bots = Bot.create_parent_bots(enabled_bot_names, api_bot)  # For storing bots on own threads
+
+    kill_switch = Ks.KillSwitch(api_bot, bots)  # Ctrl-C / SIGTERM stops all bots and cancels all orders
+    kill_switch.install_signal_handlers()
 
     for bot in bots:
         pass
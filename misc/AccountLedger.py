@@ -0,0 +1,72 @@
+import logging
+import multiprocessing
+import numpy as np
+import time
+
+
+class AccountLedger:
+
+    # maxBorrowUSDForAccount / maxLendUSDForAccount checks shared by shard processes (see ShardCoordinator). Each shard
+    # sees the wallet's orders through the feed, but only some time after they are sent, so every order sent by any
+    # shard is also recorded here with the time it was sent. A shard counts the recorded orders sent after its feed's
+    # orders data was taken (set_orders_as_of_time), as only those are missing from its wallet totals. Orders the feed
+    # has reported are therefore never counted twice, and are only ever dropped that way. If a shard's feed has not
+    # reported an order ttl_seconds after it was sent, the feed is taken to have stalled and no more orders are allowed
+    # until it catches up, rather than that order's exposure being forgotten.
+
+    def __init__(self, n_shards, ttl_seconds=60.0, context=None, max_orders=1024):
+        context = context if context is not None else multiprocessing.get_context()
+        self.n_shards = n_shards
+        self.ttl_seconds = ttl_seconds
+        self.lock = context.Lock()
+        # Ring buffer of the orders sent: time, side index (0 borrow, 1 lend) and USD of each
+        self.order_times = context.Array('d', max_orders, lock=False)
+        self.order_side_indexes = context.Array('b', max_orders, lock=False)
+        self.order_usds = context.Array('d', max_orders, lock=False)
+        self.next_order_index = context.Value('i', 0, lock=False)
+        self.orders_as_of_times = context.Array('d', n_shards, lock=False)  # Shard i: time its feed's orders were taken
+        self.shard_index = None  # Set in each shard process
+
+    def get_pending_usd(self, side_index):
+        # Called with self.lock held. Views made on each call, as the arrays are re-created in each shard process.
+        is_pending = (np.frombuffer(self.order_times) > self.orders_as_of_times[self.shard_index]) \
+            & (np.frombuffer(self.order_side_indexes, dtype=np.int8) == side_index)
+        return float(np.frombuffer(self.order_usds)[is_pending].sum())
+
+    def get_oldest_pending_time(self):
+        # Called with self.lock held. Time the oldest order not yet reported by this shard's feed was sent, or None.
+        order_times = np.frombuffer(self.order_times)
+        pending_order_times = order_times[order_times > self.orders_as_of_times[self.shard_index]]
+        return float(pending_order_times.min()) if len(pending_order_times) > 0 else None
+
+    def reserve(self, is_borrow, order_usd, wallet_total_usd, max_usd_for_account):
+        # Returns (True if the order is within the account limit and has been recorded, wallet total counted)
+        side_index = 0 if is_borrow else 1
+        with self.lock:
+            now = time.time()  # Not monotonic, which is per process on some platforms
+            wallet_total_usd = wallet_total_usd + self.get_pending_usd(side_index)
+            oldest_pending_time = self.get_oldest_pending_time()
+            if oldest_pending_time is not None and now - oldest_pending_time > self.ttl_seconds:
+                logging.warning(f'Account ledger: shard {self.shard_index} feed has not reported an order sent '
+                                + f'{now - oldest_pending_time:.1f}s ago. No new orders until it does')
+                return False, wallet_total_usd
+            if wallet_total_usd + order_usd >= max_usd_for_account:
+                return False, wallet_total_usd
+            i = self.next_order_index.value
+            if self.order_times[i] > min(self.orders_as_of_times):
+                logging.warning('Account ledger full of orders not yet reported by every shard feed. No new orders '
+                                + f'until they are. Raise shard_account_ledger_max_orders ({len(self.order_times)})')
+                return False, wallet_total_usd
+            self.order_times[i] = now
+            self.order_side_indexes[i] = side_index
+            self.order_usds[i] = order_usd
+            self.next_order_index.value = (i + 1) % len(self.order_times)
+            return True, wallet_total_usd
+
+    def set_orders_as_of_time(self, as_of_time):
+        # Called once this shard's feed has applied the wallet's orders as taken at as_of_time (time.time())
+        with self.lock:
+            self.orders_as_of_times[self.shard_index] = max(self.orders_as_of_times[self.shard_index], as_of_time)
+
+    def set_shard_index(self, shard_index):
+        self.shard_index = shard_index
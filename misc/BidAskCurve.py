@@ -0,0 +1,61 @@
+import bisect
+import numpy as np
+
+RATE_GAP = 0.0001  # Spread assumed, and minimum rate, when only one side of a fixed market is quoted
+
+
+class BidAskCurve:
+
+    # Best bid/ask snapshot of one token, as returned by get_current_best_bid_ask_by_token_id, with the fixed rate
+    # markets held as arrays sorted by days to maturity. Missing sides are filled in for all tenors at once when the
+    # curve is built, so a lookup is just a bisect.
+
+    def __init__(self, bid_ask):
+        self.bid_ask = bid_ask
+        floating_bid_ask = bid_ask.get('ir', {}) if bid_ask else {}
+        self.floating_bid = float(floating_bid_ask['bid']) if 'bid' in floating_bid_ask else np.nan
+        self.floating_ask = float(floating_bid_ask['ask']) if 'ask' in floating_bid_ask else np.nan
+
+        fixed_bid_asks = sorted(bid_ask.get('fr', []) if bid_ask else [], key=lambda fr: fr['daysToMaturity'])
+        self.days_to_maturity = [int(fr['daysToMaturity']) for fr in fixed_bid_asks]
+        quoted_bids = np.array([float(fr['bid']) if 'bid' in fr else np.nan for fr in fixed_bid_asks], dtype=float)
+        quoted_asks = np.array([float(fr['ask']) if 'ask' in fr else np.nan for fr in fixed_bid_asks], dtype=float)
+        has_bid = ~np.isnan(quoted_bids)
+        has_ask = ~np.isnan(quoted_asks)
+        self.bids = np.where(
+            has_bid, quoted_bids, np.where(has_ask, np.maximum(quoted_asks - RATE_GAP, RATE_GAP), self.floating_bid))
+        self.asks = np.where(has_ask, quoted_asks, np.where(has_bid, quoted_bids + RATE_GAP, self.floating_ask))
+        self.bid_list = self.bids.tolist()  # Python floats are quicker to index one at a time
+        self.ask_list = self.asks.tolist()
+
+        # Mid (or the one quoted side) of each tenor with an actual quote, ignoring the gap filling above
+        has_quote = has_bid | has_ask
+        self.quoted_days_to_maturity = np.asarray(self.days_to_maturity, dtype=float)[has_quote]
+        self.quoted_mids = np.where(
+            has_bid & has_ask, (quoted_bids + quoted_asks) / 2, np.where(has_bid, quoted_bids, quoted_asks))[has_quote]
+
+    def get_fixed_bid_ask(self, days_to_maturity):
+        i = bisect.bisect_left(self.days_to_maturity, days_to_maturity)
+        if i == len(self.days_to_maturity) or self.days_to_maturity[i] != days_to_maturity:
+            return None, None
+        return none_if_nan(self.bid_list[i]), none_if_nan(self.ask_list[i])
+
+    def get_floating_bid_ask(self):
+        return none_if_nan(self.floating_bid), none_if_nan(self.floating_ask)
+
+    def get_floating_mid(self):
+        if np.isnan(self.floating_bid) or np.isnan(self.floating_ask):
+            return None
+        return (self.floating_bid + self.floating_ask) / 2
+
+    def is_empty(self):
+        return not self.bid_ask
+
+    def is_same_data(self, bid_ask):
+        return bid_ask == self.bid_ask
+
+
+def none_if_nan(rate):
+    if rate != rate:  # NaN
+        return None
+    return float(rate)
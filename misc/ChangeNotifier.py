@@ -0,0 +1,97 @@
+from threading import Lock
+
+
+def get_market_key(market_id):
+    return 'market', market_id
+
+
+def get_token_key(token_id):
+    return 'token', token_id
+
+
+class ChangeNotifier:
+
+    # Tells subscribers (TokenBots) when market data they quote from has changed: a token's price or bid/ask curve
+    # (get_token_key) or the wallet's orders in a market (get_market_key, via OrderStore.add_listener). Changes are
+    # marked as they happen and only notified once InfinityApiBot has published a snapshot with them (see
+    # InfinityApiBot.publish_market_snapshot). Callbacks are called on the thread that notifies, so must only signal
+    # the subscriber (e.g. set an Event). A subscriber's own cancels (ignore_removals) do not notify that subscriber,
+    # so that a TokenBot is not woken by its own loop.
+
+    def __init__(self):
+        self.lock = Lock()
+        self.callbacks_by_key = {}  # key -> {subscription id: callback}
+        self.keys_by_subscription_id = {}
+        self.next_subscription_id = 1
+        self.changed_keys = {}  # key -> subscription ids that made every change to it since last taken
+        self.ignored_removals = {}  # order id -> subscription id cancelling it
+
+    def ignore_removals(self, order_ids, subscription_id):
+        with self.lock:
+            for order_id in order_ids:
+                self.ignored_removals[order_id] = subscription_id
+
+    def mark_changed(self, keys, excluded_subscription_id=None):
+        # Keys changed only by excluded_subscription_id do not notify that subscriber
+        excluded_subscription_ids = {excluded_subscription_id} if excluded_subscription_id is not None else set()
+        with self.lock:
+            for key in keys:
+                if key in self.changed_keys:
+                    self.changed_keys[key] &= excluded_subscription_ids
+                else:
+                    self.changed_keys[key] = set(excluded_subscription_ids)
+
+    def notify(self, changed_keys):
+        # changed_keys: as returned by take_changed_keys
+        with self.lock:
+            callbacks = {}
+            for key, excluded_subscription_ids in changed_keys.items():
+                for subscription_id, callback in self.callbacks_by_key.get(key, {}).items():
+                    if subscription_id not in excluded_subscription_ids:
+                        callbacks[subscription_id] = callback
+        for callback in callbacks.values():
+            callback()
+
+    def notify_all(self):
+        with self.lock:
+            callbacks = {}
+            for callbacks_by_subscription_id in self.callbacks_by_key.values():
+                callbacks.update(callbacks_by_subscription_id)
+        for callback in callbacks.values():
+            callback()
+
+    def on_order_added(self, order):
+        self.mark_changed([get_market_key(order['marketId'])])
+
+    def on_order_removed(self, order):
+        with self.lock:
+            excluded_subscription_id = self.ignored_removals.get(order['orderId'])
+        self.mark_changed([get_market_key(order['marketId'])], excluded_subscription_id)
+
+    def stop_ignoring_removals(self, order_ids):
+        with self.lock:
+            for order_id in order_ids:
+                self.ignored_removals.pop(order_id, None)
+
+    def take_changed_keys(self):
+        # Called just before a snapshot is built, so that snapshot has every change marked up to this point
+        with self.lock:
+            changed_keys = self.changed_keys
+            self.changed_keys = {}
+            return changed_keys
+
+    def subscribe(self, keys, callback):
+        with self.lock:
+            subscription_id = self.next_subscription_id
+            self.next_subscription_id = self.next_subscription_id + 1
+            self.keys_by_subscription_id[subscription_id] = list(keys)
+            for key in keys:
+                self.callbacks_by_key.setdefault(key, {})[subscription_id] = callback
+            return subscription_id
+
+    def unsubscribe(self, subscription_id):
+        with self.lock:
+            for key in self.keys_by_subscription_id.pop(subscription_id, []):
+                del self.callbacks_by_key[key][subscription_id]
+                if len(self.callbacks_by_key[key]) == 0:
+                    del self.callbacks_by_key[key]
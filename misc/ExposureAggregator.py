@@ -0,0 +1,95 @@
+from constants import OrderSide as Osi
+from constants import Token
+from threading import Lock
+
+
+def get_borrow_usd(borrow_quantity, price):
+    return max(0.0, borrow_quantity) * price + borrow_quantity * price
+
+
+def get_lend_usd(lend_quantity, price):
+    return - min(0.0, lend_quantity) * price + lend_quantity * price
+
+
+class ExposureAggregator:
+
+    # Borrow/lend USD totals per token and for the whole wallet, kept up to date as orders are added to or removed
+    # from the active order stores (see OrderStore.add_listener) and as prices change, so that limit checks are O(1).
+
+    def __init__(self, token_id_resolver):
+        self.lock = Lock()
+        self.token_id_resolver = token_id_resolver  # order -> token id
+        self.orders_by_id = {}  # orderId -> (token id, side, quantity) as counted, so removals undo exactly that
+        self.borrow_quantities_by_token_id = {}
+        self.lend_quantities_by_token_id = {}
+        self.prices_by_token_id = {}  # ERC20 tokens only
+        self.borrow_usd_by_token_id = {}
+        self.lend_usd_by_token_id = {}
+        self.wallet_borrow_usd = 0.0
+        self.wallet_lend_usd = 0.0
+
+    def get_exposures(self, token_id):
+        with self.lock:
+            return self.borrow_usd_by_token_id.get(token_id, 0.0), self.lend_usd_by_token_id.get(token_id, 0.0), \
+                self.wallet_borrow_usd, self.wallet_lend_usd
+
+    def on_order_added(self, order):
+        token_id = self.token_id_resolver(order)
+        if token_id is None:
+            return
+        quantity = float(order['quantity'])
+        with self.lock:
+            self.orders_by_id[order['orderId']] = (token_id, order['side'], quantity)
+            self.update_quantity(token_id, order['side'], quantity)
+
+    def on_order_removed(self, order):
+        with self.lock:
+            counted_order = self.orders_by_id.pop(order['orderId'], None)
+            if counted_order is not None:
+                token_id, side, quantity = counted_order
+                self.update_quantity(token_id, side, -quantity)
+
+    def reconcile(self, token_ids, compute_from_scratch, tolerance=1e-6):
+        # compute_from_scratch(token_id) -> (token borrow usd, token lend usd, wallet borrow usd, wallet lend usd)
+        differences = {}
+        for token_id in token_ids:
+            expected = compute_from_scratch(token_id)
+            actual = self.get_exposures(token_id)
+            if any(abs(e - a) > tolerance * max(1.0, abs(e)) for e, a in zip(expected, actual)):
+                differences[token_id] = {'expected': expected, 'actual': actual}
+        return differences
+
+    def reset_wallet_totals(self):
+        # Re-sum the per token totals, dropping any accumulated floating point error
+        with self.lock:
+            self.wallet_borrow_usd = sum(self.borrow_usd_by_token_id.values())
+            self.wallet_lend_usd = sum(self.lend_usd_by_token_id.values())
+
+    def update_prices(self, floating_tokens_and_prices):
+        with self.lock:
+            for token_id in floating_tokens_and_prices:
+                token = floating_tokens_and_prices[token_id]
+                if token['tokenType'] != Token.TOKEN_TYPE_ERC20:
+                    continue
+                price = float(token['price'])
+                if self.prices_by_token_id.get(token_id) != price:
+                    self.prices_by_token_id[token_id] = price
+                    self.update_token_totals(token_id)
+
+    def update_quantity(self, token_id, side, quantity_change):  # Lock must be held
+        if side == Osi.BORROW:
+            self.borrow_quantities_by_token_id[token_id] = \
+                self.borrow_quantities_by_token_id.get(token_id, 0.0) + quantity_change
+        else:
+            self.lend_quantities_by_token_id[token_id] = \
+                self.lend_quantities_by_token_id.get(token_id, 0.0) + quantity_change
+        self.update_token_totals(token_id)
+
+    def update_token_totals(self, token_id):  # Lock must be held
+        price = self.prices_by_token_id.get(token_id, 0.0)
+        borrow_usd = get_borrow_usd(self.borrow_quantities_by_token_id.get(token_id, 0.0), price)
+        lend_usd = get_lend_usd(self.lend_quantities_by_token_id.get(token_id, 0.0), price)
+        self.wallet_borrow_usd = self.wallet_borrow_usd + borrow_usd - self.borrow_usd_by_token_id.get(token_id, 0.0)
+        self.wallet_lend_usd = self.wallet_lend_usd + lend_usd - self.lend_usd_by_token_id.get(token_id, 0.0)
+        self.borrow_usd_by_token_id[token_id] = borrow_usd
+        self.lend_usd_by_token_id[token_id] = lend_usd
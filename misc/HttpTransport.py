@@ -0,0 +1,90 @@
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from threading import Lock
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+def find_session(client):
+    # The REST client keeps its requests.Session as an attribute. Returns None if it has none.
+    for value in vars(client).values():
+        if isinstance(value, requests.Session):
+            return value
+    return None
+
+
+class HttpTransport(HTTPAdapter):
+
+    # Keep-alive connection pool shared by every thread using the session it is mounted on, with a default timeout
+    # for requests sent without one and counts of connections opened (TCP + TLS handshake) vs requests sent.
+
+    def __init__(self, pool_maxsize=10, timeout_seconds=10.0):
+        self.timeout_seconds = timeout_seconds
+        self.stats_lock = Lock()
+        self.n_requests = 0
+        self.n_new_connections = 0
+        self.n_errors = 0
+        super().__init__(pool_connections=4, pool_maxsize=pool_maxsize, pool_block=True)
+
+    def attach(self, session):
+        session.mount('https://', self)
+        session.mount('http://', self)
+
+    def count_new_connection(self):
+        with self.stats_lock:
+            self.n_new_connections = self.n_new_connections + 1
+
+    def get_pool_maxsize(self):
+        return self._pool_maxsize
+
+    def get_stats(self):
+        with self.stats_lock:
+            return {'pool_maxsize': self._pool_maxsize,
+                    'requests': self.n_requests,
+                    'new_connections': self.n_new_connections,
+                    'reused_connections': max(0, self.n_requests - self.n_new_connections),
+                    'errors': self.n_errors}
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        transport = self
+
+        class CountingHTTPConnectionPool(HTTPConnectionPool):
+            def _new_conn(self):
+                transport.count_new_connection()
+                return super()._new_conn()
+
+        class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+            def _new_conn(self):
+                transport.count_new_connection()
+                return super()._new_conn()
+
+        # Own dict, as the pool manager's default is shared module state
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool, 'https': CountingHTTPSConnectionPool}
+
+    def log_stats(self):
+        stats = self.get_stats()
+        logging.info(f"HTTP transport:\tpool size {stats['pool_maxsize']}\trequests {stats['requests']}\t"
+                     + f"new connections {stats['new_connections']}\treused {stats['reused_connections']}\t"
+                     + f"errors {stats['errors']}")
+
+    def resize(self, pool_maxsize):
+        # Pools are sized when created, so existing (idle) connections are dropped and re-opened on demand
+        if pool_maxsize != self._pool_maxsize:
+            logging.info(f'Resizing HTTP connection pool from {self._pool_maxsize} to {pool_maxsize}')
+            self.poolmanager.clear()
+            self.init_poolmanager(self._pool_connections, pool_maxsize, self._pool_block)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if timeout is None:
+            timeout = self.timeout_seconds
+        try:
+            response = super().send(request, stream, timeout, verify, cert, proxies)
+        except Exception:
+            with self.stats_lock:
+                self.n_errors = self.n_errors + 1
+            raise
+        with self.stats_lock:
+            self.n_requests = self.n_requests + 1
+        return response
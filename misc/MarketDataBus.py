@@ -0,0 +1,273 @@
+import logging
+import mmap
+import numpy as np
+import os
+import time
+
+MAGIC = b'IMDB'
+LAYOUT_VERSION = 1
+CODE_LENGTH = 16  # Bytes, token codes longer than this are cut
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'),
+    ('layoutVersion', '<u4'),
+    ('maxTokens', '<u4'),
+    ('maxTenors', '<u4'),
+    ('maxMarkets', '<u4'),
+    ('nTokens', '<u4'),
+    ('nMarkets', '<u4'),
+    ('padding', '<u4'),
+    ('sequence', '<u8'),  # Seqlock: odd while the writer is updating the region
+    ('version', '<u8'),  # MarketSnapshot version published
+    ('publishTime', '<f8'),  # time.time() of the publish
+])
+MARKET_DTYPE = np.dtype([
+    ('marketId', '<i8'),
+    ('tokenId', '<i8'),
+    ('isFloating', '<u1'),
+    ('daysToMaturity', '<i4'),
+    ('priceStep', '<f8'),
+    ('quantityStep', '<f8'),
+])
+
+
+def get_token_dtype(max_tenors):
+    # Missing rates are NaN. Fixed bids & asks are those of BidAskCurve, i.e. with one-sided tenors already filled in.
+    return np.dtype([
+        ('tokenId', '<i8'),
+        ('code', f'S{CODE_LENGTH}'),
+        ('price', '<f8'),
+        ('floatingBid', '<f8'),
+        ('floatingAsk', '<f8'),
+        ('nTenors', '<u4'),
+        ('daysToMaturity', '<i4', (max_tenors,)),
+        ('fixedBids', '<f8', (max_tenors,)),
+        ('fixedAsks', '<f8', (max_tenors,)),
+    ])
+
+
+def get_region_size(max_tokens, max_tenors, max_markets):
+    return (HEADER_DTYPE.itemsize + max_tokens * get_token_dtype(max_tenors).itemsize
+            + max_markets * MARKET_DTYPE.itemsize)
+
+
+def get_views(buffer, max_tokens, max_tenors, max_markets):
+    # Structured arrays mapped straight onto the region: header, token records, then market records
+    token_dtype = get_token_dtype(max_tenors)
+    header = np.frombuffer(buffer, HEADER_DTYPE, 1, 0)
+    tokens = np.frombuffer(buffer, token_dtype, max_tokens, HEADER_DTYPE.itemsize)
+    markets = np.frombuffer(buffer, MARKET_DTYPE, max_markets, HEADER_DTYPE.itemsize + tokens.nbytes)
+    return header, tokens, markets
+
+
+class MarketDataBus:
+
+    # Publishes InfinityApiBot's prices, best bid/ask curves and market metadata into a memory-mapped file (e.g. under
+    # /dev/shm) with the fixed binary layout above, so that any local process can read them with MarketDataBusReader
+    # instead of polling the REST API itself. There must be a single writer: InfinityApiBot publishes with its
+    # market_snapshot_lock held. Readers never lock, but retry if the sequence number was odd or changed while reading.
+
+    def __init__(self, path, max_tokens=64, max_tenors=32, max_markets=1024):
+        self.path = path
+        self.max_tokens = max_tokens
+        self.max_tenors = max_tenors
+        self.max_markets = max_markets
+        size = get_region_size(max_tokens, max_tenors, max_markets)
+        # A new, zeroed region in a new file, swapped in at path once its header is written. Readers still attached to
+        # an older one keep their mapping of it, which is never truncated under them, and must re-attach.
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.truncate(size)
+        fd = os.open(temp_path, os.O_RDWR)
+        try:
+            self.mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.header, self.tokens, self.markets = get_views(self.mmap, max_tokens, max_tenors, max_markets)
+        self.header['layoutVersion'] = LAYOUT_VERSION
+        self.header['maxTokens'] = max_tokens
+        self.header['maxTenors'] = max_tenors
+        self.header['maxMarkets'] = max_markets
+        self.header['magic'] = MAGIC
+        os.replace(temp_path, path)
+        self.market_registry = None
+        self.has_warned_capacity = False
+        logging.info(f'Market data bus at {path} ({size} bytes)')
+
+    def get_market_records(self, market_registry):
+        # Markets whose metadata cannot be converted are left out, rather than failing every publish until rollover
+        records = []
+        for market in market_registry.markets_by_market_id.values():
+            try:
+                records.append((
+                    int(market['marketId']), int(market_registry.get_token_id_from_market_id(market['marketId'])),
+                    market_registry.is_floating_market_id(market['marketId']), int(market.get('daysToMaturity', 0)),
+                    float(market['priceStep']), float(market['quantityStep'])))
+            except Exception as e:
+                logging.warning(f'Error {e} - Cannot publish market {market.get("marketId")} on market data bus')
+        return np.array(records[:self.max_markets], MARKET_DTYPE)
+
+    def get_token_records(self, market_snapshot):
+        token_records = np.zeros(min(len(market_snapshot.floating_tokens_and_prices), self.max_tokens),
+                                 self.tokens.dtype)
+        for record, (token_id, token) in zip(token_records, market_snapshot.floating_tokens_and_prices.items()):
+            set_token_record(record, token_id, token, market_snapshot.bid_ask_curves.get(token_id), self.max_tenors)
+        return token_records
+
+    def publish(self, market_snapshot):
+        market_registry = market_snapshot.market_registry
+        self.warn_if_over_capacity(market_snapshot)
+        # Everything converted first, so that nothing can fail while the region is being written
+        token_records = self.get_token_records(market_snapshot)
+        market_records = None
+        if market_registry is not self.market_registry:  # Market metadata only changes with the registry
+            market_records = self.get_market_records(market_registry) if market_registry is not None \
+                else np.zeros(0, MARKET_DTYPE)
+
+        self.header['sequence'] += 1  # Odd: being written
+        try:
+            self.tokens[:len(token_records)] = token_records
+            self.header['nTokens'] = len(token_records)
+            if market_records is not None:
+                self.markets[:len(market_records)] = market_records
+                self.header['nMarkets'] = len(market_records)
+                self.market_registry = market_registry
+            self.header['version'] = market_snapshot.version
+            self.header['publishTime'] = time.time()
+        finally:
+            self.header['sequence'] += 1  # Even: consistent again, even if this publish failed part way
+
+    def stop_bus(self):
+        self.mmap.close()
+
+    def warn_if_over_capacity(self, market_snapshot):
+        if self.has_warned_capacity:
+            return
+        n_tokens = len(market_snapshot.floating_tokens_and_prices)
+        n_markets = 0
+        if market_snapshot.market_registry is not None:
+            n_markets = len(market_snapshot.market_registry.markets_by_market_id)
+        max_n_tenors = max([len(bid_ask_curve.days_to_maturity)
+                            for bid_ask_curve in market_snapshot.bid_ask_curves.values()], default=0)
+        if n_tokens > self.max_tokens or n_markets > self.max_markets or max_n_tenors > self.max_tenors:
+            logging.warning(f'Market data bus too small for {n_tokens} tokens, {n_markets} markets & '
+                            + f'{max_n_tenors} tenors. Only the first {self.max_tokens}, {self.max_markets} & '
+                            + f'{self.max_tenors} are published')
+            self.has_warned_capacity = True
+
+
+def set_token_record(record, token_id, token, bid_ask_curve, max_tenors):
+    record['tokenId'] = token_id
+    record['code'] = token['code'].encode()[:CODE_LENGTH]
+    record['price'] = float(token['price'])
+    if bid_ask_curve is None:
+        record['floatingBid'] = np.nan
+        record['floatingAsk'] = np.nan
+        record['nTenors'] = 0
+        return
+    record['floatingBid'] = bid_ask_curve.floating_bid
+    record['floatingAsk'] = bid_ask_curve.floating_ask
+    n_tenors = min(len(bid_ask_curve.days_to_maturity), max_tenors)
+    record['daysToMaturity'][:n_tenors] = bid_ask_curve.days_to_maturity[:n_tenors]
+    record['fixedBids'][:n_tenors] = bid_ask_curve.bids[:n_tenors]
+    record['fixedAsks'][:n_tenors] = bid_ask_curve.asks[:n_tenors]
+    record['nTenors'] = n_tenors
+
+
+class MarketDataBusReader:
+
+    # Attaches to a MarketDataBus from any local process. Lookups read the shared region in place (no copy, no lock)
+    # and are retried until they did not overlap a publish, so they always see the data of one single snapshot. A read
+    # still overlapping publishes after timeout_seconds raises, as the writer has then stopped mid-publish.
+
+    def __init__(self, path, retry_sleep_seconds=0.0, timeout_seconds=1.0):
+        self.path = path
+        self.retry_sleep_seconds = retry_sleep_seconds
+        self.timeout_seconds = timeout_seconds
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = np.frombuffer(self.mmap, HEADER_DTYPE, 1, 0)[0]
+        if header['magic'] != MAGIC or header['layoutVersion'] != LAYOUT_VERSION:
+            raise Exception(f"{path} is not a market data bus with layout version {LAYOUT_VERSION}, "
+                            + f"or is not initialised yet (magic {header['magic']})")
+        self.header, self.tokens, self.markets = get_views(
+            self.mmap, int(header['maxTokens']), int(header['maxTenors']), int(header['maxMarkets']))
+
+    def get_best_bid_ask(self, token_id, is_floating_market, days_to_maturity=0):
+        # Same as MarketSnapshot.get_best_bid_ask
+        def read():
+            record = self.get_token_record(token_id)
+            if record is None:
+                return None, None
+            if is_floating_market:
+                return none_if_nan(record['floatingBid']), none_if_nan(record['floatingAsk'])
+            n_tenors = record['nTenors']
+            i = np.searchsorted(record['daysToMaturity'][:n_tenors], days_to_maturity)
+            if i == n_tenors or record['daysToMaturity'][i] != days_to_maturity:
+                return None, None
+            return none_if_nan(record['fixedBids'][i]), none_if_nan(record['fixedAsks'][i])
+        return self.read_consistently(read)
+
+    def get_last_price(self, token_id):
+        def read():
+            record = self.get_token_record(token_id)
+            return None if record is None else float(record['price'])
+        return self.read_consistently(read)
+
+    def get_market(self, market_id):
+        # Returns {marketId, tokenId, isFloating, daysToMaturity, priceStep, quantityStep}, or None if not published
+        def read():
+            markets = self.markets[:self.header['nMarkets'][0]]
+            i = np.flatnonzero(markets['marketId'] == market_id)
+            if len(i) == 0:
+                return None
+            market = markets[i[0]]
+            return {'marketId': int(market['marketId']), 'tokenId': int(market['tokenId']),
+                    'isFloating': bool(market['isFloating']), 'daysToMaturity': int(market['daysToMaturity']),
+                    'priceStep': float(market['priceStep']), 'quantityStep': float(market['quantityStep'])}
+        return self.read_consistently(read)
+
+    def get_snapshot(self):
+        # Copies of (header, token records, market records) of one publish, as NumPy structured arrays
+        def read():
+            header = self.header[0].copy()
+            return header, self.tokens[:header['nTokens']].copy(), self.markets[:header['nMarkets']].copy()
+        return self.read_consistently(read)
+
+    def get_token_record(self, token_id):
+        tokens = self.tokens[:self.header['nTokens'][0]]
+        i = np.flatnonzero(tokens['tokenId'] == token_id)
+        return tokens[i[0]] if len(i) > 0 else None
+
+    def get_version(self):
+        # Version of the MarketSnapshot last published, 0 if none yet. Cheap enough to poll for changes.
+        return int(self.read_consistently(lambda: self.header['version'][0]))
+
+    def read_consistently(self, read):
+        deadline = None
+        while True:
+            sequence = self.header['sequence'][0]
+            if sequence % 2 == 0:
+                try:
+                    result = read()
+                except (IndexError, ValueError):
+                    if self.header['sequence'][0] == sequence:
+                        raise
+                    result = None  # Read half written counts. Retried below.
+                if self.header['sequence'][0] == sequence:
+                    return result
+            if deadline is None:
+                deadline = time.monotonic() + self.timeout_seconds
+            elif time.monotonic() > deadline:
+                raise Exception(f'Market data bus {self.path} still being written after {self.timeout_seconds}s '
+                                + f'(sequence {sequence}). Has its writer stopped?')
+            time.sleep(self.retry_sleep_seconds)  # 0 just yields to the writer
+
+    def stop_reader(self):
+        self.mmap.close()
+
+
+def none_if_nan(rate):
+    if rate != rate:  # NaN
+        return None
+    return float(rate)
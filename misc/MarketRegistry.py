@@ -0,0 +1,47 @@
+class MarketRegistry:
+
+    # Hash indexes over the market data held by InfinityApiBot. Never modified once built: InfinityApiBot builds a new
+    # registry whenever the underlying market data changes and swaps it in with a single assignment.
+
+    def __init__(self, floating_markets, floating_tokens_and_prices, fixed_markets):
+        self.token_ids_by_code = {}
+        self.token_ids_by_market_id = {}
+        self.markets_by_market_id = {}
+        self.floating_markets_by_token_id = {}
+        self.fixed_markets_by_token_id_and_days_to_maturity = {}
+        self.floating_market_ids = set()
+
+        if floating_tokens_and_prices is not None:
+            for token_id in floating_tokens_and_prices:
+                self.token_ids_by_code[floating_tokens_and_prices[token_id]['code']] = token_id
+        if floating_markets is not None:
+            for token_id in floating_markets:
+                market = floating_markets[token_id]
+                self.floating_markets_by_token_id[token_id] = market
+                self.token_ids_by_market_id[market['marketId']] = token_id
+                self.markets_by_market_id[market['marketId']] = market
+                self.floating_market_ids.add(market['marketId'])
+        if fixed_markets is not None:
+            for token_id in fixed_markets:
+                for market in fixed_markets[token_id]:
+                    self.fixed_markets_by_token_id_and_days_to_maturity[(token_id, market['daysToMaturity'])] = market
+                    self.token_ids_by_market_id[market['marketId']] = token_id
+                    self.markets_by_market_id[market['marketId']] = market
+
+    def get_fixed_market(self, token_id, days_to_maturity):
+        return self.fixed_markets_by_token_id_and_days_to_maturity.get((token_id, days_to_maturity))
+
+    def get_floating_market(self, token_id):
+        return self.floating_markets_by_token_id.get(token_id)
+
+    def get_market(self, market_id):
+        return self.markets_by_market_id.get(market_id)
+
+    def get_token_id(self, code):
+        return self.token_ids_by_code.get(code)
+
+    def get_token_id_from_market_id(self, market_id):
+        return self.token_ids_by_market_id.get(market_id)
+
+    def is_floating_market_id(self, market_id):
+        return market_id in self.floating_market_ids
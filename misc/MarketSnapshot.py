@@ -0,0 +1,43 @@
+import logging
+
+
+class MarketSnapshot:
+
+    # Consistent, read-only view of InfinityApiBot's market data at one point in time: prices, best bid/ask curves,
+    # active orders and market metadata. Never modified once built. InfinityApiBot builds a new snapshot whenever any
+    # of these change and swaps it in with a single assignment (see InfinityApiBot.publish_market_snapshot), so a
+    # TokenBot can take one snapshot per iteration and read it without locking.
+
+    def __init__(self, version, market_registry, floating_tokens_and_prices, bid_ask_curves, active_floating_orders,
+                 active_fixed_orders):
+        self.version = version
+        self.market_registry = market_registry
+        self.floating_tokens_and_prices = floating_tokens_and_prices
+        self.bid_ask_curves = bid_ask_curves
+        self.active_floating_orders = active_floating_orders  # OrderStoreView
+        self.active_fixed_orders = active_fixed_orders  # OrderStoreView
+
+    def get_best_bid_ask(self, token_id, is_floating_market, days_to_maturity=0):
+        bid_ask_curve = self.bid_ask_curves.get(token_id)
+        if bid_ask_curve is None or bid_ask_curve.is_empty():
+            return None, None
+        if is_floating_market:
+            return bid_ask_curve.get_floating_bid_ask()
+        bid, ask = bid_ask_curve.get_fixed_bid_ask(days_to_maturity)
+        if bid is None or ask is None:
+            logging.error(
+                f'Error - No best bid & ask for token id {token_id} with days to maturity ({days_to_maturity}).')
+        return bid, ask
+
+    def get_bid_n_ask_orders(self, market_id, is_floating_market):
+        if is_floating_market:
+            return self.active_floating_orders.get_bid_n_ask_orders(market_id)
+        return self.active_fixed_orders.get_bid_n_ask_orders(market_id)
+
+    def get_last_price(self, token_id):
+        return float(self.floating_tokens_and_prices[token_id]['price'])
+
+    def get_total_orders_in_usd(self, market_id, is_floating_market, side, price):
+        if is_floating_market:
+            return self.active_floating_orders.get_quantity(market_id, side) * price
+        return self.active_fixed_orders.get_quantity(market_id, side) * price
@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta, timezone
+from misc import MiscHelperFunctions as Mhf
+import numpy as np
+from threading import Lock
+
+
+# Vectorised versions of MiscHelperFunctions.convert_tenor_to_date / convert_tenor_to_n_days, for generating
+# schedules over many dates at once (e.g. for backtests). Benchmark dates are the UTC dates of the rollovers that
+# the tenors are quoted from, i.e. what convert_tenor_to_date calls benchmark_date.
+
+def get_weekdays(dates):
+    return (dates.astype('datetime64[D]').astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday. Monday = 0
+
+
+def get_last_fridays_of_months(months):
+    last_dates_of_months = (months.astype('datetime64[M]') + 1).astype('datetime64[D]') - 1
+    return last_dates_of_months - (get_weekdays(last_dates_of_months) - 4) % 7
+
+
+def get_maturity_dates(tenor, benchmark_dates):
+    tenor = tenor.upper()
+    benchmark_dates = np.asarray(benchmark_dates, dtype='datetime64[D]')
+
+    if tenor == 'FLOAT':
+        return benchmark_dates.copy()
+
+    if not tenor[0:-1].isnumeric():
+        raise Exception(f'Tenor {tenor} is wrong format. Left character should be number.')
+
+    n = int(tenor[0:-1])
+    months = benchmark_dates.astype('datetime64[M]')
+
+    match tenor[-1]:
+        case 'D':
+            return benchmark_dates + n
+        case 'W':
+            closest_fridays = benchmark_dates + (4 - get_weekdays(benchmark_dates)) % 7
+            return closest_fridays + 7 * (n - 1)
+        case 'M':
+            month_offsets = (benchmark_dates > get_last_fridays_of_months(months)).astype(np.int64)
+            return get_last_fridays_of_months(months + month_offsets + (n - 1))
+        case 'Q':
+            month_numbers = months.astype(np.int64) % 12 + 1
+            year_offsets = (month_numbers == 12).astype(np.int64)
+            target_month_numbers = (month_numbers + 2) // 3 * 3
+            target_months = months + 12 * year_offsets + (target_month_numbers - month_numbers)
+            return get_last_fridays_of_months(target_months + 3 * (n - 1))
+        case _:
+            raise Exception(f'Date code {tenor} is wrong format. Right character should be D, W, M, Q only.')
+
+
+def get_n_days_to_maturity(tenor, benchmark_dates):
+    benchmark_dates = np.asarray(benchmark_dates, dtype='datetime64[D]')
+    return (get_maturity_dates(tenor, benchmark_dates) - benchmark_dates).astype(np.int64)
+
+
+def get_maturity_schedule(tenors, start_date, end_date):
+    # For every rollover date in [start_date, end_date): maturity date & days to maturity of each tenor
+    benchmark_dates = np.arange(np.datetime64(start_date, 'D'), np.datetime64(end_date, 'D'))
+    schedule = {'dates': benchmark_dates}
+    for tenor in tenors:
+        maturity_dates = get_maturity_dates(tenor, benchmark_dates)
+        schedule[tenor] = (maturity_dates, (maturity_dates - benchmark_dates).astype(np.int64))
+    return schedule
+
+
+class MaturityCalendar:
+
+    def __init__(self, tenors=None):
+        self.lock = Lock()
+        self.tenors = set()
+        self.dates_by_tenor = {}
+        self.n_days_by_tenor = {}
+        self.valid_from = None
+        self.valid_until = None
+        if tenors is not None:
+            self.add_tenors(tenors)
+
+    def add_tenors(self, tenors):
+        with self.lock:
+            self.tenors.update(tenor.upper() for tenor in tenors)
+            self.valid_until = None  # Force a recompute
+
+    def get_date(self, tenor):
+        return self.get_dates_and_n_days(tenor)[0]
+
+    def get_dates_and_n_days(self, tenor):
+        tenor = tenor.upper()
+        curr_utc_date_and_time = datetime.now(timezone.utc)
+        if self.valid_until is None or not self.valid_from <= curr_utc_date_and_time < self.valid_until \
+                or tenor not in self.dates_by_tenor:
+            self.refresh(tenor)
+        return self.dates_by_tenor[tenor], self.n_days_by_tenor[tenor]
+
+    def get_n_days(self, tenor):
+        return self.get_dates_and_n_days(tenor)[1]
+
+    def refresh(self, new_tenor=None):
+        with self.lock:
+            if new_tenor is not None:
+                self.tenors.add(new_tenor)
+            valid_from = Mhf.get_last_rollover_datetime()
+            valid_until = valid_from + timedelta(days=1)
+            # Computed for a time within the period rather than the current time, so a refresh straddling the
+            # rollover cannot mix the two periods
+            curr_utc_date_and_time = valid_from + timedelta(hours=12)
+            dates_by_tenor = {}
+            n_days_by_tenor = {}
+            for tenor in self.tenors:
+                dates_by_tenor[tenor] = Mhf.convert_tenor_to_date(tenor, curr_utc_date_and_time)
+                n_days_by_tenor[tenor] = Mhf.convert_tenor_to_n_days(tenor, curr_utc_date_and_time)
+            self.dates_by_tenor, self.n_days_by_tenor = dates_by_tenor, n_days_by_tenor
+            self.valid_from, self.valid_until = valid_from, valid_until
@@ -92,10 +92,11 @@ def convert_tenor_to_date(tenor, curr_utc_date_and_time):
             raise Exception(f'Date code {tenor} is wrong format. Right character should be D, W, M, Q only.')
 
 
-def convert_tenor_to_n_days(tenor):
+def convert_tenor_to_n_days(tenor, curr_utc_date_and_time=None):
     if tenor == 'FLOAT':
         return 0
-    curr_utc_date_and_time = datetime.now(timezone.utc)
+    if curr_utc_date_and_time is None:
+        curr_utc_date_and_time = datetime.now(timezone.utc)
     tenor_date = convert_tenor_to_date(tenor, curr_utc_date_and_time)
     n_days_to_maturity = tenor_date - curr_utc_date_and_time.date()
     n_days_to_maturity = n_days_to_maturity.days
@@ -129,6 +130,16 @@ def get_last_friday_of_month(this_date):
     return last_friday_of_month
 
 
+def get_last_rollover_datetime():
+    current_utc_datetime = datetime.utcnow()
+    if current_utc_datetime.time() > time(Rot.HOUR, Rot.MINUTE, Rot.SECOND):
+        date_to_use = current_utc_datetime.date()
+    else:
+        date_to_use = current_utc_datetime.date() - timedelta(days=1)
+    datetime_to_use = datetime.combine(date_to_use, time(Rot.HOUR, Rot.MINUTE, Rot.SECOND))
+    return datetime_to_use.replace(tzinfo=timezone.utc)
+
+
 def get_list_of_enabled_bots():
     with open(CFG_PATH_FILENAME, 'r') as ymlFile:
         cfg = yaml.safe_load(ymlFile)
@@ -167,6 +178,10 @@ def get_logging_level(logging_level):
             raise Exception(f'Cannot recognize logging level {logging_level}')
 
 
+def get_next_rollover_datetime():
+    return get_last_rollover_datetime() + timedelta(days=1)
+
+
 def get_token_id_from_market_id_and_markets(market_id, markets):
     for token_id in markets:
         if markets[token_id]['marketId'] == market_id:
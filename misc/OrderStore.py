@@ -0,0 +1,157 @@
+from constants import OrderSide as Osi
+from threading import RLock
+
+
+class OrderStoreView:
+
+    # Immutable copy of an OrderStore (see OrderStore.get_frozen_view), safe to read from any thread without locking.
+    # The order tuples of the (marketId, side) buckets that did not change are shared with the previous view.
+
+    def __init__(self, version, orders_by_market_and_side, quantities_by_market_and_side, n_orders):
+        self.version = version
+        self.orders_by_market_and_side = orders_by_market_and_side  # (marketId, side) -> tuple, newest first
+        self.quantities_by_market_and_side = quantities_by_market_and_side
+        self.n_orders = n_orders
+
+    def __len__(self):
+        return self.n_orders
+
+    def get_bid_n_ask_orders(self, market_id):
+        return self.get_orders(market_id, Osi.BORROW), self.get_orders(market_id, Osi.LEND)
+
+    def get_orders(self, market_id, side):
+        return self.orders_by_market_and_side.get((market_id, side), ())
+
+    def get_quantity(self, market_id, side):
+        return self.quantities_by_market_and_side.get((market_id, side), 0.0)
+
+
+class OrderStore:
+
+    def __init__(self, orders=None):
+        self.lock = RLock()
+        self.orders_by_id = {}
+        self.orders_by_market_and_side = {}  # (marketId, side) -> {orderId: order}
+        self.quantities_by_market_and_side = {}  # (marketId, side) -> total quantity on book
+        self.listeners = []  # Objects with on_order_added(order) & on_order_removed(order)
+        self.version = 0  # Bumped on every change, so get_frozen_view only copies the store after it has changed
+        self.frozen_view = None
+        self.changed_keys = set()  # (marketId, side) buckets changed since frozen_view was built
+        if orders is not None:
+            self.replace_all(orders)
+
+    def __contains__(self, order_id):
+        return order_id in self.orders_by_id
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.orders_by_id.values()))
+
+    def __len__(self):
+        return len(self.orders_by_id)
+
+    def add(self, order):
+        with self.lock:
+            if order['orderId'] in self.orders_by_id:
+                self.remove(order['orderId'])
+            if order['side'] != Osi.BORROW and order['side'] != Osi.LEND:
+                raise Exception(f"Unrecognized side {order['side']} for order {order['orderId']}")
+            key = (order['marketId'], order['side'])
+            self.orders_by_id[order['orderId']] = order
+            if key not in self.orders_by_market_and_side:
+                self.orders_by_market_and_side[key] = {}
+                self.quantities_by_market_and_side[key] = 0.0
+            self.orders_by_market_and_side[key][order['orderId']] = order
+            self.quantities_by_market_and_side[key] = self.quantities_by_market_and_side[key] + float(order['quantity'])
+            self.version = self.version + 1
+            self.changed_keys.add(key)
+            for listener in self.listeners:
+                listener.on_order_added(order)
+
+    def add_listener(self, listener):
+        with self.lock:
+            self.listeners.append(listener)
+            for order in self.orders_by_id.values():
+                listener.on_order_added(order)
+
+    def get_bid_n_ask_orders(self, market_id):
+        return self.get_orders(market_id, Osi.BORROW), self.get_orders(market_id, Osi.LEND)
+
+    def get_frozen_view(self):
+        # Read-only copy of the store as it is now. Once the store has changed, only the changed buckets are copied
+        # and sorted again.
+        with self.lock:
+            if self.frozen_view is not None and self.frozen_view.version == self.version:
+                return self.frozen_view
+            if self.frozen_view is None:
+                self.changed_keys = set(self.orders_by_market_and_side.keys())
+                orders_by_market_and_side = {}
+            else:
+                orders_by_market_and_side = dict(self.frozen_view.orders_by_market_and_side)
+            for key in self.changed_keys:
+                orders = self.orders_by_market_and_side.get(key)
+                if orders is None:
+                    orders_by_market_and_side.pop(key, None)
+                else:
+                    orders_by_market_and_side[key] = tuple(self.sort_orders(orders.values()))
+            self.changed_keys = set()
+            self.frozen_view = OrderStoreView(self.version, orders_by_market_and_side,
+                                              dict(self.quantities_by_market_and_side), len(self.orders_by_id))
+            return self.frozen_view
+
+    def get_order(self, order_id):
+        return self.orders_by_id.get(order_id)
+
+    def get_order_ids(self):
+        with self.lock:
+            return list(self.orders_by_id.keys())
+
+    def get_orders(self, market_id, side):
+        # Newest first, i.e. the same order as the REST API returns them
+        with self.lock:
+            orders = self.orders_by_market_and_side.get((market_id, side))
+            if orders is None:
+                return []
+            return self.sort_orders(orders.values())
+
+    def get_quantity(self, market_id, side):
+        return self.quantities_by_market_and_side.get((market_id, side), 0.0)
+
+    def remove(self, order_id):
+        with self.lock:
+            order = self.orders_by_id.pop(order_id, None)
+            if order is None:
+                return None
+            key = (order['marketId'], order['side'])
+            del self.orders_by_market_and_side[key][order_id]
+            if len(self.orders_by_market_and_side[key]) == 0:
+                del self.orders_by_market_and_side[key]
+                del self.quantities_by_market_and_side[key]  # Drop any accumulated float error with the last order
+            else:
+                self.quantities_by_market_and_side[key] = \
+                    self.quantities_by_market_and_side[key] - float(order['quantity'])
+            self.version = self.version + 1
+            self.changed_keys.add(key)
+            for listener in self.listeners:
+                listener.on_order_removed(order)
+            return order
+
+    def remove_many(self, order_ids):
+        with self.lock:
+            return [order for order in map(self.remove, order_ids) if order is not None]
+
+    def replace_all(self, orders):
+        with self.lock:
+            for order in list(self.orders_by_id.values()):
+                for listener in self.listeners:
+                    listener.on_order_removed(order)
+            self.changed_keys.update(self.orders_by_market_and_side.keys())
+            self.orders_by_id = {}
+            self.orders_by_market_and_side = {}
+            self.quantities_by_market_and_side = {}
+            self.version = self.version + 1
+            for order in orders:
+                self.add(order)
+
+    def sort_orders(self, orders):
+        return sorted(orders, key=lambda order: order['orderId'], reverse=True)
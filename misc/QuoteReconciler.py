@@ -0,0 +1,32 @@
+def get_n_ticks(value, step):
+    return round(float(value) / float(step))
+
+
+def reconcile_quotes(target_quotes, resting_orders, price_step, quantity_step, rate_tolerance_ticks=0,
+                     quantity_tolerance_ticks=0):
+    # Diffs the quotes we want on one side of a market against the orders already resting there.
+    # target_quotes: [(rate, qty, ...)], anything after qty (e.g. a ladder level) being passed through as is.
+    # resting_orders: order dicts as held in the OrderStore (price & quantity as strings).
+    # A resting order is kept if its rate and quantity, in price_step and quantity_step ticks, are within the given
+    # tolerances of a target quote's. Each resting order can satisfy at most one target quote (the closest in rate).
+    # Returns (orders_to_cancel, quotes_to_place).
+    unmatched_orders = list(resting_orders)
+    quotes_to_place = []
+    for quote in target_quotes:
+        rate, qty = quote[0], quote[1]
+        rate_ticks = get_n_ticks(rate, price_step)
+        qty_ticks = get_n_ticks(qty, quantity_step)
+        best_order = None
+        best_distance = None
+        for order in unmatched_orders:
+            if abs(get_n_ticks(order['quantity'], quantity_step) - qty_ticks) > quantity_tolerance_ticks:
+                continue
+            distance = abs(get_n_ticks(order['price'], price_step) - rate_ticks)
+            if distance <= rate_tolerance_ticks and (best_distance is None or distance < best_distance):
+                best_order = order
+                best_distance = distance
+        if best_order is None:
+            quotes_to_place.append(quote)
+        else:
+            unmatched_orders.remove(best_order)
+    return unmatched_orders, quotes_to_place
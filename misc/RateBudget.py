@@ -0,0 +1,214 @@
+from collections import deque
+from constants import EndpointClass as Ec
+from contextlib import contextmanager
+import logging
+import multiprocessing
+from threading import Condition, current_thread, local
+import time
+
+
+def create_buckets(rates_per_second_by_endpoint_class, bursts_by_endpoint_class=None, context=None):
+    # Token buckets for a RateBudget. Shared by processes (SharedTokenBucket) if a multiprocessing context is given.
+    bursts_by_endpoint_class = bursts_by_endpoint_class if bursts_by_endpoint_class is not None else {}
+    buckets = {}
+    for endpoint_class, rate_per_second in rates_per_second_by_endpoint_class.items():
+        if rate_per_second:
+            burst = bursts_by_endpoint_class.get(endpoint_class, max(1, rate_per_second))
+            if context is None:
+                buckets[endpoint_class] = TokenBucket(rate_per_second, burst)
+            else:
+                buckets[endpoint_class] = SharedTokenBucket(rate_per_second, burst, context)
+    return buckets
+
+
+def get_endpoint_class(method_name):
+    if method_name.startswith('create_'):
+        return Ec.SEND
+    if method_name.startswith('cancel_'):
+        return Ec.CANCEL
+    return Ec.READ
+
+
+class TokenBucket:
+
+    def __init__(self, rate_per_second, burst):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.n_tokens = float(burst)
+        self.last_refill_time = time.monotonic()
+
+    def get_seconds_until_token(self):
+        self.refill()
+        if self.n_tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.n_tokens) / self.rate_per_second
+
+    def refill(self):
+        now = time.monotonic()
+        self.n_tokens = min(float(self.burst), self.n_tokens + (now - self.last_refill_time) * self.rate_per_second)
+        self.last_refill_time = now
+
+    def try_take(self):
+        self.refill()
+        if self.n_tokens >= 1.0:
+            self.n_tokens = self.n_tokens - 1.0
+            return True
+        return False
+
+
+class SharedTokenBucket:
+
+    # TokenBucket shared by processes (see ShardCoordinator), so that a rate stays the budget of the whole wallet
+    # rather than of each process. Uses time.time(), as time.monotonic() is per process on some platforms.
+
+    def __init__(self, rate_per_second, burst, context=None):
+        context = context if context is not None else multiprocessing.get_context()
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.lock = context.Lock()
+        self.state = context.Array('d', [float(burst), time.time()], lock=False)  # Number of tokens, last refill time
+
+    def get_seconds_until_token(self):
+        with self.lock:
+            self.refill()
+            n_tokens = self.state[0]
+        if n_tokens >= 1.0:
+            return 0.0
+        return (1.0 - n_tokens) / self.rate_per_second
+
+    def refill(self):
+        # Called with self.lock held
+        now = time.time()
+        self.state[0] = min(float(self.burst), self.state[0] + max(0.0, now - self.state[1]) * self.rate_per_second)
+        self.state[1] = now
+
+    def try_take(self):
+        # Checks and takes in one step, as other processes may take the same token in between
+        with self.lock:
+            self.refill()
+            if self.state[0] >= 1.0:
+                self.state[0] = self.state[0] - 1.0
+                return True
+            return False
+
+
+class RateBudget:
+
+    # Shared request budget: one token bucket per endpoint class (see constants.EndpointClass). Callers queue per
+    # client id (one per TokenBot, see as_client) and are served round robin across clients, so a busy TokenBot
+    # cannot starve the others. An endpoint class without a rate is not limited, but its waits are still counted.
+    # buckets (see create_buckets), if given, are used instead of the rates & bursts, e.g. to share them by processes.
+
+    def __init__(self, rates_per_second_by_endpoint_class, bursts_by_endpoint_class=None, buckets=None):
+        self.condition = Condition()
+        if buckets is not None:
+            self.buckets = buckets
+        else:
+            self.buckets = create_buckets(rates_per_second_by_endpoint_class, bursts_by_endpoint_class)
+        self.queues = {}  # endpoint class -> {client id: deque of waiting tickets}
+        self.client_orders = {}  # endpoint class -> deque of client ids with waiting tickets, in round robin order
+        self.thread_local = local()
+        self.stats = {}  # endpoint class -> {'calls', 'waits', 'total_wait_seconds', 'max_wait_seconds'}
+        self.total_wait_seconds_by_client_id = {}
+
+    def acquire(self, endpoint_class):
+        bucket = self.buckets.get(endpoint_class)
+        if bucket is None:
+            self.record_wait(endpoint_class, self.get_client_id(), 0.0)
+            return
+        client_id = self.get_client_id()
+        start_time = time.monotonic()
+        with self.condition:
+            ticket = {'granted': False}
+            queues = self.queues.setdefault(endpoint_class, {})
+            if client_id not in queues:
+                queues[client_id] = deque()
+                self.client_orders.setdefault(endpoint_class, deque()).append(client_id)
+            queues[client_id].append(ticket)
+            while True:
+                self.grant(endpoint_class, bucket)
+                if ticket['granted']:
+                    break
+                self.condition.wait(max(0.001, bucket.get_seconds_until_token()))
+        self.record_wait(endpoint_class, client_id, time.monotonic() - start_time)
+
+    @contextmanager
+    def as_client(self, client_id):
+        # Calls made from this thread within the with block are queued under client_id (unchanged if None). The
+        # previous client id is restored afterwards, as pool threads are shared by all clients.
+        previous_client_id = getattr(self.thread_local, 'client_id', None)
+        if client_id is not None:
+            self.thread_local.client_id = client_id
+        try:
+            yield
+        finally:
+            self.thread_local.client_id = previous_client_id
+
+    def get_client_id(self):
+        return getattr(self.thread_local, 'client_id', None) or current_thread().name
+
+    def get_stats(self):
+        with self.condition:
+            return {endpoint_class: dict(stats) for endpoint_class, stats in self.stats.items()}
+
+    def get_wait_seconds_by_client_id(self):
+        with self.condition:
+            return dict(self.total_wait_seconds_by_client_id)
+
+    def grant(self, endpoint_class, bucket):
+        # Hands out as many tickets as there are tokens, taking the next client's oldest ticket each time
+        queues = self.queues[endpoint_class]
+        client_order = self.client_orders[endpoint_class]
+        n_granted = 0
+        while len(client_order) > 0 and bucket.try_take():
+            client_id = client_order.popleft()
+            queues[client_id].popleft()['granted'] = True
+            n_granted = n_granted + 1
+            if len(queues[client_id]) > 0:
+                client_order.append(client_id)
+            else:
+                del queues[client_id]
+        if n_granted > 0:
+            self.condition.notify_all()
+
+    def log_stats(self):
+        for endpoint_class, stats in self.get_stats().items():
+            mean_wait_seconds = stats['total_wait_seconds'] / stats['calls'] if stats['calls'] > 0 else 0.0
+            logging.info(f'Rate budget {endpoint_class}:\tcalls {stats["calls"]}\twaited {stats["waits"]}\t'
+                         + f'mean wait {mean_wait_seconds * 1000:.1f}ms\t'
+                         + f'max wait {stats["max_wait_seconds"] * 1000:.1f}ms')
+
+    def record_wait(self, endpoint_class, client_id, wait_seconds):
+        with self.condition:
+            stats = self.stats.setdefault(
+                endpoint_class, {'calls': 0, 'waits': 0, 'total_wait_seconds': 0.0, 'max_wait_seconds': 0.0})
+            stats['calls'] = stats['calls'] + 1
+            if wait_seconds > 0.001:
+                stats['waits'] = stats['waits'] + 1
+            stats['total_wait_seconds'] = stats['total_wait_seconds'] + wait_seconds
+            stats['max_wait_seconds'] = max(stats['max_wait_seconds'], wait_seconds)
+            self.total_wait_seconds_by_client_id[client_id] = \
+                self.total_wait_seconds_by_client_id.get(client_id, 0.0) + wait_seconds
+
+
+class RateLimitedClient:
+
+    # Wraps the REST client so every call goes through the rate budget first. Attributes are passed straight through.
+
+    def __init__(self, client, rate_budget):
+        object.__setattr__(self, 'client', client)
+        object.__setattr__(self, 'rate_budget', rate_budget)
+
+    def __getattr__(self, name):
+        value = getattr(self.client, name)
+        if not callable(value):
+            return value
+        endpoint_class = get_endpoint_class(name)
+
+        def call_within_budget(*args, **kwargs):
+            self.rate_budget.acquire(endpoint_class)
+            return value(*args, **kwargs)
+        return call_within_budget
+
+    def __setattr__(self, name, value):
+        setattr(self.client, name, value)
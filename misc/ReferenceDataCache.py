@@ -0,0 +1,53 @@
+import datetime as dt
+import json
+import logging
+import os
+
+
+# On-disk copy of the slow-to-fetch reference data (wallets, floating markets & tokens, fixed markets), so that a
+# restart within the same rollover period can start quoting straight away. JSON object keys are always strings, so
+# the token id keyed dicts are stored as lists and rebuilt on load.
+
+CACHE_VERSION = 1
+
+
+def load_reference_data(path_filename, rollover_datetime, wallet_address, domain):
+    if not os.path.isfile(path_filename):
+        return None
+    try:
+        with open(path_filename, 'r') as cache_file:
+            cache = json.load(cache_file)
+    except Exception as e:
+        logging.warning(f'Error {e} - Cannot read reference data cache {path_filename}')
+        return None
+    if cache.get('version') != CACHE_VERSION \
+            or cache.get('wallet_address') != wallet_address \
+            or cache.get('domain') != domain:
+        logging.info('Reference data cache is for a different wallet, domain or version. Ignoring it')
+        return None
+    if dt.datetime.fromisoformat(cache['rollover_datetime']) != rollover_datetime:
+        logging.info(f"Reference data cache is from before rollover ({cache['rollover_datetime']}). Ignoring it")
+        return None
+    return {
+        'wallets': cache['wallets'],
+        'floating_market_details': cache['floating_market_details'],
+        'fixed_markets': {token_id: markets for token_id, markets in cache['fixed_markets']}}
+
+
+def save_reference_data(path_filename, rollover_datetime, wallet_address, domain, wallets, floating_market_details,
+                        fixed_markets):
+    cache = {
+        'version': CACHE_VERSION,
+        'wallet_address': wallet_address,
+        'domain': domain,
+        'rollover_datetime': rollover_datetime.isoformat(),
+        'wallets': wallets,
+        'floating_market_details': floating_market_details,
+        'fixed_markets': [[token_id, markets] for token_id, markets in fixed_markets.items()]}
+    try:
+        # Write then rename, so a crash mid-write never leaves a truncated cache behind
+        with open(path_filename + '.tmp', 'w') as cache_file:
+            json.dump(cache, cache_file)
+        os.replace(path_filename + '.tmp', path_filename)
+    except Exception as e:
+        logging.warning(f'Error {e} - Cannot write reference data cache {path_filename}')
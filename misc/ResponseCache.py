@@ -0,0 +1,80 @@
+import logging
+from threading import Event, Lock
+from time import monotonic
+
+
+class InFlightRequest:
+
+    def __init__(self):
+        self.done = Event()
+        self.response = None
+        self.error = None
+
+
+class ResponseCache:
+
+    # Shared cache of REST responses with a time to live per endpoint. Concurrent requests for the same endpoint & key
+    # are coalesced: the first caller makes the HTTP call and everyone else waits for its response.
+
+    def __init__(self, ttl_seconds_by_endpoint=None, default_ttl_seconds=0.0):
+        self.lock = Lock()
+        self.ttl_seconds_by_endpoint = dict(ttl_seconds_by_endpoint or {})
+        self.default_ttl_seconds = default_ttl_seconds
+        self.entries = {}  # (endpoint, key) -> (expiry time, response)
+        self.in_flight_requests = {}  # (endpoint, key) -> InFlightRequest
+        self.stats = {}  # endpoint -> counters
+
+    def get(self, endpoint, key, fetch_response):
+        cache_key = (endpoint, key)
+        with self.lock:
+            stats = self.get_endpoint_stats(endpoint)
+            entry = self.entries.get(cache_key)
+            if entry is not None and entry[0] > monotonic():
+                stats['hits'] = stats['hits'] + 1
+                return entry[1]
+            in_flight_request = self.in_flight_requests.get(cache_key)
+            is_leader = in_flight_request is None
+            if is_leader:
+                in_flight_request = InFlightRequest()
+                self.in_flight_requests[cache_key] = in_flight_request
+                stats['misses'] = stats['misses'] + 1
+            else:
+                stats['coalesced'] = stats['coalesced'] + 1
+
+        if not is_leader:
+            in_flight_request.done.wait()
+            if in_flight_request.error is not None:
+                raise in_flight_request.error
+            return in_flight_request.response
+
+        try:
+            in_flight_request.response = fetch_response()
+        except Exception as e:
+            in_flight_request.error = e
+            with self.lock:
+                stats['errors'] = stats['errors'] + 1
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight_requests[cache_key]
+                ttl_seconds = self.ttl_seconds_by_endpoint.get(endpoint, self.default_ttl_seconds)
+                if in_flight_request.error is None and ttl_seconds > 0:
+                    self.entries[cache_key] = (monotonic() + ttl_seconds, in_flight_request.response)
+            in_flight_request.done.set()
+        return in_flight_request.response
+
+    def get_endpoint_stats(self, endpoint):  # Lock must be held
+        if endpoint not in self.stats:
+            self.stats[endpoint] = {'hits': 0, 'misses': 0, 'coalesced': 0, 'errors': 0}
+        return self.stats[endpoint]
+
+    def get_stats(self):
+        with self.lock:
+            return {endpoint: dict(stats) for endpoint, stats in self.stats.items()}
+
+    def log_stats(self):
+        for endpoint, stats in self.get_stats().items():
+            n_requests = stats['hits'] + stats['misses'] + stats['coalesced']
+            hit_rate = (stats['hits'] + stats['coalesced']) / n_requests if n_requests > 0 else 0.0
+            logging.info(f'Response cache {endpoint}:\thits {stats["hits"]}\tcoalesced {stats["coalesced"]}\t'
+                         + f'misses {stats["misses"]}\terrors {stats["errors"]}\thit rate {hit_rate:.1%}')
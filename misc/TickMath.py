@@ -0,0 +1,37 @@
+from decimal import Decimal
+import numpy as np
+
+
+# Rates and quantities as whole numbers of a market's priceStep / quantityStep (ticks). Rounding works on whole arrays
+# (e.g. every quote in a ladder at once) and ticks only become Decimals when an order is sent, so the wire value is
+# exactly ticks * step. Steps may be strings (as in market details), floats or Decimals.
+
+
+def from_ticks(ticks, step):
+    # As floats, e.g. for comparing with rates from the API
+    return np.asarray(ticks, dtype=np.int64) * np.asarray(step, dtype=float)
+
+
+def get_step_decimal(step):
+    # Via str, so a float step such as 0.0001 is exactly 0.0001 rather than its binary approximation
+    return step if isinstance(step, Decimal) else Decimal(str(step))
+
+
+def round_value(val, step):
+    # Same result as MiscHelperFunctions.round_value, but exact whatever the step type
+    return to_decimal(round(float(val) / float(step)), step)
+
+
+def to_decimal(tick, step):
+    return int(tick) * get_step_decimal(step)
+
+
+def to_decimals(ticks, step):
+    step_decimal = get_step_decimal(step)
+    return [int(tick) * step_decimal for tick in np.asarray(ticks).ravel()]
+
+
+def to_ticks(values, step):
+    # Nearest tick, halves to even (as round)
+    return np.rint(np.asarray(values, dtype=float) / np.asarray(step, dtype=float)).astype(np.int64)
+
@@ -0,0 +1,65 @@
+import bisect
+import math
+import numpy as np
+
+LINEAR = 'linear'  # Piecewise linear between observed points, flat beyond them
+NELSON_SIEGEL = 'nelson_siegel'  # Smooth Nelson-Siegel curve, least squares fitted with a fixed decay
+
+
+def get_nelson_siegel_factors(days_to_maturity, decay_days):
+    x = np.asarray(days_to_maturity, dtype=float) / decay_days
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope_factors = np.where(x > 0, (1 - np.exp(-x)) / x, 1.0)
+    curvature_factors = slope_factors - np.exp(-x)
+    return np.column_stack([np.ones_like(x), slope_factors, curvature_factors])
+
+
+class YieldCurve:
+
+    # Term structure of one token fitted to (days to maturity, rate) points: the floating rate at day 0 plus fixed
+    # rate mids and recent trades. Immutable once fitted.
+
+    def __init__(self, days_to_maturity, rates, fit_method=LINEAR, decay_days=90.0):
+        order = np.argsort(days_to_maturity, kind='stable')
+        self.days_to_maturity = np.asarray(days_to_maturity, dtype=float)[order]
+        self.rates = np.asarray(rates, dtype=float)[order]
+        self.fit_method = fit_method
+        self.decay_days = float(decay_days)
+        self.coefficients = None
+        if self.fit_method == NELSON_SIEGEL and len(self.days_to_maturity) >= 3:
+            self.coefficients, _, _, _ = np.linalg.lstsq(
+                get_nelson_siegel_factors(self.days_to_maturity, self.decay_days), self.rates, rcond=None)
+            self.coefficients = self.coefficients.tolist()
+        elif self.fit_method != LINEAR and self.fit_method != NELSON_SIEGEL:
+            raise Exception(f'Unrecognized yield curve fit method {self.fit_method}')
+        self.day_list = self.days_to_maturity.tolist()  # Python floats are quicker for one lookup at a time
+        self.rate_list = self.rates.tolist()
+
+    def get_rate(self, days_to_maturity):
+        if len(self.day_list) == 0:
+            return None
+        if self.coefficients is not None:
+            # Flat beyond the observed points, as for LINEAR, rather than trusting the fit's extrapolation
+            x = min(max(days_to_maturity, self.day_list[0]), self.day_list[-1]) / self.decay_days
+            slope_factor = (1 - math.exp(-x)) / x if x > 0 else 1.0
+            return self.coefficients[0] + self.coefficients[1] * slope_factor \
+                + self.coefficients[2] * (slope_factor - math.exp(-x))
+        i = bisect.bisect_left(self.day_list, days_to_maturity)
+        if i == 0:
+            return self.rate_list[0]
+        if i == len(self.day_list):
+            return self.rate_list[-1]
+        weight = (days_to_maturity - self.day_list[i - 1]) / (self.day_list[i] - self.day_list[i - 1])
+        return self.rate_list[i - 1] + weight * (self.rate_list[i] - self.rate_list[i - 1])
+
+    def get_rates(self, days_to_maturity):
+        days_to_maturity = np.asarray(days_to_maturity, dtype=float)
+        if len(self.day_list) == 0:
+            return np.full(days_to_maturity.shape, np.nan)
+        if self.coefficients is not None:
+            days_to_maturity = np.clip(days_to_maturity, self.day_list[0], self.day_list[-1])
+            return get_nelson_siegel_factors(days_to_maturity, self.decay_days) @ np.asarray(self.coefficients)
+        return np.interp(days_to_maturity, self.days_to_maturity, self.rates)
+
+    def is_empty(self):
+        return len(self.day_list) == 0
@@ -0,0 +1,115 @@
+from constants import OrderSide as Osi
+from constants import OrderStatus as Ost
+import datetime as dt
+from misc import MiscHelperFunctions as Mhf
+from threading import Lock
+
+TOKENS = [{'tokenId': 1, 'code': 'ETH', 'price': '2000', 'tokenType': 1},
+          {'tokenId': 2, 'code': 'USDC', 'price': '1', 'tokenType': 1}]
+FLOATING_MARKETS = [{'tokenId': 1, 'marketId': 11, 'code': 'ETH-SPOT', 'quantityStep': '0.01', 'priceStep': '0.0001'},
+                    {'tokenId': 2, 'marketId': 12, 'code': 'USDC-SPOT', 'quantityStep': '1', 'priceStep': '0.0001'}]
+FIXED_DAYS_TO_MATURITY = (1, 7, 30)
+
+
+def get_fixed_markets(token_id):
+    # Market ids token id * 100 + 1, 2, 3, maturing on the dates MaturityCalendar expects
+    now = dt.datetime.now(dt.timezone.utc)
+    fixed_markets = []
+    for i, days_to_maturity in enumerate(FIXED_DAYS_TO_MATURITY):
+        maturity_date = Mhf.convert_tenor_to_date(f'{days_to_maturity}D', now)
+        fixed_markets.append({
+            'marketId': token_id * 100 + i + 1, 'daysToMaturity': days_to_maturity, 'quantityStep': '0.01',
+            'priceStep': '0.0001',
+            'maturityDate': int(dt.datetime.combine(maturity_date, dt.time(), dt.timezone.utc).timestamp() * 1000)})
+    return fixed_markets
+
+
+class FakeInfinityRest:
+
+    # Stands in for infinity_exchange's rest_client.Client in tests: one trading wallet, the ETH & USDC markets above,
+    # and the wallet's floating & fixed orders held in memory. Order listing pages from the newest order back, as the
+    # API does, with sides as booleans (Osi.BORROW / Osi.LEND).
+
+    def __init__(self, **kwargs):
+        self.lock = Lock()
+        self.tokens = [dict(token) for token in TOKENS]
+        self.fixed_markets = {token['tokenId']: get_fixed_markets(token['tokenId']) for token in TOKENS}
+        self.floating_orders = []
+        self.fixed_orders = []
+        self.n_cancel_failures_by_order_id = {}  # Order id -> number of its next cancels that raise
+        self.n_ignored_cancels_by_order_id = {}  # Order id -> number of its next cancels that leave it on book
+        self.cancelled_order_ids = []
+        self.next_order_id = 1000
+
+    def add_order(self, is_floating_market, market_id, side, quantity, price, status=Ost.STATUS_ON_BOOK):
+        with self.lock:
+            self.next_order_id = self.next_order_id + 1
+            order = {'orderId': self.next_order_id, 'marketId': market_id, 'side': side, 'quantity': str(quantity),
+                     'price': str(price), 'status': status}
+            (self.floating_orders if is_floating_market else self.fixed_orders).append(order)
+            return order
+
+    def cancel_order(self, orders, order_id):
+        with self.lock:
+            if self.n_cancel_failures_by_order_id.get(order_id, 0) > 0:
+                self.n_cancel_failures_by_order_id[order_id] = self.n_cancel_failures_by_order_id[order_id] - 1
+                raise Exception(f'Cannot cancel order {order_id}')
+            if self.n_ignored_cancels_by_order_id.get(order_id, 0) > 0:
+                self.n_ignored_cancels_by_order_id[order_id] = self.n_ignored_cancels_by_order_id[order_id] - 1
+                return
+            for order in orders:
+                if order['orderId'] == order_id and order['status'] == Ost.STATUS_ON_BOOK:
+                    order['status'] = Ost.STATUS_MANUALLY_CANCELLED
+                    self.cancelled_order_ids.append(order_id)
+                    return
+            raise Exception(f'Order {order_id} not on book')
+
+    def cancel_fixed_rate_order_by_order_id(self, order_id):
+        self.cancel_order(self.fixed_orders, order_id)
+
+    def cancel_floating_rate_order_by_order_id(self, order_id):
+        self.cancel_order(self.floating_orders, order_id)
+
+    def create_fixed_rate_order(self, market_id, order_type, side, qty, deduplication, price):
+        return self.add_order(False, market_id, side == Osi.BORROW_NUM, qty, price)['orderId']
+
+    def create_floating_rate_order(self, market_id, order_type, side, qty, deduplication, price):
+        return self.add_order(True, market_id, side == Osi.BORROW_NUM, qty, price)['orderId']
+
+    def get_active_fixed_rate_markets_by_token_id(self, token_id):
+        return {'markets': self.fixed_markets[token_id]}
+
+    def get_current_best_bid_ask_by_token_id(self, token_id, days_to_maturity, min_bid_n_ask_size):
+        return {'ir': {'bid': '0.03', 'ask': '0.04'},
+                'fr': [{'daysToMaturity': days, 'bid': '0.045', 'ask': '0.055'} for days in FIXED_DAYS_TO_MATURITY]}
+
+    def get_floating_rate_market_details(self):
+        return {'markets': [dict(market) for market in FLOATING_MARKETS], 'tokens': self.get_token_details()['tokens']}
+
+    def get_floating_rate_market_details_by_market_id(self, market_id):
+        return {'market': {'price': '0.035'}}
+
+    def get_recent_fixed_rate_transactions_by_market_id(self, market_id, n_transactions):
+        return {'trxs': []}
+
+    def get_token_details(self):
+        return {'tokens': [dict(token) for token in self.tokens]}
+
+    def get_user_wallet_details(self):
+        return {'wallet': {'name': 'Trading', 'walletId': 7}}
+
+    def get_user_wallets(self):
+        return {'wallets': [{'name': 'Trading', 'walletId': 7}]}
+
+    def get_orders_page(self, orders, start_id, limit):
+        with self.lock:
+            orders = sorted(orders, key=lambda order: -order['orderId'])
+        if start_id:
+            orders = [order for order in orders if order['orderId'] <= start_id]
+        return [dict(order) for order in orders[:limit]]
+
+    def get_users_fixed_rate_orders(self, pending=True, start_id=0, limit=100):
+        return self.get_orders_page(self.fixed_orders, start_id, limit)
+
+    def get_users_floating_rate_orders(self, pending=True, start_id=0, limit=100):
+        return {'orders': self.get_orders_page(self.floating_orders, start_id, limit)}
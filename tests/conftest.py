@@ -0,0 +1,28 @@
+import os
+import pytest
+import sys
+
+sys.path[:0] = [os.path.dirname(os.path.dirname(os.path.abspath(__file__))), os.path.dirname(os.path.abspath(__file__))]
+
+CFG = {
+    'wallet_address': '0xabc',
+    'chainId': 1,
+    'user-agent': 'test',
+    'infinity_url': 'https://dev.infinity.test',
+    'env_path_filename': os.devnull,
+    'inf_api_bot_refresh_minutes': 1,
+}
+
+
+@pytest.fixture
+def api_bot(monkeypatch):
+    # InfinityApiBot as configured above, talking to a FakeInfinityRest (see api_bot.inf_rest.client)
+    rest_client = pytest.importorskip('infinity_exchange.rest_client.rest_client')
+    import FakeInfinityRest as Fir
+    from bots import InfinityApiBot as Inf
+    from misc import MiscHelperFunctions as Mhf
+    monkeypatch.setattr(rest_client, 'Client', Fir.FakeInfinityRest)
+    monkeypatch.setattr(Mhf, 'load_config_file_etc', lambda: dict(CFG))
+    api_bot = Inf.InfinityApiBot(True, update_active_orders=False)
+    api_bot.ok_to_update_active_orders = True
+    return api_bot
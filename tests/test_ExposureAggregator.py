@@ -0,0 +1,52 @@
+from constants import OrderSide as Osi
+import FakeInfinityRest as Fir
+import random
+
+TOKEN_IDS = [token['tokenId'] for token in Fir.TOKENS]
+
+
+def get_random_order(rng, order_id):
+    # (is floating market, order) in any of the fake's floating or fixed markets
+    token_id = rng.choice(TOKEN_IDS)
+    is_floating_market = rng.random() < 0.5
+    if is_floating_market:
+        market_id = next(market['marketId'] for market in Fir.FLOATING_MARKETS if market['tokenId'] == token_id)
+    else:
+        market_id = token_id * 100 + rng.randint(1, len(Fir.FIXED_DAYS_TO_MATURITY))
+    return is_floating_market, {'orderId': order_id, 'marketId': market_id, 'side': rng.choice([Osi.BORROW, Osi.LEND]),
+                                'quantity': str(round(rng.uniform(0.01, 50.0), 2)), 'price': '0.04', 'status': 1}
+
+
+def test_reconcile_finds_no_differences_after_random_changes(api_bot):
+    # Adds, removes and price updates go through the OrderStore listeners & update_prices, as from the API or feed.
+    # The running totals must always match a full recompute.
+    rng = random.Random(0)
+    next_order_id = 1
+    for step in range(2000):
+        action = rng.random()
+        order_ids = {True: api_bot.active_floating_orders.get_order_ids(),
+                     False: api_bot.active_fixed_orders.get_order_ids()}
+        if action < 0.45:
+            is_floating_market, order = get_random_order(rng, next_order_id)
+            next_order_id = next_order_id + 1
+            (api_bot.active_floating_orders if is_floating_market else api_bot.active_fixed_orders).add(order)
+        elif action < 0.55 and len(order_ids[True]) > 0:  # Same id again, e.g. a partial fill
+            _, order = get_random_order(rng, rng.choice(order_ids[True]))
+            order['marketId'] = api_bot.active_floating_orders.get_order(order['orderId'])['marketId']
+            api_bot.active_floating_orders.add(order)
+        elif action < 0.75:
+            is_floating_market = rng.random() < 0.5
+            if len(order_ids[is_floating_market]) > 0:
+                active_orders = api_bot.active_floating_orders if is_floating_market else api_bot.active_fixed_orders
+                active_orders.remove_many(rng.sample(order_ids[is_floating_market],
+                                                     rng.randint(1, len(order_ids[is_floating_market]))))
+        elif action < 0.97:
+            price = str(round(rng.uniform(0.5, 4000.0), 4))
+            api_bot.apply_price_updates([{'tokenId': rng.choice(TOKEN_IDS), 'price': price}])
+        else:  # Full sync
+            orders = list(api_bot.active_fixed_orders)
+            api_bot.active_fixed_orders.replace_all(rng.sample(orders, len(orders) // 2))
+        differences = api_bot.exposure_aggregator.reconcile(
+            TOKEN_IDS, api_bot.compute_current_positions_and_orders_in_usd)
+        assert differences == {}, f'step {step}'
+    assert len(api_bot.active_floating_orders) + len(api_bot.active_fixed_orders) > 0
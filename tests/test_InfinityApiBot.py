@@ -0,0 +1,42 @@
+from constants import OrderSide as Osi
+from constants import OrderStatus as Ost
+
+
+def count_order_listings(monkeypatch, inf_rest):
+    # Start ids of each floating orders page requested
+    start_ids = []
+    get_users_floating_rate_orders = inf_rest.get_users_floating_rate_orders
+
+    def counted(pending=True, start_id=0, limit=100):
+        start_ids.append(start_id)
+        return get_users_floating_rate_orders(pending, start_id, limit)
+    monkeypatch.setattr(inf_rest, 'get_users_floating_rate_orders', counted)
+    return start_ids
+
+
+def test_incremental_sync_pages_back_to_oldest_known_order_only(api_bot, monkeypatch):
+    inf_rest = api_bot.inf_rest.client
+    for i in range(5):  # History before the oldest order still on book
+        inf_rest.add_order(True, 11, Osi.BORROW, 1, '0.03', Ost.STATUS_MANUALLY_CANCELLED)
+    orders = [inf_rest.add_order(True, 11, Osi.BORROW, 1, '0.03') for i in range(150)]
+    assert api_bot.sync_active_orders(True, True)
+    orders[0]['status'] = Ost.STATUS_MANUALLY_CANCELLED
+    new_order = inf_rest.add_order(True, 12, Osi.LEND, 100, '0.04')
+    start_ids = count_order_listings(monkeypatch, inf_rest)
+
+    assert api_bot.sync_active_orders(True, False)
+    assert len(start_ids) == 2  # 151 orders newest first, down to orders[0] on the second page, and nothing by id
+    assert sorted(api_bot.active_floating_orders.get_order_ids()) == \
+        sorted([order['orderId'] for order in orders[1:]] + [new_order['orderId']])
+
+
+def test_incremental_sync_fetches_orders_no_longer_listed_by_id(api_bot, monkeypatch):
+    inf_rest = api_bot.inf_rest.client
+    orders = [inf_rest.add_order(True, 11, Osi.BORROW, 1, '0.03') for i in range(3)]
+    assert api_bot.sync_active_orders(True, True)
+    inf_rest.floating_orders.remove(orders[1])  # e.g. filled, and so no longer listed as pending
+    start_ids = count_order_listings(monkeypatch, inf_rest)
+
+    assert api_bot.sync_active_orders(True, False)
+    assert start_ids == [0, orders[1]['orderId']]
+    assert sorted(api_bot.active_floating_orders.get_order_ids()) == [orders[0]['orderId'], orders[2]['orderId']]
@@ -0,0 +1,75 @@
+from constants import OrderSide as Osi
+from constants import OrderStatus as Ost
+from constants import WsChannel as Wsc
+import json
+import pytest
+from threading import Event, Thread
+import time
+
+FRAMES = [
+    {'channel': Wsc.PRICES, 'data': [{'tokenId': 1, 'price': '2100'}]},
+    {'channel': Wsc.BID_ASK, 'data': {'tokenId': 1, 'ir': {'bid': '0.031', 'ask': '0.041'}, 'fr': []}},
+    {'channel': Wsc.FLOATING_ORDERS, 'data': [{'orderId': 5001, 'marketId': 11, 'side': Osi.LEND, 'quantity': '2',
+                                               'price': '0.04', 'status': Ost.STATUS_ON_BOOK}]},
+    {'channel': Wsc.FIXED_ORDERS, 'data': [{'orderId': 5002, 'marketId': 101, 'side': Osi.BORROW, 'quantity': '1',
+                                            'price': '0.045', 'status': Ost.STATUS_ON_BOOK}]}]
+
+
+def wait_until(condition, timeout_seconds=5.0):
+    end_time = time.monotonic() + timeout_seconds
+    while not condition():
+        if time.monotonic() > end_time:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class LocalWsServer:
+
+    # Sends FRAMES to the first client once it has subscribed, then drops the connection when drop_event is set
+
+    def __init__(self):
+        sync_server = pytest.importorskip('websockets.sync.server')
+        self.subscriptions = []
+        self.drop_event = Event()
+        self.server = sync_server.serve(self.handle, 'localhost', 0, close_timeout=1)
+        self.url = f'ws://localhost:{self.server.socket.getsockname()[1]}'
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def handle(self, connection):
+        self.subscriptions.append(json.loads(connection.recv(timeout=5)))
+        for frame in FRAMES:
+            connection.send(json.dumps(frame))
+        self.drop_event.wait(10)
+
+    def shutdown(self):
+        self.drop_event.set()
+        self.server.shutdown()
+
+
+def test_feed_updates_stores_then_falls_back_to_rest_on_disconnect(api_bot):
+    from bots import InfinityWsFeed as Iwf
+    server = LocalWsServer()
+    api_bot.ws_feed = Iwf.InfinityWsFeed(api_bot, server.url, reconnect_seconds=60, start_feed=True)
+    try:
+        assert wait_until(api_bot.ws_feed.is_connected)
+        assert server.subscriptions[0]['channels'] == [Wsc.PRICES, Wsc.BID_ASK, Wsc.FLOATING_ORDERS, Wsc.FIXED_ORDERS]
+        assert server.subscriptions[0]['walletId'] == 7
+        assert wait_until(lambda: api_bot.ws_feed.n_messages == len(FRAMES))
+        market_snapshot = api_bot.get_market_snapshot()
+        assert market_snapshot.get_last_price(1) == 2100.0
+        assert market_snapshot.get_best_bid_ask(1, True) == (0.031, 0.041)
+        assert market_snapshot.get_bid_n_ask_orders(11, True)[1][0]['orderId'] == 5001
+        assert market_snapshot.get_bid_n_ask_orders(101, False)[0][0]['orderId'] == 5002
+        api_bot.ws_feed_resync_needed = False
+        api_bot.refresh_now_event.clear()
+
+        server.drop_event.set()
+        assert wait_until(lambda: not api_bot.ws_feed.is_connected())
+        # InfinityApiBot.run_loop polls REST again straight away, until the feed has reconnected and resynced
+        assert api_bot.ws_feed_resync_needed
+        assert api_bot.refresh_now_event.is_set()
+    finally:
+        api_bot.ws_feed.stop_feed()
+        server.shutdown()
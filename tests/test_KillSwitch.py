@@ -0,0 +1,83 @@
+from constants import OrderSide as Osi
+from constants import OrderStatus as Ost
+
+
+class FakeParentBot:
+
+    # Records the calls KillSwitch makes, in order
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def stop_bot(self):
+        self.calls.append('stop_bot')
+
+    def wait_for_bot_to_stop(self):
+        self.calls.append('wait_for_bot_to_stop')
+
+
+def add_orders(inf_rest):
+    # Floating & fixed, borrow & lend, for both tokens
+    return [inf_rest.add_order(True, 11, Osi.BORROW, 1, '0.03'),
+            inf_rest.add_order(True, 12, Osi.LEND, 100, '0.04'),
+            inf_rest.add_order(False, 101, Osi.BORROW, 1, '0.045'),
+            inf_rest.add_order(False, 203, Osi.LEND, 100, '0.05')]
+
+
+def test_trigger_stops_bots_and_cancels_every_order(api_bot):
+    from bots import KillSwitch as Ks
+    inf_rest = api_bot.inf_rest.client
+    orders = add_orders(inf_rest)
+    api_bot.update_active_orders()
+    unknown_order = inf_rest.add_order(True, 11, Osi.LEND, 1, '0.04')  # Sent just before, not synced yet
+    failing_order = orders[2]
+    inf_rest.n_cancel_failures_by_order_id[failing_order['orderId']] = 1
+    calls = []
+    kill_switch = Ks.KillSwitch(api_bot, [FakeParentBot(calls), FakeParentBot(calls)])
+
+    assert kill_switch.trigger('test')
+    assert kill_switch.is_triggered()
+    assert calls == ['stop_bot', 'stop_bot', 'wait_for_bot_to_stop', 'wait_for_bot_to_stop']
+    assert not api_bot.send_orders
+    assert all(order['status'] == Ost.STATUS_MANUALLY_CANCELLED
+               for order in inf_rest.floating_orders + inf_rest.fixed_orders)
+    # Retried on the next attempt, together with the order only found by the sync after the first one
+    assert sorted(inf_rest.cancelled_order_ids[-2:]) == sorted([failing_order['orderId'], unknown_order['orderId']])
+    assert len(api_bot.active_floating_orders) + len(api_bot.active_fixed_orders) == 0
+    assert kill_switch.time_to_flat_seconds is not None and kill_switch.time_to_flat_seconds >= 0
+    assert kill_switch.trigger('again')  # Only once
+    assert len(calls) == 4
+
+
+def test_trigger_retries_orders_still_on_book_after_their_cancel(api_bot):
+    from bots import KillSwitch as Ks
+    inf_rest = api_bot.inf_rest.client
+    orders = add_orders(inf_rest)
+    api_bot.update_active_orders()
+    inf_rest.n_ignored_cancels_by_order_id[orders[1]['orderId']] = 1
+    assert api_bot.cancel_floating_order(orders[1]['orderId'])  # Acknowledged, but still on book
+    api_bot.sync_active_orders(True, True)
+    inf_rest.n_ignored_cancels_by_order_id[orders[2]['orderId']] = 1  # Same for the kill switch's own cancel
+    kill_switch = Ks.KillSwitch(api_bot)
+
+    assert kill_switch.trigger('test')
+    assert all(order['status'] == Ost.STATUS_MANUALLY_CANCELLED
+               for order in inf_rest.floating_orders + inf_rest.fixed_orders)
+    assert inf_rest.cancelled_order_ids.count(orders[1]['orderId']) == 1
+    assert inf_rest.cancelled_order_ids[-1] == orders[2]['orderId']
+    assert len(api_bot.active_floating_orders) + len(api_bot.active_fixed_orders) == 0
+
+
+def test_trigger_reports_not_flat_after_max_attempts(api_bot):
+    from bots import KillSwitch as Ks
+    inf_rest = api_bot.inf_rest.client
+    api_bot.cfg['kill_switch_max_attempts'] = 2
+    orders = add_orders(inf_rest)
+    api_bot.update_active_orders()
+    inf_rest.n_cancel_failures_by_order_id[orders[0]['orderId']] = 10
+    kill_switch = Ks.KillSwitch(api_bot)
+
+    assert not kill_switch.trigger('test')
+    assert kill_switch.time_to_flat_seconds is None
+    assert sorted(inf_rest.cancelled_order_ids) == sorted(order['orderId'] for order in orders[1:])
+    assert api_bot.active_floating_orders.get_order_ids() == [orders[0]['orderId']]
@@ -0,0 +1,19 @@
+from decimal import Decimal
+from misc import MiscHelperFunctions as Mhf
+from misc import TickMath as Tm
+import numpy as np
+
+VALUES = np.random.default_rng(0).uniform(0.0, 0.2, 10000)
+
+
+def test_batch_rounding_matches_round_value_for_string_steps():
+    # Whole array at once with to_ticks & to_decimals, rather than one value at a time
+    assert Tm.to_decimals(Tm.to_ticks(VALUES, '0.0001'), '0.0001') == \
+        [Mhf.round_value(value, '0.0001') for value in VALUES]
+
+
+def test_batch_rounding_is_exact_for_float_steps():
+    # MiscHelperFunctions.round_value would send the binary approximation of 0.0001 times the ticks instead
+    wire_values = Tm.to_decimals(Tm.to_ticks(VALUES, 0.0001), 0.0001)
+    assert wire_values == [Decimal('0.0001') * round(value / 0.0001) for value in VALUES]
+    assert wire_values == [Tm.round_value(value, 0.0001) for value in VALUES]